@@ -1,10 +1,20 @@
 import os
 import sys
 import json
-from flask import Flask, request, jsonify, send_from_directory
+import hashlib
+import time
+import uuid
+import itertools
+from collections import OrderedDict
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
+from conversion_pool import (ConversionCancelledError, ConversionProcessPool, ConversionTimeoutError,
+                             PoolSaturatedError, WorkerJobError)
+from conversion_profile import ConversionProfile, ConversionStats
+from service_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
 import traceback
-import webbrowser
 import threading
+# zipfile, tempfile and concurrent.futures (batch conversion) and webbrowser (__main__) are
+# imported where they are used, so importing the app stays fast.
 
 def get_base_path():
 
@@ -24,22 +34,39 @@ APP_BASE_DEFAULTS = {
     "Default_Node_Shape": "rectangle",
     "Add_Link_Labels": True,
     "App_Port": 5000,
+    "App_Server_Mode": "development",  # "production": see wsgi_server.py
+    "App_Threads": 8,  # Production: request threads per process
+    "App_Workers": 1,  # Production: processes (more than 1 needs gunicorn)
 }
 
 effective_default_config = APP_BASE_DEFAULTS.copy()
 
 # --- Import Core Functionality from Existing Script ---
 try:
-    from workflow_to_mermaid import workflow_to_mermaid, default_config as imported_mermaid_generator_defaults
-    import mermaid_styles
+    from workflow_to_mermaid import workflow_to_mermaid, config_fingerprint, parse_workflow_json, default_config as imported_mermaid_generator_defaults
+    from mermaid_styles import compile_config, parse_collapse_mode
+    from png_workflow import extract_workflow_from_png
+    from conversion_session import ConversionSession
     print("Successfully imported workflow_to_mermaid and mermaid_styles modules.")
     effective_default_config.update(imported_mermaid_generator_defaults)
     effective_default_config["App_Port"] = APP_BASE_DEFAULTS["App_Port"]
 except ImportError as e:
     print(f"Error: Could not import necessary modules: {e}")
     print("Please ensure app.py, workflow_to_mermaid.py, and mermaid_styles.py are in the same directory or accessible.")
-    def workflow_to_mermaid(workflow, config): # pylint: disable=unused-argument
+    def workflow_to_mermaid(workflow, config, profile=None): # pylint: disable=unused-argument
         raise RuntimeError("Core conversion module failed to load, cannot perform conversion.")
+    def config_fingerprint(config):
+        return hashlib.sha1(repr(config).encode('utf-8')).hexdigest()
+    def compile_config(config):
+        return config
+    def parse_collapse_mode(value):
+        return value if isinstance(value, bool) else None
+    parse_workflow_json = json.loads
+    def extract_workflow_from_png(source): # pylint: disable=unused-argument
+        raise RuntimeError("PNG workflow module failed to load, cannot read PNG workflows.")
+    class ConversionSession:
+        def __init__(self, config): # pylint: disable=unused-argument
+            raise RuntimeError("Core conversion module failed to load, cannot perform conversion.")
 
 # --- Flask Application Setup ---
 STATIC_FOLDER_PATH = os.path.join(BASE_DIR, 'static')
@@ -81,8 +108,37 @@ def get_server_startup_config():
         print(f"Config file '{MERMAID_CONFIG_PATH}' not found. Using default port {default_port_value}.")
     return current_port
 
+# --- Helper Function: Load Server Mode Settings ---
+# Returns {"mode", "threads", "workers"} from App_Server_Mode, App_Threads and App_Workers.
+def get_server_mode_config():
+    settings = {"mode": APP_BASE_DEFAULTS["App_Server_Mode"], "threads": APP_BASE_DEFAULTS["App_Threads"],
+                "workers": APP_BASE_DEFAULTS["App_Workers"]}
+    user_config = {}
+    if os.path.exists(MERMAID_CONFIG_PATH):
+        try:
+            with open(MERMAID_CONFIG_PATH, 'r', encoding='utf-8') as f:
+                user_config = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read server settings from '{MERMAID_CONFIG_PATH}': {e}. Using defaults.")
+    mode = user_config.get("App_Server_Mode")
+    if mode is not None:
+        if str(mode).lower() in ('development', 'production'):
+            settings["mode"] = str(mode).lower()
+        else:
+            print(f"Warning: 'App_Server_Mode' must be 'development' or 'production', not '{mode}'. Using '{settings['mode']}'.")
+    for key, setting in (("App_Threads", "threads"), ("App_Workers", "workers")):
+        value = user_config.get(key)
+        if value is None:
+            continue
+        try:
+            if int(value) < 1: raise ValueError
+            settings[setting] = int(value)
+        except (TypeError, ValueError):
+            print(f"Warning: '{key}' must be a positive integer, not '{value}'. Using {settings[setting]}.")
+    return settings
+
 # --- Helper Function: Load Mermaid UI Configuration ---
-def load_mermaid_config():
+def _read_mermaid_config():
     config = effective_default_config.copy()
     if os.path.exists(MERMAID_CONFIG_PATH):
         try:
@@ -100,23 +156,108 @@ def load_mermaid_config():
     config["Add_Link_Labels"] = str(config.get("Add_Link_Labels", True)).lower() == 'true'
     return config
 
-# --- Helper Function: Save Configuration ---
-def save_mermaid_config(new_config_data):
+# --- Cached Mermaid UI Configuration ---
+# The merged config is parsed and compiled once and kept in memory. Requests only stat the file
+# and re-read it when its (mtime, size, inode) signature changes or after /api/update_config.
+# The state is swapped as a single tuple, so readers never see a half-updated config.
+_config_lock = threading.RLock()
+_config_state = None  # (file_signature, merged_config, compiled_config, config_fingerprint)
+
+def _config_file_signature():
     try:
-        current_full_config = {}
-        if os.path.exists(MERMAID_CONFIG_PATH):
+        stat_result = os.stat(MERMAID_CONFIG_PATH)
+    except OSError:
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+# Returns (merged_config, compiled_config, config_fingerprint). Both configs are shared between
+# requests and must be treated as read-only. compiled_config is the merged dict itself if it
+# could not be compiled, so conversion reports the problem as before.
+def get_mermaid_config_state():
+    global _config_state
+    signature = _config_file_signature()
+    state = _config_state
+    if state is not None and state[0] == signature:
+        return state[1:]
+    with _config_lock:
+        state = _config_state
+        if state is None or state[0] != signature:
+            config = _read_mermaid_config()
             try:
-                with open(MERMAID_CONFIG_PATH, 'r', encoding='utf-8') as f:
-                    current_full_config = json.load(f)
+                compiled_config = compile_config(config)
             except Exception as e:
-                print(f"Warning: Failed to read existing config '{MERMAID_CONFIG_PATH}', updating based on defaults: {e}")
+                print(f"Warning: Could not precompile configuration: {e}")
+                compiled_config = config
+            config_version = getattr(compiled_config, 'version', None) or config_fingerprint(config)
+            state = (signature, config, compiled_config, config_version)
+            _config_state = state
+    return state[1:]
+
+def load_mermaid_config():
+    return get_mermaid_config_state()[0]
+
+def invalidate_mermaid_config():
+    global _config_state
+    with _config_lock:
+        _config_state = None
+
+# --- Per-Request Collapse Override ---
+# ?collapse=true|false|auto on the conversion endpoints overrides Collapse_ComfyUI_Groups for one
+# request. The override is a config variant with its own fingerprint, so the conversion cache and
+# the worker processes keep its results apart from the plain config's.
+CONFIG_VARIANTS_MAX = 8
+_config_variants = {}  # (config_fingerprint, collapse mode) -> (compiled_config, variant fingerprint)
+
+# Returns (compiled_config, config_fingerprint) for the current request. Raises ValueError for an invalid option.
+def get_request_config_state():
+    merged_config, compiled_config, config_version = get_mermaid_config_state()
+    collapse_option = request.args.get('collapse')
+    if collapse_option is None:
+        return compiled_config, config_version
+    collapse_mode = parse_collapse_mode(collapse_option)
+    if collapse_mode is None:
+        raise ValueError("Invalid 'collapse' option, expected true, false or auto")
+    if getattr(compiled_config, 'collapse_comfyui_groups', None) == collapse_mode:
+        return compiled_config, config_version
+    variant_key = (config_version, collapse_mode)
+    variant = _config_variants.get(variant_key)
+    if variant is None:
+        variant_config = dict(merged_config, Collapse_ComfyUI_Groups=collapse_mode)
+        try:
+            variant_compiled_config = compile_config(variant_config)
+        except Exception:  # Reported by the conversion, as for the plain config
+            variant_compiled_config = variant_config
+        variant = (variant_compiled_config,
+                   getattr(variant_compiled_config, 'version', None) or config_fingerprint(variant_config))
+        with _config_lock:
+            if len(_config_variants) >= CONFIG_VARIANTS_MAX:  # Only variants of replaced configs pile up
+                _config_variants.clear()
+            _config_variants[variant_key] = variant
+    return variant
+
+# --- Helper Function: Save Configuration ---
+def save_mermaid_config(new_config_data):
+    try:
+        # Read-modify-write under the config lock; the new file is swapped in atomically and
+        # the cached config is dropped in the same critical section.
+        with _config_lock:
+            current_full_config = {}
+            if os.path.exists(MERMAID_CONFIG_PATH):
+                try:
+                    with open(MERMAID_CONFIG_PATH, 'r', encoding='utf-8') as f:
+                        current_full_config = json.load(f)
+                except Exception as e:
+                    print(f"Warning: Failed to read existing config '{MERMAID_CONFIG_PATH}', updating based on defaults: {e}")
+                    current_full_config = effective_default_config.copy()
+            else:
                 current_full_config = effective_default_config.copy()
-        else:
-            current_full_config = effective_default_config.copy()
-        for key, value in new_config_data.items():
-            current_full_config[key] = value
-        with open(MERMAID_CONFIG_PATH, 'w', encoding='utf-8') as f:
-            json.dump(current_full_config, f, indent=2, ensure_ascii=False)
+            for key, value in new_config_data.items():
+                current_full_config[key] = value
+            temp_config_path = MERMAID_CONFIG_PATH + ".tmp"
+            with open(temp_config_path, 'w', encoding='utf-8') as f:
+                json.dump(current_full_config, f, indent=2, ensure_ascii=False)
+            os.replace(temp_config_path, MERMAID_CONFIG_PATH)
+            invalidate_mermaid_config()
         print(f"Configuration successfully saved to '{MERMAID_CONFIG_PATH}'.")
         return True
     except Exception as e:
@@ -124,35 +265,660 @@ def save_mermaid_config(new_config_data):
         traceback.print_exc()
         return False
 
+# --- Conversion Result Cache ---
+# In-process LRU of generated Mermaid code, keyed by (sha256 of the workflow text, config fingerprint).
+# Bounded both by entry count and by the total size of the cached code.
+CONVERSION_CACHE_MAX_ENTRIES = 256
+CONVERSION_CACHE_MAX_CHARS = 64 * 1024 * 1024
+
+class ConversionCache:
+    def __init__(self, max_entries=CONVERSION_CACHE_MAX_ENTRIES, max_chars=CONVERSION_CACHE_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._total_chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(workflow_json_string, config_version):
+        workflow_bytes = workflow_json_string.encode('utf-8') if isinstance(workflow_json_string, str) else workflow_json_string
+        return hashlib.sha256(workflow_bytes).hexdigest(), config_version
+
+    def get(self, key):
+        with self._lock:
+            mermaid_code = self._entries.get(key)
+            if mermaid_code is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return mermaid_code
+
+    def put(self, key, mermaid_code):
+        if len(mermaid_code) > self.max_chars:
+            return  # Too large to cache at all
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_chars -= len(previous)
+            self._entries[key] = mermaid_code
+            self._total_chars += len(mermaid_code)
+            while len(self._entries) > self.max_entries or self._total_chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_chars -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_chars = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries), "max_entries": self.max_entries,
+                "cached_chars": self._total_chars, "max_chars": self.max_chars,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+conversion_cache = ConversionCache()
+conversion_stats = ConversionStats()
+
+# --- Service Metrics (served at /metrics) ---
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+COUNT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+metrics = MetricsRegistry('wf2mermaid')
+http_requests_total = metrics.counter('http_requests_total', "HTTP requests by route, method and status.",
+                                      ('route', 'method', 'status'))
+http_request_duration = metrics.histogram('http_request_duration_seconds',
+                                          "Time until the response (or the first chunk of a stream) is ready.",
+                                          LATENCY_BUCKETS, ('route',))
+workflow_size_bytes = metrics.histogram('workflow_size_bytes', "Size of converted workflow JSON.", SIZE_BUCKETS)
+workflow_nodes = metrics.histogram('workflow_nodes', "Nodes per converted workflow (cache misses only).", COUNT_BUCKETS)
+workflow_links = metrics.histogram('workflow_links', "Links per converted workflow (cache misses only).", COUNT_BUCKETS)
+mermaid_output_chars = metrics.histogram('mermaid_output_chars', "Size of generated Mermaid code.", SIZE_BUCKETS)
+conversion_errors_total = metrics.counter('conversion_errors_total', "Failed conversions by error type.", ('type',))
+
+def _cache_metric(field):
+    return lambda: conversion_cache.stats()[field]
+
+metrics.callback('conversion_cache_hits_total', "Conversion cache hits.", _cache_metric('hits'), 'counter')
+metrics.callback('conversion_cache_misses_total', "Conversion cache misses.", _cache_metric('misses'), 'counter')
+metrics.callback('conversion_cache_evictions_total', "Conversion cache evictions.", _cache_metric('evictions'), 'counter')
+metrics.callback('conversion_cache_hit_ratio', "Share of conversion cache lookups that hit.", _cache_metric('hit_rate'))
+metrics.callback('conversion_cache_entries', "Entries in the conversion cache.", _cache_metric('entries'))
+metrics.callback('conversion_cache_chars', "Characters of Mermaid code in the conversion cache.", _cache_metric('cached_chars'))
+
+# Invalid workflows raise these ValueError subclasses so failures can be counted by type.
+class InvalidWorkflowJSONError(ValueError):
+    pass
+
+class WorkflowNotObjectError(ValueError):
+    pass
+
+def record_conversion_error(error):
+    if isinstance(error, InvalidWorkflowJSONError): error_type = 'invalid_json'
+    elif isinstance(error, WorkflowNotObjectError): error_type = 'not_object'
+    elif isinstance(error, PoolSaturatedError): error_type = 'overloaded'
+    elif isinstance(error, ConversionTimeoutError): error_type = 'timeout'
+    elif isinstance(error, ConversionCancelledError): error_type = 'cancelled'
+    elif isinstance(error, ValueError): error_type = 'invalid_request'
+    elif isinstance(error, RuntimeError): error_type = 'runtime'
+    else: error_type = 'internal'
+    conversion_errors_total.inc(error_type)
+
+def record_conversion(workflow_payload, mermaid_code, profile):
+    if isinstance(workflow_payload, (str, bytes)):
+        workflow_size_bytes.observe(len(workflow_payload.encode('utf-8') if isinstance(workflow_payload, str) else workflow_payload))
+    mermaid_output_chars.observe(len(mermaid_code))
+    if 'nodes' in profile.counters:
+        workflow_nodes.observe(profile.counters['nodes'])
+        workflow_links.observe(profile.counters.get('links', 0) + profile.counters.get('links_skipped', 0))
+    conversion_stats.record(profile)
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_requests_total.inc(route, request.method, str(response.status_code))
+    started = g.get('request_started')
+    if started is not None:
+        http_request_duration.observe(time.perf_counter() - started, route)
+    return response
+
+# --- Offloading Large Conversions ---
+# Workflow text of at least OFFLOAD_MIN_BYTES, or with at least OFFLOAD_MIN_NODES nodes, is converted
+# in a worker process (see conversion_pool.py) so it cannot starve small requests of the GIL.
+OFFLOAD_MIN_BYTES = 2 * 1024 * 1024
+OFFLOAD_MIN_NODES = 5000
+OFFLOAD_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+OFFLOAD_MAX_QUEUED = OFFLOAD_WORKERS * 2  # Beyond this, requests get 503 instead of waiting
+OFFLOAD_TIMEOUT_SECONDS = 60  # Per request, including time queued; 504 after that
+OFFLOAD_RETRY_AFTER_SECONDS = 5
+OFFLOAD_SELECTIVE_PARSE = False  # Workers read text of 4 MB+ with the slower, memory-lean scan of workflow_ingest.py
+
+# Worker error kinds -> the exceptions an in-process conversion would have raised
+OFFLOAD_ERROR_TYPES = {'invalid_json': InvalidWorkflowJSONError, 'not_object': WorkflowNotObjectError, 'invalid': ValueError}
+
+_offload_pool = None
+_offload_pool_lock = threading.Lock()
+
+def get_offload_pool():
+    global _offload_pool
+    with _offload_pool_lock:
+        if _offload_pool is None:
+            _offload_pool = ConversionProcessPool(OFFLOAD_WORKERS, OFFLOAD_MAX_QUEUED, OFFLOAD_SELECTIVE_PARSE)
+        return _offload_pool
+
+def _offload_pool_jobs():
+    pool = _offload_pool
+    pool_stats = pool.stats() if pool is not None else {}
+    return [({"outcome": outcome}, pool_stats.get(outcome, 0)) for outcome in ('completed', 'rejected', 'timeouts', 'cancelled')]
+
+metrics.callback('offload_pool_jobs_total', "Conversions offloaded to worker processes, by outcome.", _offload_pool_jobs, 'counter')
+
+def _convert_in_worker_process(workflow_payload, compiled_config, config_version, is_cancelled, profile):
+    if profile is not None: profile.enter('offload')
+    config = dict(getattr(compiled_config, 'source', compiled_config))
+    try:
+        return get_offload_pool().convert(config_version, config, workflow_payload, OFFLOAD_TIMEOUT_SECONDS, is_cancelled)
+    except WorkerJobError as e:
+        raise OFFLOAD_ERROR_TYPES.get(e.kind, RuntimeError)(str(e))
+    finally:
+        if profile is not None: profile.finish()
+
+# Returns a function telling whether the client of the current request has disconnected, or None
+# if the server does not expose the connection (only Werkzeug's servers do).
+def client_disconnect_check():
+    sock = request.environ.get('werkzeug.socket')
+    if sock is None:
+        return None
+    import select
+    import socket
+
+    def client_disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            # The request body has been read, so a readable socket means EOF (or a pipelined request)
+            return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+        except ValueError:  # TLS sockets cannot peek: assume connected
+            return False
+        except OSError:
+            return True
+
+    return client_disconnected
+
+# --- Helper Function: Convert One Workflow ---
+# workflow_payload is the workflow JSON text (str/bytes) or an already parsed workflow dict.
+# A legacy {"workflow_json": "<workflow JSON string>"} envelope is unwrapped.
+# cache_source is the raw text keying the conversion cache (defaults to the payload when it is text),
+# so repeated requests are answered before any parsing.
+# With offload=True, large workflows are converted in a worker process (is_cancelled is polled
+# meanwhile), which may raise PoolSaturatedError, ConversionTimeoutError or ConversionCancelledError.
+# Text at least OFFLOAD_MIN_BYTES long is sent unparsed; a workflow found to have at least
+# OFFLOAD_MIN_NODES nodes (or parsed from such text by the caller) is sent as the parsed dict.
+# Raises ValueError with a client-facing message for invalid input.
+def convert_workflow_payload(workflow_payload, compiled_config, config_version, cache_source=None, profile=None,
+                             offload=False, is_cancelled=None):
+    if profile is not None: profile.enter('cache')
+    if cache_source is None and isinstance(workflow_payload, (str, bytes)):
+        cache_source = workflow_payload
+    cache_key = conversion_cache.make_key(cache_source, config_version) if cache_source is not None else None
+    cached_mermaid_code = conversion_cache.get(cache_key) if cache_key else None
+    if cached_mermaid_code is not None:
+        print("Serving conversion from cache.")
+        if profile is not None:
+            profile.finish()
+            profile.count('cache_hits')
+        return cached_mermaid_code
+    if offload and isinstance(workflow_payload, (str, bytes)) and len(workflow_payload) >= OFFLOAD_MIN_BYTES:
+        mermaid_code = _convert_in_worker_process(workflow_payload, compiled_config, config_version, is_cancelled, profile)
+    else:
+        if profile is not None: profile.enter('parse')
+        workflow_dict = load_workflow_payload(workflow_payload)
+        nodes = workflow_dict.get('nodes')
+        if offload and ((isinstance(nodes, list) and len(nodes) >= OFFLOAD_MIN_NODES)
+                        or (cache_source is not None and len(cache_source) >= OFFLOAD_MIN_BYTES)):
+            mermaid_code = _convert_in_worker_process(workflow_dict, compiled_config, config_version, is_cancelled, profile)
+        else:
+            mermaid_code = workflow_to_mermaid(workflow_dict, compiled_config, profile)
+    if cache_key:
+        conversion_cache.put(cache_key, mermaid_code)
+    return mermaid_code
+
+# Parses a workflow payload (see convert_workflow_payload) into the workflow dict.
+def load_workflow_payload(workflow_payload):
+    workflow_dict = _parse_workflow_payload(workflow_payload)
+    if isinstance(workflow_dict, dict) and 'workflow_json' in workflow_dict:
+        workflow_dict = _parse_workflow_payload(workflow_dict['workflow_json'])
+    if not isinstance(workflow_dict, dict):
+        raise WorkflowNotObjectError("Provided JSON is not a valid object (dictionary)")
+    return workflow_dict
+
+def _parse_workflow_payload(workflow_payload):
+    if not isinstance(workflow_payload, (str, bytes)):
+        return workflow_payload
+    try:
+        return parse_workflow_json(workflow_payload)
+    except ValueError:  # Includes UnicodeDecodeError for undecodable bytes
+        raise InvalidWorkflowJSONError("Provided Workflow JSON is invalid")
+
+# --- Helper Function: Read the Workflow From a Request ---
+# The workflow is accepted as:
+#   - the raw request body (application/json), parsed once;
+#   - a multipart file field ('workflow' or the first file), .json or .png;
+#   - a raw PNG body (image/png);
+#   - the legacy {"workflow_json": "<workflow JSON string>"} body.
+# Returns the unparsed workflow payload. Raises ValueError with a client-facing message.
+def read_request_workflow_payload():
+    if request.mimetype == 'image/png':
+        # Only the chunk headers and the workflow chunk are kept; image data is discarded as it streams in.
+        workflow_payload = extract_workflow_from_png(request.stream)
+    elif request.mimetype == 'multipart/form-data':
+        upload = request.files.get('workflow') or next(iter(request.files.values()), None)
+        if upload is None:
+            raise ValueError("Missing 'workflow' file in multipart request")
+        if upload.mimetype == 'image/png' or (upload.filename or '').lower().endswith('.png'):
+            workflow_payload = extract_workflow_from_png(upload.stream)
+        else:
+            workflow_payload = upload.read()
+    else:
+        workflow_payload = request.get_data(cache=False)
+    if not workflow_payload.strip():
+        raise ValueError("Missing workflow in request body")
+    return workflow_payload
+
 # --- API Endpoint: Handle Conversion Request ---
 @app.route('/api/convert', methods=['POST'])
 def handle_convert():
     print("Received /api/convert request")
     try:
-        data = request.get_json()
-        if not data or 'workflow_json' not in data:
-            return jsonify({"status": "error", "message": "Missing 'workflow_json' field in request body"}), 400
-        workflow_json_string = data['workflow_json']
+        profile = ConversionProfile()
         try:
-            workflow_dict = json.loads(workflow_json_string)
-            if not isinstance(workflow_dict, dict):
-                raise ValueError("Provided JSON is not a valid object (dictionary)")
-        except json.JSONDecodeError:
-            return jsonify({"status": "error", "message": "Provided Workflow JSON is invalid"}), 400
+            profile.enter('read')
+            workflow_payload = read_request_workflow_payload()
+            current_compiled_config, current_config_version = get_request_config_state()
+            mermaid_code = convert_workflow_payload(workflow_payload, current_compiled_config, current_config_version,
+                                                    profile=profile, offload=True, is_cancelled=client_disconnect_check())
         except ValueError as ve:
+            record_conversion_error(ve)
             return jsonify({"status": "error", "message": str(ve)}), 400
-        current_config = load_mermaid_config()
-        mermaid_code = workflow_to_mermaid(workflow_dict, current_config)
-        return jsonify({"status": "success", "mermaid_code": mermaid_code})
+        except PoolSaturatedError as pse:
+            record_conversion_error(pse)
+            response = jsonify({"status": "error", "message": "Server is busy converting large workflows, please retry shortly."})
+            response.headers['Retry-After'] = str(OFFLOAD_RETRY_AFTER_SECONDS)
+            return response, 503
+        except ConversionTimeoutError as cte:
+            record_conversion_error(cte)
+            return jsonify({"status": "error", "message": f"Conversion timed out: {cte}"}), 504
+        except ConversionCancelledError as cce:
+            record_conversion_error(cce)
+            print("Client disconnected, conversion cancelled.")
+            return jsonify({"status": "error", "message": str(cce)}), 499  # Client Closed Request (not sent anywhere)
+        record_conversion(workflow_payload, mermaid_code, profile)
+        response = jsonify({"status": "success", "mermaid_code": mermaid_code})
+        response.headers['Server-Timing'] = profile.server_timing()
+        return response
     except RuntimeError as re:
+        record_conversion_error(re)
         print(f"Runtime error: {re}")
         traceback.print_exc()
         return jsonify({"status": "error", "message": str(re)}), 500
     except Exception as e:
+        record_conversion_error(e)
         print(f"Uncaught error processing conversion request: {e}")
         traceback.print_exc()
         return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
 
+# --- Incremental Conversion Sessions ---
+SESSION_MAX_COUNT = 64
+SESSION_IDLE_SECONDS = 30 * 60
+
+# Keeps ConversionSessions between requests, least recently used first. Sessions idle for
+# longer than idle_seconds, or beyond max_sessions, are dropped.
+class ConversionSessionStore:
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, idle_seconds=SESSION_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()  # session_id -> [session, lock, config_version, last_used]
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._sessions:
+            oldest_id, oldest_entry = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - oldest_entry[3] <= self.idle_seconds:
+                break
+            del self._sessions[oldest_id]
+
+    def create(self, session, config_version):
+        session_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = [session, threading.Lock(), config_version, now]
+            self._expire(now)
+        return session_id
+
+    # Returns the session entry list, or None if the session is unknown or expired.
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[3] = now
+                self._sessions.move_to_end(session_id)
+            return entry
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+conversion_sessions = ConversionSessionStore()
+metrics.callback('conversion_sessions', "Open incremental conversion sessions.", lambda: len(conversion_sessions))
+
+def _session_response(session_id, session, mermaid_code):
+    return jsonify({"status": "success", "session_id": session_id, "mermaid_code": mermaid_code,
+                    "stats": session.last_stats})
+
+def _session_not_found():
+    return jsonify({"status": "error", "message": "Conversion session not found or expired"}), 404
+
+# --- API Endpoint: Create a Conversion Session ---
+# Takes a workflow like /api/convert and returns its Mermaid code with a session_id for later updates.
+@app.route('/api/session', methods=['POST'])
+def create_conversion_session():
+    print("Received /api/session request")
+    try:
+        try:
+            workflow_dict = load_workflow_payload(read_request_workflow_payload())
+            current_compiled_config, current_config_version = get_request_config_state()
+            session = ConversionSession(current_compiled_config)
+            mermaid_code = session.convert(workflow_dict)
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        session_id = conversion_sessions.create(session, current_config_version)
+        return _session_response(session_id, session, mermaid_code)
+    except Exception as e:
+        print(f"Error creating conversion session: {e}")
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
+
+# --- API Endpoint: Update a Conversion Session ---
+# POST a new workflow version (same formats as /api/convert), or PATCH a JSON Patch (RFC 6902)
+# array against the last version. Only the changed nodes, links and group memberships are recomputed.
+@app.route('/api/session/<session_id>', methods=['POST', 'PATCH'])
+def update_conversion_session(session_id):
+    print(f"Received {request.method} /api/session request")
+    try:
+        entry = conversion_sessions.get(session_id)
+        if entry is None:
+            return _session_not_found()
+        session, session_lock = entry[0], entry[1]
+        try:
+            if request.method == 'PATCH':
+                patch_operations = _parse_workflow_payload(request.get_data(cache=False))
+            else:
+                workflow_dict = load_workflow_payload(read_request_workflow_payload())
+            with session_lock:
+                current_compiled_config, current_config_version = get_request_config_state()
+                if entry[2] != current_config_version:  # Config changed since the last run: start over
+                    session.set_config(current_compiled_config)
+                    entry[2] = current_config_version
+                if request.method == 'PATCH':
+                    mermaid_code = session.apply_patch(patch_operations)
+                else:
+                    mermaid_code = session.convert(workflow_dict)
+                return _session_response(session_id, session, mermaid_code)
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+    except Exception as e:
+        print(f"Error updating conversion session: {e}")
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": f"Internal server error: {str(e)}"}), 500
+
+# --- API Endpoint: Close a Conversion Session ---
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def delete_conversion_session(session_id):
+    if not conversion_sessions.remove(session_id):
+        return _session_not_found()
+    return jsonify({"status": "success", "message": "Conversion session closed."})
+
+# --- Batch Conversion ---
+BATCH_CONVERT_WORKERS = max(2, min(8, os.cpu_count() or 1))
+BATCH_MAX_IN_FLIGHT = BATCH_CONVERT_WORKERS * 4  # Items read ahead of the results being streamed out
+BATCH_MAX_ITEM_BYTES = 64 * 1024 * 1024  # Per workflow (also guards against zip bombs)
+BATCH_SPOOL_BYTES = 8 * 1024 * 1024  # Zip uploads larger than this are spooled to a temp file
+BATCH_WORKFLOW_EXTENSIONS = ('.json', '.png')
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
+    global _batch_executor
+    import concurrent.futures
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=BATCH_CONVERT_WORKERS, thread_name_prefix="batch-convert")
+        return _batch_executor
+
+# Called when the production server stops: lets running batch conversions finish, drops queued ones
+# and stops the conversion worker processes.
+def shutdown_background_work():
+    global _batch_executor, _offload_pool
+    with _batch_executor_lock:
+        executor, _batch_executor = _batch_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+    with _offload_pool_lock:
+        pool, _offload_pool = _offload_pool, None
+    if pool is not None:
+        pool.close()
+
+# Splits a body delivered in chunks into lines without re-scanning buffered data.
+def iter_body_lines(chunks):
+    parts = []
+    for chunk in chunks:
+        start = 0
+        while True:
+            newline_index = chunk.find(b'\n', start)
+            if newline_index < 0:
+                parts.append(chunk[start:])
+                break
+            parts.append(chunk[start:newline_index])
+            yield b''.join(parts)
+            parts = []
+            start = newline_index + 1
+    tail = b''.join(parts)
+    if tail:
+        yield tail
+
+# Yields (name, workflow_payload, cache_source) per NDJSON line. A line is either a workflow object or
+# {"name": ..., "workflow_json": "<workflow JSON string>"}. Lines that cannot be used yield a ValueError
+# as payload so they are reported in order with the other items.
+def iter_ndjson_batch_items(lines):
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        name = f"line {line_number}"
+        if len(line) > BATCH_MAX_ITEM_BYTES:
+            yield name, ValueError("Workflow exceeds the maximum batch item size"), None
+            continue
+        try:
+            item = parse_workflow_json(line)
+        except ValueError:
+            yield name, ValueError("Provided Workflow JSON is invalid"), None
+            continue
+        if isinstance(item, dict) and 'workflow_json' in item:
+            if isinstance(item.get('name'), str):
+                name = item['name']
+            yield name, item['workflow_json'], None
+        else:
+            yield name, item, line
+
+# Yields (name, workflow_payload, None) for every .json/.png member of a zip archive, in archive order.
+def iter_zip_batch_items(zip_file):
+    import zipfile
+    with zipfile.ZipFile(zip_file) as archive:
+        for member in archive.infolist():
+            name = member.filename
+            if member.is_dir() or not name.lower().endswith(BATCH_WORKFLOW_EXTENSIONS):
+                continue
+            if member.file_size > BATCH_MAX_ITEM_BYTES:
+                yield name, ValueError("Workflow exceeds the maximum batch item size"), None
+                continue
+            try:
+                with archive.open(member) as member_file:
+                    if name.lower().endswith('.png'):
+                        payload = extract_workflow_from_png(member_file)
+                    else:
+                        payload = member_file.read()
+            except (ValueError, zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                payload = ValueError(str(e) or type(e).__name__)
+            yield name, payload, None
+
+def _convert_batch_item(workflow_payload, cache_source, compiled_config, config_version, is_cancelled):
+    if isinstance(workflow_payload, Exception):
+        raise workflow_payload
+    profile = ConversionProfile()
+    mermaid_code = convert_workflow_payload(workflow_payload, compiled_config, config_version, cache_source, profile,
+                                            offload=True, is_cancelled=is_cancelled)
+    record_conversion(workflow_payload, mermaid_code, profile)
+    return mermaid_code
+
+# Submits items to the batch pool (at most BATCH_MAX_IN_FLIGHT at a time) and yields one NDJSON
+# result line per item as soon as it finishes, followed by a summary line. Large items are offloaded
+# like single conversions; a busy offload pool or a timeout fails just that item.
+def stream_batch_results(items, compiled_config, config_version, is_cancelled=None):
+    import concurrent.futures
+    import zipfile
+    executor = get_batch_executor()
+    in_flight = {}  # future -> (index, name)
+    succeeded = failed = 0
+    item_iter = enumerate(items)
+    exhausted = False
+    while True:
+        while not exhausted and len(in_flight) < BATCH_MAX_IN_FLIGHT:
+            try:
+                index, (name, workflow_payload, cache_source) = next(item_iter)
+            except StopIteration:
+                exhausted = True
+            except (ValueError, zipfile.BadZipFile, OSError) as e:  # The input stream itself broke
+                yield json.dumps({"status": "error", "message": f"Could not read batch input: {e}"}) + "\n"
+                exhausted = True
+            else:
+                future = executor.submit(_convert_batch_item, workflow_payload, cache_source, compiled_config, config_version,
+                                         is_cancelled)
+                in_flight[future] = (index, name)
+        if not in_flight:
+            break
+        done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            index, name = in_flight.pop(future)
+            try:
+                result = {"index": index, "name": name, "status": "success", "mermaid_code": future.result()}
+                succeeded += 1
+            except ValueError as ve:
+                record_conversion_error(ve)
+                result = {"index": index, "name": name, "status": "error", "message": str(ve)}
+                failed += 1
+            except PoolSaturatedError as pse:
+                record_conversion_error(pse)
+                result = {"index": index, "name": name, "status": "error",
+                          "message": "Server is busy converting large workflows, please retry shortly."}
+                failed += 1
+            except (ConversionTimeoutError, ConversionCancelledError) as ce:
+                record_conversion_error(ce)
+                message = f"Conversion timed out: {ce}" if isinstance(ce, ConversionTimeoutError) else str(ce)
+                result = {"index": index, "name": name, "status": "error", "message": message}
+                failed += 1
+            except Exception as e:
+                record_conversion_error(e)
+                print(f"Error converting batch item '{name}': {e}")
+                traceback.print_exc()
+                result = {"index": index, "name": name, "status": "error", "message": f"Internal server error: {str(e)}"}
+                failed += 1
+            yield json.dumps(result) + "\n"
+    yield json.dumps({"status": "done", "total": succeeded + failed, "succeeded": succeeded, "failed": failed}) + "\n"
+
+# --- API Endpoint: Batch Conversion ---
+# Body: NDJSON (one workflow per line) or a zip archive of .json/.png workflows.
+# Response: NDJSON, one {"index", "name", "status", ...} line per workflow in completion order,
+# then a {"status": "done", ...} summary line.
+@app.route('/api/convert_batch', methods=['POST'])
+def handle_convert_batch():
+    print("Received /api/convert_batch request")
+    try:
+        current_compiled_config, current_config_version = get_request_config_state()
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    is_cancelled = client_disconnect_check()
+    body = request.stream
+    head = body.read(4)
+    body_chunks = itertools.chain([head], iter(lambda: body.read(1024 * 1024), b''))
+    is_zip = request.mimetype in ('application/zip', 'application/x-zip-compressed') or head == b'PK\x03\x04'
+    if is_zip:
+        import tempfile
+        import zipfile
+        # Zip archives keep their directory at the end, so the upload is spooled before reading.
+        zip_file = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+        for chunk in body_chunks:
+            zip_file.write(chunk)
+        zip_file.seek(0)
+        if not zipfile.is_zipfile(zip_file):
+            zip_file.close()
+            return jsonify({"status": "error", "message": "Request body is not a valid zip archive"}), 400
+        zip_file.seek(0)
+        items = iter_zip_batch_items(zip_file)
+    else:
+        # NDJSON lines are read while earlier items convert.
+        zip_file = None
+        items = iter_ndjson_batch_items(iter_body_lines(body_chunks))
+
+    def generate():
+        try:
+            yield from stream_batch_results(items, current_compiled_config, current_config_version, is_cancelled)
+        finally:
+            if zip_file is not None:
+                zip_file.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- API Endpoint: Conversion Cache Statistics ---
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({"status": "success", "conversion_cache": conversion_cache.stats()})
+
+# --- API Endpoint: Conversion Phase Statistics ---
+# Per-phase latency histograms with p50/p95/p99 (over the most recent conversions) and counter
+# totals for /api/convert and /api/convert_batch conversions. ?reset=1 clears them after reading.
+@app.route('/api/stats', methods=['GET'])
+def get_conversion_stats():
+    summary = conversion_stats.summary()
+    if request.args.get('reset') in ('1', 'true'):
+        conversion_stats.clear()
+    return jsonify({"status": "success", **summary, "conversion_cache": conversion_cache.stats()})
+
+# --- Endpoint: Prometheus Metrics ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.exposition(), content_type=METRICS_CONTENT_TYPE)
+
 # --- API Endpoint: Get Current Config Settings ---
 @app.route('/api/get_config', methods=['GET'])
 def get_config_settings():
@@ -165,7 +931,8 @@ def get_config_settings():
             "Generate_ComfyUI_Subgraphs": current_config.get("Generate_ComfyUI_Subgraphs", dc.get("Generate_ComfyUI_Subgraphs", True)),
             "Default_Connector": current_config.get("Default_Connector", dc.get("Default_Connector", "-->")),
             "Default_Node_Shape": current_config.get("Default_Node_Shape", dc.get("Default_Node_Shape", "rectangle")),
-            "Add_Link_Labels": current_config.get("Add_Link_Labels", dc.get("Add_Link_Labels", True))
+            "Add_Link_Labels": current_config.get("Add_Link_Labels", dc.get("Add_Link_Labels", True)),
+            "Collapse_ComfyUI_Groups": current_config.get("Collapse_ComfyUI_Groups", dc.get("Collapse_ComfyUI_Groups", False))
         }
         return jsonify({"status": "success", "settings": frontend_settings})
     except Exception as e:
@@ -199,6 +966,11 @@ def update_config_settings():
                 else: # Should not happen with current allowed_keys_map
                     if isinstance(value, expected_type): update_payload[key] = value
                     else: return jsonify({"status": "error", "message": f"Incorrect value type for field '{key}'. Expected {expected_type.__name__}, received {type(value).__name__}."}), 400
+        if "Collapse_ComfyUI_Groups" in data:  # true, false or "auto"
+            collapse_mode = parse_collapse_mode(data["Collapse_ComfyUI_Groups"])
+            if collapse_mode is None:
+                return jsonify({"status": "error", "message": "Incorrect value for field 'Collapse_ComfyUI_Groups'. Expected true, false or \"auto\"."}), 400
+            update_payload["Collapse_ComfyUI_Groups"] = collapse_mode
         if not update_payload:
             return jsonify({"status": "error", "message": "No valid configuration items provided for update"}), 400
         if save_mermaid_config(update_payload):
@@ -224,13 +996,38 @@ def serve_index():
 
 # --- Start Server ---
 if __name__ == '__main__':
+    import argparse
+    import multiprocessing
+    multiprocessing.freeze_support()  # Conversion worker processes of the packaged exe start here
+    parser = argparse.ArgumentParser(description="ComfyUI workflow to Mermaid web app.")
+    parser.add_argument('--production', action='store_true',
+                        help="Serve without debugger, reloader or browser (same as App_Server_Mode: \"production\").")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on (default: 0.0.0.0).")
+    parser.add_argument('--port', type=int, help="Port (default: App_Port from Mermaid_config.json, else 5000).")
+    parser.add_argument('--threads', type=int, help="Production: request threads per process (default: App_Threads, else 8).")
+    parser.add_argument('--workers', type=int, help="Production: worker processes, more than 1 needs gunicorn (default: App_Workers, else 1).")
+    args = parser.parse_args()
+
+    server_port = args.port or get_server_startup_config()
+    server_settings = get_server_mode_config()
+
+    if args.production or server_settings["mode"] == 'production':
+        import wsgi_server
+        threads = max(1, args.threads or server_settings["threads"])
+        workers = max(1, args.workers or server_settings["workers"])
+        get_mermaid_config_state()  # Load and compile the config once, before serving (and forking)
+        if workers > 1:
+            wsgi_server.serve_prefork(app, args.host, server_port, workers, threads, shutdown_background_work)
+        else:
+            wsgi_server.serve_threaded(app, args.host, server_port, threads, shutdown_background_work)
+        sys.exit(0)
 
     DEBUG_MODE = True
 
-    server_port = get_server_startup_config()
     url_to_open = f"http://127.0.0.1:{server_port}"
 
     def open_browser_after_delay():
+        import webbrowser
         try:
             print(f"Preparing to open browser to: {url_to_open} in 1 second.")
             webbrowser.open_new_tab(url_to_open)
@@ -238,10 +1035,10 @@ if __name__ == '__main__':
         except Exception as e:
             print(f"Could not automatically open browser: {e}")
 
-    print(f"Starting Flask server, listening on 0.0.0.0, port {server_port}...")
+    print(f"Starting Flask server, listening on {args.host}, port {server_port}...")
     print(f"Open your browser and go to {url_to_open}")
 
     if not os.environ.get("WERKZEUG_RUN_MAIN"):
         threading.Timer(1.0, open_browser_after_delay).start()
 
-    app.run(debug=DEBUG_MODE, host='0.0.0.0', port=server_port, use_reloader=DEBUG_MODE)
+    app.run(debug=DEBUG_MODE, host=args.host, port=server_port, use_reloader=DEBUG_MODE)
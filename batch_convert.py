@@ -0,0 +1,282 @@
+# batch_convert.py
+# Converts many ComfyUI workflows (.json / .png) to Mermaid .mmd files in parallel.
+#
+# Usage:
+#   python batch_convert.py PATH_OR_GLOB [PATH_OR_GLOB ...] [-o OUTPUT_DIR] [-j JOBS]
+#                           [--config Mermaid_config.json] [--force] [--verbose] [--selective-parse]
+#
+# Directories are searched recursively. Each output is written next to its input
+# (workflow.json -> workflow.mmd) unless an output directory is given. Outputs newer
+# than both their input and the config file are skipped unless --force is set.
+
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+import traceback
+
+from workflow_to_mermaid import absolute_config_path, compile_config, load_config_file, write_mermaid
+from workflow_ingest import SELECTIVE_PARSE_MIN_BYTES, parse_workflow_for_conversion, read_workflow_file_fields
+from png_workflow import extract_workflow_from_png
+
+WORKFLOW_EXTENSIONS = ('.json', '.png')
+READER_THREADS = 4
+
+
+# --- Input Discovery ---
+# Directory part of a glob pattern before its first wildcard ("in/**/*.json" -> "in").
+def _glob_root(pattern):
+    root_parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        root_parts.append(part)
+    return os.path.abspath(os.sep.join(root_parts) or os.curdir)
+
+
+# Expands paths, directories (recursive) and glob patterns into (input_path, root_dir) pairs.
+# root_dir is the directory the input was found under, used to mirror the tree in an output directory.
+def collect_inputs(patterns):
+    inputs = []
+    seen = set()
+
+    def add(file_path, root_dir):
+        absolute_path = os.path.abspath(file_path)
+        if absolute_path not in seen and absolute_path.lower().endswith(WORKFLOW_EXTENSIONS):
+            seen.add(absolute_path)
+            inputs.append((absolute_path, root_dir))
+
+    for pattern in patterns:
+        is_glob = glob.has_magic(pattern)
+        matches = sorted(glob.glob(pattern, recursive=True)) if is_glob else [pattern]
+        if not matches:
+            print(f"Warning: No files match '{pattern}'.")
+        for match in matches:
+            if os.path.isdir(match):
+                root_dir = os.path.abspath(match)
+                for dir_path, dir_names, file_names in os.walk(match):
+                    dir_names.sort()
+                    for file_name in sorted(file_names):
+                        add(os.path.join(dir_path, file_name), root_dir)
+            elif os.path.isfile(match):
+                add(match, _glob_root(pattern) if is_glob else os.path.dirname(os.path.abspath(match)))
+            else:
+                print(f"Warning: '{match}' does not exist, skipped.")
+    return inputs
+
+
+# Maps every input to its .mmd path. Inputs that would share an output (a.json and a.png)
+# keep their extension in the output name (a.png.mmd).
+def plan_outputs(inputs, output_dir=None):
+    def output_for(input_path, root_dir, keep_extension):
+        base_name = os.path.basename(input_path) if keep_extension else os.path.splitext(os.path.basename(input_path))[0]
+        if output_dir is None:
+            target_dir = os.path.dirname(input_path)
+        else:
+            target_dir = os.path.join(output_dir, os.path.relpath(os.path.dirname(input_path), root_dir))
+        return os.path.normpath(os.path.join(target_dir, base_name + ".mmd"))
+
+    output_counts = {}
+    for input_path, root_dir in inputs:
+        output_path = output_for(input_path, root_dir, False)
+        output_counts[output_path] = output_counts.get(output_path, 0) + 1
+    plan = []
+    for input_path, root_dir in inputs:
+        output_path = output_for(input_path, root_dir, False)
+        if output_counts[output_path] > 1:
+            output_path = output_for(input_path, root_dir, True)
+        plan.append((input_path, output_path))
+    return plan
+
+
+def is_up_to_date(input_path, output_path, config_mtime=0.0):
+    try:
+        output_mtime = os.path.getmtime(output_path)
+        return output_mtime >= os.path.getmtime(input_path) and output_mtime >= config_mtime
+    except OSError:
+        return False
+
+
+# --- Reading (I/O threads) ---
+# Returns the workflow JSON bytes of an input. For PNGs only the metadata chunks are read.
+def read_workflow_bytes(input_path):
+    if input_path.lower().endswith('.png'):
+        return extract_workflow_from_png(input_path).encode('utf-8')
+    with open(input_path, 'rb') as f:
+        return f.read()
+
+
+# With --selective-parse, a .json input of SELECTIVE_PARSE_MIN_BYTES or more is not read here: its
+# worker memory-maps and scans the file (see convert_workflow_file). Returns its size, else None.
+def in_place_input_size(input_path, selective_parse):
+    if not selective_parse or not input_path.lower().endswith('.json'):
+        return None
+    try:
+        size = os.path.getsize(input_path)
+    except OSError:  # Reported by the regular read
+        return None
+    return size if size >= SELECTIVE_PARSE_MIN_BYTES else None
+
+
+# --- Conversion (worker processes) ---
+_worker_compiled_config = None
+_worker_verbose = False
+_worker_selective_parse = False
+
+
+def _init_worker(merged_config, verbose, selective_parse=False):
+    global _worker_compiled_config, _worker_verbose, _worker_selective_parse
+    _worker_compiled_config = compile_config(merged_config)
+    _worker_verbose = verbose
+    _worker_selective_parse = selective_parse
+
+
+# Converts one workflow and writes its .mmd atomically. Returns the number of characters written.
+def convert_workflow_bytes(workflow_bytes, output_path):
+    return _write_workflow_mermaid(parse_workflow_for_conversion(workflow_bytes, _worker_selective_parse), output_path)
+
+
+# Like convert_workflow_bytes for a .json file scanned in place (see in_place_input_size).
+def convert_workflow_file(input_path, output_path):
+    return _write_workflow_mermaid(read_workflow_file_fields(input_path), output_path)
+
+
+def _write_workflow_mermaid(workflow_dict, output_path):
+    if not isinstance(workflow_dict, dict):
+        raise ValueError("Provided JSON is not a valid object (dictionary)")
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    temp_output_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with contextlib.ExitStack() as stack:
+            if not _worker_verbose:  # Keep per-node/per-link converter warnings out of the batch log
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            with open(temp_output_path, 'w', encoding='utf-8') as f_out:
+                written = write_mermaid(workflow_dict, _worker_compiled_config, f_out)
+        os.replace(temp_output_path, output_path)
+    finally:
+        if os.path.exists(temp_output_path):
+            os.remove(temp_output_path)
+    return written
+
+
+# --- Batch Driver ---
+class BatchSummary:
+    def __init__(self):
+        self.converted = 0
+        self.skipped = 0
+        self.failures = []  # (input_path, message)
+        self.bytes_read = 0
+        self.chars_written = 0
+        self.started = time.perf_counter()
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(f"Converted {self.converted}, skipped {self.skipped} (up to date), failed {len(self.failures)} "
+              f"in {elapsed:.2f}s.")
+        print(f"Throughput: {self.converted / elapsed:.1f} workflows/s, "
+              f"{self.bytes_read / elapsed / (1024 * 1024):.2f} MB/s read, "
+              f"{self.chars_written / (1024 * 1024):.2f} MB of Mermaid code written.")
+        if self.failures:
+            print("Failures:")
+            for input_path, message in self.failures:
+                print(f"  {input_path}: {message}")
+
+
+def run_batch(plan, merged_config, jobs, verbose=False, selective_parse=False):
+    summary = BatchSummary()
+    if jobs <= 1:
+        _init_worker(merged_config, verbose, selective_parse)
+        for input_path, output_path in plan:
+            try:
+                in_place_size = in_place_input_size(input_path, selective_parse)
+                if in_place_size is not None:
+                    summary.bytes_read += in_place_size
+                    summary.chars_written += convert_workflow_file(input_path, output_path)
+                else:
+                    workflow_bytes = read_workflow_bytes(input_path)
+                    summary.bytes_read += len(workflow_bytes)
+                    summary.chars_written += convert_workflow_bytes(workflow_bytes, output_path)
+                summary.converted += 1
+            except Exception as e:
+                summary.failures.append((input_path, str(e) or type(e).__name__))
+                if verbose: traceback.print_exc()
+        return summary
+
+    # Reader threads fetch the next inputs while the process pool converts earlier ones;
+    # at most `window` files are read or converting at any time to bound memory.
+    window = jobs * 4
+    pending_plan = iter(plan)
+    in_flight = {}  # future -> (stage, input_path, output_path)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=READER_THREADS) as read_pool, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                   initargs=(merged_config, verbose, selective_parse)) as convert_pool:
+        def start_reads():
+            while len(in_flight) < window:
+                next_item = next(pending_plan, None)
+                if next_item is None:
+                    return
+                input_path, output_path = next_item
+                in_place_size = in_place_input_size(input_path, selective_parse)
+                if in_place_size is not None:
+                    summary.bytes_read += in_place_size
+                    convert_future = convert_pool.submit(convert_workflow_file, input_path, output_path)
+                    in_flight[convert_future] = ('convert', input_path, output_path)
+                else:
+                    in_flight[read_pool.submit(read_workflow_bytes, input_path)] = ('read', input_path, output_path)
+
+        start_reads()
+        while in_flight:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage, input_path, output_path = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    summary.failures.append((input_path, str(e) or type(e).__name__))
+                    continue
+                if stage == 'read':
+                    summary.bytes_read += len(result)
+                    convert_future = convert_pool.submit(convert_workflow_bytes, result, output_path)
+                    in_flight[convert_future] = ('convert', input_path, output_path)
+                else:
+                    summary.chars_written += result
+                    summary.converted += 1
+            start_reads()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert ComfyUI workflows (.json/.png) to Mermaid .mmd files in parallel.")
+    parser.add_argument('inputs', nargs='+', help="Workflow files, directories (searched recursively) or glob patterns.")
+    parser.add_argument('-o', '--output-dir', help="Write .mmd files here (mirroring input directories) instead of next to the inputs.")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: CPU count).")
+    parser.add_argument('--config', default=absolute_config_path, help="Mermaid config file (default: Mermaid_config.json next to the converter).")
+    parser.add_argument('--force', action='store_true', help="Convert even if the output is up to date.")
+    parser.add_argument('--verbose', action='store_true', help="Show converter warnings and tracebacks.")
+    parser.add_argument('--selective-parse', action='store_true',
+                        help="Scan workflows of 4 MB or more (.json files memory-mapped) keeping only the fields the "
+                             "converter uses: much less memory per worker, but slower than a full JSON parse "
+                             "and laxer about invalid JSON.")
+    args = parser.parse_args(argv)
+
+    merged_config = load_config_file(args.config)
+    config_mtime = os.path.getmtime(args.config) if os.path.exists(args.config) else 0.0
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else None
+
+    plan = plan_outputs(collect_inputs(args.inputs), output_dir)
+    todo = [(input_path, output_path) for input_path, output_path in plan
+            if args.force or not is_up_to_date(input_path, output_path, config_mtime)]
+    print(f"Found {len(plan)} workflow file(s), {len(todo)} to convert with {max(args.jobs, 1)} worker(s).")
+
+    summary = run_batch(todo, merged_config, args.jobs, args.verbose, args.selective_parse)
+    summary.skipped = len(plan) - len(todo)
+    summary.report()
+    return 1 if summary.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,360 @@
+# benchmark.py
+# Benchmarks the converter on seeded synthetic ComfyUI workflows.
+#
+# Usage:
+#   python benchmark.py [--nodes 100,1000,10000] [--link-ratio 1.5] [--groups N] [--node-types 200]
+#                       [--rules 400] [--repeat 5] [--seed 0] [--output results.json]
+#                       [--baseline baseline.json] [--threshold 0.2] [--startup]
+#
+# For every workflow size, workflow_to_mermaid, get_link_style, get_node_style_and_shape,
+# calculate_overlap_area and adjust_text_color_for_background are timed separately. The peak
+# traced memory of a full conversion is recorded too. --startup also times cold imports of the
+# modules and a first conversion in fresh interpreters (use --nodes "" for startup only).
+# With --output the results are written as JSON. With --baseline they are compared per case
+# against an earlier --output file, and the script exits with status 1 if any timing is more
+# than --threshold slower.
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from mermaid_styles import adjust_text_color_for_background, get_link_style, get_node_style_and_shape, style_memo
+from workflow_to_mermaid import build_node_maps, calculate_overlap_area, compile_config, workflow_to_mermaid
+
+DATA_TYPES = ["MODEL", "CLIP", "VAE", "CONDITIONING", "LATENT", "IMAGE", "MASK", "INT", "FLOAT", "STRING"]
+SHAPES = ["rectangle", "round", "stadium", "database", "circle", "rhombus", "hexagon", "parallelogram"]
+COLORS = ["#ccf", "#d8bfd8", "#ffe0e0", "#cfc", "#333", "#fff", "navy", "lightgrey", "darkred", "rgb(40,40,90)"]
+NODE_WIDTH, NODE_HEIGHT, NODE_SPACING = 300, 120, 60
+OVERLAP_GROUPS_PER_NODE = 8  # calculate_overlap_area is timed against this many groups per node
+
+# Startup scenarios, each timed in a fresh interpreter from before its first import
+STARTUP_SCENARIOS = {
+    "import mermaid_styles": "import mermaid_styles",
+    "import workflow_to_mermaid": "import workflow_to_mermaid",
+    "import app": "import app",
+    "first conversion": (
+        "import workflow_to_mermaid\n"
+        "workflow_to_mermaid.workflow_to_mermaid({'nodes': [{'id': 1, 'type': 'KSampler'}, {'id': 2, 'type': 'VAEDecode'}],"
+        " 'links': [[1, 1, 0, 2, 0, 'LATENT']]}, workflow_to_mermaid.get_default_config())"
+    ),
+}
+
+
+# --- Synthetic Data ---
+def _random_style(rng):
+    style = f"fill:{rng.choice(COLORS)},stroke:{rng.choice(COLORS)},stroke-width:{rng.randint(1, 3)}px"
+    if rng.random() < 0.2:
+        style += f",color:{rng.choice(COLORS)}"
+    return style
+
+
+# Builds a Mermaid config with node_type_count node types (NodeType0...) spread over config groups,
+# and rule_count styling rules split across Node_Styles, Node_Group_Styles, Link_Styles,
+# Link_Group_Styles and Data_Type_Link_Styles. Returns (config, node_types).
+def generate_config(rng, node_type_count, rule_count):
+    node_types = [f"NodeType{i}" for i in range(node_type_count)]
+    group_names = [f"group_{i}" for i in range(max(1, node_type_count // 10))]
+    style_names = [f"style{i}" for i in range(24)]
+    config = {
+        "Default_Graph_Direction": "LR",
+        "Default_Connector": "-->",
+        "Default_Node_Style": "",
+        "Default_Node_Shape": "rectangle",
+        "Add_Link_Labels": True,
+        "Generate_ComfyUI_Subgraphs": True,
+        "Collapse_ComfyUI_Groups": False,  # Measure the full diagram at every size
+        "Style_Definitions": {name: _random_style(rng) for name in style_names},
+        "Node_Group": [{"group_name": name, "nodes": rng.sample(node_types, min(len(node_types), rng.randint(2, 12)))}
+                       for name in group_names],
+        "Node_Styles": {}, "Node_Group_Styles": [], "Link_Styles": [], "Link_Group_Styles": [],
+        "Data_Type_Link_Styles": [],
+    }
+
+    def style_value():
+        return rng.choice(style_names) if rng.random() < 0.7 else _random_style(rng)
+
+    def link_components(rule):
+        if rng.random() < 0.5: rule["connector"] = rng.choice(["-->", "-.->", "==>", "---"])
+        if rng.random() < 0.8: rule["style"] = style_value()
+        if rng.random() < 0.3: rule["add_link_label"] = rng.random() < 0.5
+        return rule
+
+    for rule_index in range(rule_count):
+        kind = rule_index % 5
+        if kind == 0:
+            config["Node_Styles"][rng.choice(node_types)] = {"style": style_value(), "shape": rng.choice(SHAPES)}
+        elif kind == 1:
+            config["Node_Group_Styles"].append({"group_name": rng.choice(group_names), "style": style_value(),
+                                                "shape": rng.choice(SHAPES)})
+        elif kind == 2:
+            config["Link_Styles"].append(link_components({"start_node_type": rng.choice(node_types),
+                                                          "end_node_type": rng.choice(node_types)}))
+        elif kind == 3:
+            rule_type = rng.choice(["from_node", "to_node", "single_to_group", "group_to_group"])
+            rule = {"type": rule_type}
+            if rule_type == "group_to_group":
+                rule["group_name_1"], rule["group_name_2"] = rng.choice(group_names), rng.choice(group_names)
+            elif rule_type == "single_to_group":
+                rule["single_node"], rule["group_name"] = rng.choice(node_types), rng.choice(group_names)
+            elif rng.random() < 0.5:
+                rule["single_node"] = rng.choice(node_types)
+            else:
+                rule["group_name"] = rng.choice(group_names)
+            config["Link_Group_Styles"].append(link_components(rule))
+        else:
+            config["Data_Type_Link_Styles"].append(link_components({"data_type": rng.choice(DATA_TYPES)}))
+    return config, node_types
+
+
+# Builds a workflow of node_count nodes laid out on a jittered grid, link_count links between
+# mostly nearby nodes, and group_count ComfyUI groups framing blocks of the grid.
+def generate_workflow(rng, node_types, node_count, link_count, group_count):
+    columns = max(1, int(node_count ** 0.5))
+    cell_width, cell_height = NODE_WIDTH + NODE_SPACING, NODE_HEIGHT + NODE_SPACING
+    nodes = []
+    for node_index in range(node_count):
+        row, column = divmod(node_index, columns)
+        node = {
+            "id": node_index + 1,
+            "type": rng.choice(node_types),
+            "pos": [column * cell_width + rng.uniform(-20, 20), row * cell_height + rng.uniform(-20, 20)],
+            "size": [NODE_WIDTH + rng.uniform(-80, 80), NODE_HEIGHT + rng.uniform(-40, 40)],
+        }
+        if rng.random() < 0.25:
+            node["title"] = f"{node['type']} #{node_index}"
+        nodes.append(node)
+
+    links = []
+    for link_index in range(link_count):
+        origin = rng.randrange(node_count)
+        target = min(node_count - 1, max(0, origin + rng.randint(-columns * 2, columns * 2)))
+        links.append([link_index + 1, origin + 1, rng.randint(0, 3), target + 1, rng.randint(0, 3), rng.choice(DATA_TYPES)])
+
+    # Groups tile the grid like hand-arranged ComfyUI groups: side by side, each covering part of its tile
+    rows = max(1, (node_count + columns - 1) // columns)
+    tiles_per_side = max(1, math.ceil(group_count ** 0.5))
+    tile_columns, tile_rows = max(1, columns // tiles_per_side), max(1, rows // tiles_per_side)
+    groups = []
+    for group_index in range(group_count):
+        tile_row, tile_column = divmod(group_index, tiles_per_side)
+        block_columns, block_rows = rng.randint(max(1, tile_columns // 2), tile_columns), rng.randint(max(1, tile_rows // 2), tile_rows)
+        left, top = tile_column * tile_columns, tile_row * tile_rows
+        groups.append({
+            "title": f"Group {group_index}",
+            "bounding": [left * cell_width - 30, top * cell_height - 30,
+                         block_columns * cell_width + 10, block_rows * cell_height + 10],
+        })
+    return {"nodes": nodes, "links": links, "groups": groups}
+
+
+# --- Timing ---
+def _time_runs(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def _timing_entry(durations, calls):
+    median = statistics.median(durations)
+    return {"calls": calls, "min_s": min(durations), "median_s": median,
+            "per_call_us": median / calls * 1e6 if calls else 0.0}
+
+
+def benchmark_case(config, node_types, rule_count, node_count, link_count, group_count, repeat, seed, measure_memory=True):
+    rng = random.Random(f"{seed}:{node_count}:{link_count}:{group_count}")
+    workflow = generate_workflow(rng, node_types, node_count, link_count, group_count)
+    compiled_config = compile_config(config)
+    nodes, links, groups = workflow["nodes"], workflow["links"], workflow["groups"]
+    node_id_to_type, _, node_id_to_group_names = build_node_maps(nodes, compiled_config.node_type_to_group_names)
+    style_definitions = compiled_config.style_definitions
+    timings = {}
+    output_chars = 0
+
+    def convert():
+        nonlocal output_chars
+        style_memo.clear()  # Time every run from a cold memo
+        with contextlib.redirect_stdout(io.StringIO()):
+            output_chars = len(workflow_to_mermaid(workflow, compiled_config))
+
+    timings["workflow_to_mermaid"] = _timing_entry(_time_runs(convert, repeat), 1)
+
+    def link_styles():
+        for link_index, link in enumerate(links):
+            get_link_style(link_index, link[1], link[3], node_id_to_type.get(link[1]), node_id_to_type.get(link[3]),
+                           compiled_config, node_id_to_group_names, style_definitions, link_data_type=link[5])
+
+    timings["get_link_style"] = _timing_entry(_time_runs(link_styles, repeat), len(links))
+
+    def node_styles():
+        for node in nodes:
+            get_node_style_and_shape(node["id"], node["type"], compiled_config, node_id_to_group_names, style_definitions)
+
+    timings["get_node_style_and_shape"] = _timing_entry(_time_runs(node_styles, repeat), len(nodes))
+
+    overlap_pairs = [(node, groups[(node_index * 7 + offset) % len(groups)])
+                     for node_index, node in enumerate(nodes) if groups
+                     for offset in range(min(OVERLAP_GROUPS_PER_NODE, len(groups)))]
+
+    def overlaps():
+        for node, group in overlap_pairs:
+            calculate_overlap_area(node, group)
+
+    timings["calculate_overlap_area"] = _timing_entry(_time_runs(overlaps, repeat), len(overlap_pairs))
+
+    style_strings = [style for style in style_definitions.values() if isinstance(style, str)]
+    contrast_inputs = [style_strings[index % len(style_strings)] for index in range(node_count)] if style_strings else []
+
+    def contrast():
+        for style in contrast_inputs:
+            adjust_text_color_for_background(style)
+
+    timings["adjust_text_color_for_background"] = _timing_entry(_time_runs(contrast, repeat), len(contrast_inputs))
+
+    result = {"nodes": node_count, "links": link_count, "groups": group_count, "node_types": len(node_types),
+              "rules": rule_count, "output_chars": output_chars, "timings": timings}
+    if measure_memory:
+        tracemalloc.start()
+        convert()
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+# --- Startup ---
+# Runs code in a fresh interpreter (from this directory, so bytecode caches are warm) and returns
+# (seconds spent in the code, seconds for the whole process including interpreter startup).
+def _time_fresh_interpreter(code):
+    timed_code = ("import time as _startup_time\n_started = _startup_time.perf_counter()\n" + code +
+                  "\nprint('STARTUP_SECONDS', _startup_time.perf_counter() - _started)")
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', timed_code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    process_seconds = time.perf_counter() - started
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith('STARTUP_SECONDS '):
+            return float(line.split()[1]), process_seconds
+    raise RuntimeError(f"Startup scenario printed no timing: {completed.stdout[-200:]}")
+
+
+def benchmark_startup(repeat):
+    results = []
+    for name, code in STARTUP_SCENARIOS.items():
+        _time_fresh_interpreter(code)  # Warm-up: writes bytecode caches
+        runs = [_time_fresh_interpreter(code) for _ in range(repeat)]
+        results.append({"startup": name, "timings": {
+            "in_process": _timing_entry([in_process for in_process, _ in runs], 1),
+            "process": _timing_entry([process for _, process in runs], 1),
+        }})
+    return results
+
+
+def case_key(result):
+    if "startup" in result:
+        return f"startup/{result['startup']}"
+    return f"{result['nodes']}n/{result['links']}l/{result['groups']}g/{result['node_types']}t/{result['rules']}r"
+
+
+# Compares median per-call timings (and peak memory) against a baseline results file.
+# Returns the list of regressions as (case, metric, baseline, current, ratio).
+def compare_with_baseline(results, baseline, threshold):
+    baseline_cases = {case_key(case): case for case in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'case':<36} {'metric':<34} {'baseline':>12} {'current':>12} {'change':>8}")
+    for case in results:
+        key = case_key(case)
+        baseline_case = baseline_cases.get(key)
+        if baseline_case is None:
+            print(f"{key:<36} (no baseline)")
+            continue
+        metrics = [(name, baseline_case["timings"][name]["per_call_us"], timing["per_call_us"], "us")
+                   for name, timing in case["timings"].items() if name in baseline_case["timings"]]
+        if "peak_memory_bytes" in case and "peak_memory_bytes" in baseline_case:
+            metrics.append(("peak_memory", baseline_case["peak_memory_bytes"] / 1024, case["peak_memory_bytes"] / 1024, "KiB"))
+        for name, baseline_value, current_value, unit in metrics:
+            ratio = current_value / baseline_value if baseline_value else 1.0
+            flag = "  REGRESSION" if ratio > 1 + threshold else ""
+            print(f"{key:<36} {name + ' (' + unit + ')':<34} {baseline_value:>12.2f} {current_value:>12.2f} "
+                  f"{(ratio - 1) * 100:>+7.1f}%{flag}")
+            if flag:
+                regressions.append((key, name, baseline_value, current_value, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ComfyUI workflow to Mermaid converter on synthetic workflows.")
+    parser.add_argument('--nodes', default="100,1000,10000", help="Comma-separated node counts (default: 100,1000,10000; up to 100000).")
+    parser.add_argument('--link-ratio', type=float, default=1.5, help="Links per node (default: 1.5).")
+    parser.add_argument('--groups', type=int, help="ComfyUI groups per workflow (default: one per 25 nodes).")
+    parser.add_argument('--node-types', type=int, default=200, help="Distinct node types (default: 200).")
+    parser.add_argument('--rules', type=int, default=400, help="Config styling rules (default: 400).")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per measurement; the median is reported (default: 5).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0).")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the traced peak-memory run.")
+    parser.add_argument('--output', help="Write results to this JSON file.")
+    parser.add_argument('--baseline', help="Compare against a results JSON file written earlier with --output.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown against the baseline (default: 0.2 = 20%%).")
+    parser.add_argument('--startup', action='store_true', help="Also time module imports and a first conversion in fresh interpreters.")
+    args = parser.parse_args(argv)
+
+    node_counts = [int(count) for count in args.nodes.split(',') if count.strip()]
+    config, node_types = generate_config(random.Random(args.seed), args.node_types, args.rules)
+    results = []
+    for node_count in node_counts:
+        link_count = int(node_count * args.link_ratio) if node_count > 0 else 0
+        group_count = args.groups if args.groups is not None else max(1, node_count // 25)
+        print(f"Benchmarking {node_count} nodes, {link_count} links, {group_count} groups...")
+        result = benchmark_case(config, node_types, args.rules, node_count, link_count, group_count,
+                                max(1, args.repeat), args.seed, not args.no_memory)
+        results.append(result)
+        for name, timing in result["timings"].items():
+            print(f"  {name:<34} median {timing['median_s'] * 1000:9.2f} ms  ({timing['per_call_us']:.2f} us/call x {timing['calls']})")
+        if "peak_memory_bytes" in result:
+            print(f"  {'peak memory (workflow_to_mermaid)':<34} {result['peak_memory_bytes'] / (1024 * 1024):9.2f} MiB")
+    if args.startup:
+        print("Benchmarking startup...")
+        for result in benchmark_startup(max(1, args.repeat)):
+            results.append(result)
+            timings = result["timings"]
+            print(f"  {result['startup']:<34} median {timings['in_process']['median_s'] * 1000:9.2f} ms  "
+                  f"(process {timings['process']['median_s'] * 1000:.2f} ms)")
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "seed": args.seed, "repeat": args.repeat, "link_ratio": args.link_ratio,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} measurement(s) regressed by more than {args.threshold * 100:.0f}%.")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
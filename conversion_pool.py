@@ -0,0 +1,211 @@
+# conversion_pool.py
+# Runs large conversions in separate worker processes, so a multi-megabyte workflow neither holds
+# the server's GIL nor ties up a request thread past its deadline.
+#
+# Workers are started on first use and reused. A job that times out, or whose client has gone
+# away, is cancelled by terminating its worker process; a fresh one is started for the next job.
+# At most `workers` jobs run and `max_queued` more wait; anything beyond that is rejected at once.
+
+import queue
+import threading
+import time
+
+POLL_INTERVAL_SECONDS = 0.1  # How often a waiting job checks its deadline and cancellation
+
+
+class PoolSaturatedError(Exception):
+    """All workers are busy and the wait queue is full."""
+
+
+class ConversionTimeoutError(Exception):
+    """The job did not finish before its deadline (it was cancelled)."""
+
+
+class ConversionCancelledError(Exception):
+    """The caller cancelled the job (e.g. the client disconnected)."""
+
+
+class WorkerJobError(Exception):
+    """The conversion failed in the worker. `kind` is 'invalid_json', 'not_object', 'invalid', 'runtime' or 'internal'."""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+# --- Worker Process ---
+# payload is workflow JSON text, or a workflow dict the caller already parsed (sent pickled).
+def _load_workflow(payload, parse_workflow):
+    try:
+        workflow = parse_workflow(payload) if isinstance(payload, (str, bytes)) else payload
+        if isinstance(workflow, dict) and 'workflow_json' in workflow:  # Legacy {"workflow_json": "..."} body
+            inner = workflow['workflow_json']
+            workflow = parse_workflow(inner) if isinstance(inner, (str, bytes)) else inner
+    except ValueError:
+        raise WorkerJobError('invalid_json', "Provided Workflow JSON is invalid")
+    if not isinstance(workflow, dict):
+        raise WorkerJobError('not_object', "Provided JSON is not a valid object (dictionary)")
+    return workflow
+
+
+def _worker_main(conn, selective_parse):
+    from workflow_to_mermaid import compile_config, workflow_to_mermaid
+    from workflow_ingest import parse_workflow_for_conversion
+
+    def parse_workflow(workflow_json):
+        return parse_workflow_for_conversion(workflow_json, selective_parse)
+
+    compiled_config, compiled_version = None, None
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        config_version, config, payload = job
+        try:
+            if compiled_config is None or config_version != compiled_version:
+                compiled_config, compiled_version = compile_config(config), config_version
+            result = ('ok', workflow_to_mermaid(_load_workflow(payload, parse_workflow), compiled_config))
+        except WorkerJobError as e:
+            result = ('error', e.kind, str(e))
+        except ValueError as e:
+            result = ('error', 'invalid', str(e))
+        except RuntimeError as e:
+            result = ('error', 'runtime', str(e))
+        except Exception as e:
+            result = ('error', 'internal', f"{type(e).__name__}: {e}")
+        conn.send(result)
+
+
+# --- Pool ---
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+class ConversionProcessPool:
+    """Bounded pool of conversion worker processes with per-job deadlines and cancellation."""
+
+    # selective_parse: workers read large workflow text with the memory-lean scan of workflow_ingest.py
+    def __init__(self, workers, max_queued, selective_parse=False):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.selective_parse = selective_parse
+        import multiprocessing
+        # Workers are spawned rather than forked: the server process has other threads (and their locks)
+        self._context = multiprocessing.get_context('spawn')
+        self._admission = threading.BoundedSemaphore(workers + max_queued)
+        self._slots = queue.LifoQueue()  # Idle workers (None: not started yet); warm ones are reused first
+        for _ in range(workers):
+            self._slots.put(None)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.worker_starts = 0
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.selective_parse), name="conversion-worker", daemon=True)
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self.worker_starts += 1
+        return _Worker(process, parent_conn)
+
+    @staticmethod
+    def _stop_worker(worker):
+        worker.process.terminate()
+        worker.process.join(1)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join(1)
+        worker.conn.close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # Waits for an idle worker until the deadline, checking for cancellation.
+    def _acquire_worker(self, deadline, is_cancelled):
+        while True:
+            try:
+                return self._slots.get(timeout=POLL_INTERVAL_SECONDS)
+            except queue.Empty:
+                pass
+            if time.monotonic() >= deadline:
+                self._count('timeouts')
+                raise ConversionTimeoutError("Timed out waiting for a conversion worker")
+            if is_cancelled is not None and is_cancelled():
+                self._count('cancelled')
+                raise ConversionCancelledError("Conversion cancelled while queued")
+
+    # Converts `payload` (workflow JSON text or a parsed workflow dict) with the config dict `config` in a worker process and
+    # returns the Mermaid code. is_cancelled, if given, is polled while the job waits or runs.
+    # Raises PoolSaturatedError, ConversionTimeoutError, ConversionCancelledError or WorkerJobError.
+    def convert(self, config_version, config, payload, timeout, is_cancelled=None):
+        if not self._admission.acquire(blocking=False):
+            self._count('rejected')
+            raise PoolSaturatedError("All conversion workers are busy")
+        try:
+            deadline = time.monotonic() + timeout
+            worker = self._acquire_worker(deadline, is_cancelled)
+            try:
+                if worker is None or not worker.process.is_alive():
+                    if worker is not None:
+                        worker.conn.close()
+                    worker = self._start_worker()
+                worker.conn.send((config_version, config, payload))
+                while not worker.conn.poll(POLL_INTERVAL_SECONDS):
+                    if time.monotonic() >= deadline:
+                        self._stop_worker(worker)
+                        worker = None
+                        self._count('timeouts')
+                        raise ConversionTimeoutError(f"Conversion did not finish within {timeout:g} seconds")
+                    if is_cancelled is not None and is_cancelled():
+                        self._stop_worker(worker)
+                        worker = None
+                        self._count('cancelled')
+                        raise ConversionCancelledError("Conversion cancelled")
+                result = worker.conn.recv()
+            except (EOFError, OSError):  # The worker died mid-job (e.g. out of memory)
+                if worker is not None:
+                    self._stop_worker(worker)
+                    worker = None
+                raise WorkerJobError('runtime', "Conversion worker process exited unexpectedly")
+            finally:
+                self._slots.put(worker)
+        finally:
+            self._admission.release()
+        self._count('completed')
+        if result[0] == 'ok':
+            return result[1]
+        raise WorkerJobError(result[1], result[2])
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "max_queued": self.max_queued, "completed": self.completed,
+                    "rejected": self.rejected, "timeouts": self.timeouts, "cancelled": self.cancelled,
+                    "worker_starts": self.worker_starts}
+
+    # Stops idle workers; called when the server shuts down.
+    def close(self):
+        while True:
+            try:
+                worker = self._slots.get_nowait()
+            except queue.Empty:
+                return
+            if worker is None:
+                continue
+            try:
+                worker.conn.send(None)
+                worker.process.join(1)
+            except OSError:
+                pass
+            self._stop_worker(worker)
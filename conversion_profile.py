@@ -0,0 +1,128 @@
+# conversion_profile.py
+# Optional per-phase timing of a conversion, and aggregation of many conversions into
+# latency histograms and percentiles (served by /api/stats).
+
+import bisect
+import collections
+import threading
+import time
+
+# Phases in the order a conversion runs them
+PHASES = ("read", "cache", "parse", "offload", "preprocess", "nodes", "links", "subgraphs", "styles", "join")
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+PERCENTILE_WINDOW = 2048  # Percentiles are taken over the most recent samples per phase
+
+
+class ConversionProfile:
+    """
+    Wall time per phase and counters of one conversion. Phases are switched with enter();
+    time spent in a phase includes whatever the consumer of the output does in between
+    (e.g. writing streamed chunks).
+    """
+
+    __slots__ = ("phase_seconds", "counters", "_phase", "_phase_started")
+
+    def __init__(self):
+        self.phase_seconds = {}
+        self.counters = {}
+        self._phase = None
+        self._phase_started = 0.0
+
+    # Ends the current phase (if any) and starts `phase`; enter(None) just ends the current one.
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self._phase is not None:
+            self.phase_seconds[self._phase] = self.phase_seconds.get(self._phase, 0.0) + now - self._phase_started
+        self._phase = phase
+        self._phase_started = now
+
+    def finish(self):
+        self.enter(None)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def total_seconds(self):
+        return sum(self.phase_seconds.values())
+
+    # Server-Timing header value: one metric per phase plus the total, durations in milliseconds.
+    def server_timing(self):
+        metrics = [f"{phase};dur={self.phase_seconds[phase] * 1000:.3f}" for phase in PHASES if phase in self.phase_seconds]
+        metrics.append(f"total;dur={self.total_seconds() * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+class _PhaseHistogram:
+    __slots__ = ("bucket_counts", "count", "sum_ms", "max_ms", "recent_ms")
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms = collections.deque(maxlen=PERCENTILE_WINDOW)
+
+    def add(self, duration_ms):
+        self.bucket_counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.sum_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.recent_ms.append(duration_ms)
+
+    def summary(self):
+        ordered = sorted(self.recent_ms)
+
+        def percentile(fraction):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+        histogram = {f"le_{bound:g}": bucket_count for bound, bucket_count in zip(HISTOGRAM_BUCKETS_MS, self.bucket_counts)}
+        histogram["le_inf"] = self.bucket_counts[-1]
+        return {
+            "count": self.count, "sum_ms": self.sum_ms, "mean_ms": self.sum_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms, "p50_ms": percentile(0.50), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99),
+            "histogram": histogram,
+        }
+
+
+class ConversionStats:
+    """Thread-safe aggregate of ConversionProfiles: per-phase latency histograms, percentiles and counter totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._counters = {}
+        self.conversions = 0
+
+    def record(self, profile):
+        with self._lock:
+            self.conversions += 1
+            for phase, seconds in profile.phase_seconds.items():
+                histogram = self._phases.get(phase)
+                if histogram is None:
+                    histogram = self._phases[phase] = _PhaseHistogram()
+                histogram.add(seconds * 1000)
+            total = self._phases.get("total")
+            if total is None:
+                total = self._phases["total"] = _PhaseHistogram()
+            total.add(profile.total_seconds() * 1000)
+            for name, value in profile.counters.items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def summary(self):
+        with self._lock:
+            ordered_phases = [phase for phase in PHASES if phase in self._phases] + ["total"] * ("total" in self._phases)
+            return {
+                "conversions": self.conversions,
+                "phases": {phase: self._phases[phase].summary() for phase in ordered_phases},
+                "counters": dict(self._counters),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._phases.clear()
+            self._counters.clear()
+            self.conversions = 0
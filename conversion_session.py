@@ -0,0 +1,311 @@
+# conversion_session.py
+# Incremental re-conversion: a ConversionSession keeps the rendered nodes, links and ComfyUI group
+# memberships of its last conversion, so a new workflow version (or a JSON Patch against the last
+# one) only recomputes the entries that changed. The output is identical to workflow_to_mermaid.
+
+import copy
+
+from workflow_to_mermaid import (
+    build_workflow_graph,
+    compile_config,
+    GroupSpatialIndex,
+    group_bounding_box,
+    header_lines,
+    intern_style_class,
+    iter_collapsed_lines,
+    iter_style_lines,
+    iter_subgraph_lines,
+    MALFORMED_LINK,
+    mermaid_node_id,
+    render_link,
+    render_node,
+    should_collapse_groups,
+    UNKNOWN_NODE,
+)
+
+_SKIPPED = object()  # Cached result of a link that renders nothing
+
+
+# --- JSON Patch (RFC 6902) ---
+def _parse_pointer(pointer):
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise ValueError(f"Invalid JSON pointer: {pointer!r}")
+    if not pointer:
+        return []
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _list_index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise ValueError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise ValueError(f"Array index out of range: {token}")
+    return index
+
+
+def _get_child(container, token):
+    if isinstance(container, dict):
+        if token not in container:
+            raise ValueError(f"Path member not found: {token!r}")
+        return container[token]
+    if isinstance(container, list):
+        return container[_list_index(container, token)]
+    raise ValueError(f"Cannot traverse into a {type(container).__name__} at {token!r}")
+
+
+def _get_value(document, tokens):
+    for token in tokens:
+        document = _get_child(document, token)
+    return document
+
+
+# Applies JSON Patch operations (add, remove, replace, move, copy, test) and returns the patched document.
+# `document` itself is never modified: containers on the patched paths are copied (once per patch) and
+# everything else is shared, so unchanged nodes and links stay the same objects.
+# Raises ValueError if an operation is malformed, its path does not exist or a test fails.
+def apply_json_patch(document, operations):
+    if not isinstance(operations, list):
+        raise ValueError("JSON Patch must be an array of operations")
+    owned = {}  # id -> container copied by this patch (kept alive so ids stay unique)
+    root = [document]
+
+    def owned_copy(container):
+        if id(container) in owned:
+            return container
+        duplicate = dict(container) if isinstance(container, dict) else list(container)
+        owned[id(duplicate)] = duplicate
+        return duplicate
+
+    # Returns the writable parent container of the path and the last token
+    def writable_parent(tokens):
+        if not isinstance(root[0], (dict, list)):
+            raise ValueError("Cannot patch inside a non-container document")
+        container = root[0] = owned_copy(root[0])
+        for token in tokens[:-1]:
+            child = _get_child(container, token)
+            if not isinstance(child, (dict, list)):
+                raise ValueError(f"Cannot traverse into a {type(child).__name__} at {token!r}")
+            key = token if isinstance(container, dict) else _list_index(container, token)
+            child = container[key] = owned_copy(child)
+            container = child
+        return container, tokens[-1]
+
+    def add(tokens, value):
+        if not tokens:
+            root[0] = value
+            return
+        container, token = writable_parent(tokens)
+        if isinstance(container, dict):
+            container[token] = value
+        else:
+            container.insert(_list_index(container, token, allow_end=True), value)
+
+    def remove(tokens):
+        if not tokens:
+            raise ValueError("Cannot remove the whole document")
+        container, token = writable_parent(tokens)
+        if isinstance(container, dict):
+            if token not in container:
+                raise ValueError(f"Path member not found: {token!r}")
+            return container.pop(token)
+        return container.pop(_list_index(container, token))
+
+    for operation in operations:
+        if not isinstance(operation, dict) or 'op' not in operation or 'path' not in operation:
+            raise ValueError(f"Invalid JSON Patch operation: {operation!r}")
+        op = operation['op']
+        tokens = _parse_pointer(operation['path'])
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise ValueError(f"'{op}' operation requires a 'value'")
+        if op == 'add':
+            add(tokens, operation['value'])
+        elif op == 'remove':
+            remove(tokens)
+        elif op == 'replace':
+            if tokens:
+                remove(tokens)
+            add(tokens, operation['value'])
+        elif op in ('move', 'copy'):
+            from_tokens = _parse_pointer(operation.get('from'))
+            if op == 'move':
+                if tokens[:len(from_tokens)] == from_tokens and len(tokens) > len(from_tokens):
+                    raise ValueError("Cannot move a value into one of its own children")
+                value = remove(from_tokens)
+            else:
+                value = copy.deepcopy(_get_value(root[0], from_tokens))
+            add(tokens, value)
+        elif op == 'test':
+            if _get_value(root[0], tokens) != operation['value']:
+                raise ValueError(f"Test failed at {operation['path']!r}")
+        else:
+            raise ValueError(f"Unsupported JSON Patch operation: {op!r}")
+    return root[0]
+
+
+# --- Incremental Conversion ---
+def _typed(value):
+    # 1, 1.0 and True hash alike but render differently ("N1", "N1.0", "NTrue")
+    return value.__class__, value
+
+
+class ConversionSession:
+    """
+    Converts successive versions of one workflow. Rendered nodes are cached by (id, label, type, groups),
+    links by their endpoints, data type and endpoint types/groups, and group memberships by node box
+    while the group boxes stay the same. Each conversion keeps only the entries it used, so the
+    caches hold exactly the last version.
+    """
+
+    def __init__(self, config_param):
+        self.compiled_config = compile_config(config_param)
+        self.workflow = None
+        self.last_stats = {}
+        self._clear_caches()
+
+    def _clear_caches(self):
+        self._node_cache = {}
+        self._link_cache = {}
+        self._group_cache = {}
+        self._groups_signature = None
+        self._spatial_index = None
+
+    def set_config(self, config_param):
+        self.compiled_config = compile_config(config_param)
+        self._clear_caches()
+
+    # Converts a full workflow version; returns the Mermaid code.
+    def convert(self, workflow):
+        if not isinstance(workflow, dict):
+            raise ValueError("Provided JSON is not a valid object (dictionary)")
+        compiled_config = self.compiled_config
+        stats = {"nodes": 0, "nodes_rendered": 0, "links": 0, "links_rendered": 0,
+                 "group_memberships_computed": 0, "group_index_rebuilt": False}
+
+        graph = build_workflow_graph(workflow, compiled_config.node_type_to_group_names)
+        lines = header_lines(compiled_config)
+        comfy_groups = workflow.get('groups', [])
+
+        # --- Collapsed Groups: rendered in full, only group memberships are reused ---
+        group_assignments = None
+        if comfy_groups and graph.node_count and should_collapse_groups(compiled_config, graph.node_count):
+            group_assignments = self._assign_nodes_to_groups(graph, comfy_groups, stats)
+            if group_assignments:
+                lines.extend(iter_collapsed_lines(graph, comfy_groups, group_assignments, compiled_config))
+                stats["nodes"] = len(graph.node_ids)
+                stats["links"] = len(graph.link_starts)
+                self._node_cache = {}
+                self._link_cache = {}
+                self.workflow = workflow
+                self.last_stats = stats
+                return "\n".join(lines)
+
+        node_style_list = []
+        link_style_list = []
+        style_classes = {} if compiled_config.node_style_mode == 'shorthand' else None
+
+        # --- Nodes ---
+        node_cache = {}
+        for node_id_num, entry in zip(graph.node_ids, graph.node_entries):
+            stats["nodes"] += 1
+            display_label = graph.entry_labels[entry]
+            node_type = graph.entry_type(entry)
+            node_groups = graph.entry_groups(entry)
+            # Groups normally follow from the type, but a duplicate ID can leave another node's groups behind
+            key = (_typed(node_id_num), _typed(display_label), _typed(node_type), node_groups)
+            try:
+                rendered = node_cache.get(key) or self._node_cache.get(key)
+            except TypeError:  # Unhashable fields are rendered every time
+                key, rendered = None, None
+            if rendered is None:
+                nodetext, node_style = render_node(node_id_num, display_label, node_type, compiled_config, node_groups)
+                rendered = (nodetext, node_style, mermaid_node_id(node_id_num, compiled_config.compact_node_ids))
+                stats["nodes_rendered"] += 1
+            if key is not None:
+                node_cache[key] = rendered
+            if rendered[1]:
+                node_style_list.append((rendered[2], rendered[1]))
+                if style_classes is not None:  # The class names depend on the order of use, so aren't cached
+                    lines.append(rendered[0] + ":::" + intern_style_class(style_classes, rendered[1]))
+                    continue
+            lines.append(rendered[0])
+
+        # --- Links ---
+        lines.append("    %% Connections")
+        link_cache = {}
+        for i, (link, start_entry, end_entry) in enumerate(zip(graph.links, graph.link_starts, graph.link_ends)):
+            stats["links"] += 1
+            key = None
+            rendered = None
+            if start_entry != MALFORMED_LINK:
+                try:
+                    key = (_typed(link[0]), _typed(link[1]), _typed(link[3]), _typed(link[5]),
+                           graph.entry_type(start_entry), graph.entry_type(end_entry),
+                           graph.entry_groups(start_entry), graph.entry_groups(end_entry),
+                           start_entry != UNKNOWN_NODE, end_entry != UNKNOWN_NODE)
+                    rendered = link_cache.get(key) or self._link_cache.get(key)
+                except TypeError:
+                    key, rendered = None, None
+            if rendered is None:
+                rendered = render_link(link, start_entry, end_entry, graph, compiled_config, link_index=i) or _SKIPPED
+                stats["links_rendered"] += 1
+            if key is not None:
+                link_cache[key] = rendered
+            if rendered is _SKIPPED:
+                continue
+            if rendered[1]:
+                link_style_list.append((i, rendered[1]))
+            lines.append(rendered[0])
+
+        # --- ComfyUI Groups ---
+        if group_assignments is None:  # Already empty if collapsing found no grouped nodes
+            group_assignments = {}
+            if compiled_config.generate_comfyui_subgraphs and comfy_groups and graph.node_count:
+                group_assignments = self._assign_nodes_to_groups(graph, comfy_groups, stats)
+        lines.extend(iter_subgraph_lines(group_assignments, comfy_groups, compiled_config.compact_node_ids))
+
+        # --- Styles ---
+        lines.extend(iter_style_lines(node_style_list, link_style_list, compiled_config.node_style_mode, style_classes,
+                                      compiled_config.link_style_mode))
+
+        self._node_cache = node_cache
+        self._link_cache = link_cache
+        self.workflow = workflow
+        self.last_stats = stats
+        return "\n".join(lines)
+
+    # Returns {group_index: [node ids]} like assign_nodes_to_comfy_groups, reusing the memberships of
+    # unchanged node boxes while the group boxes stay the same.
+    def _assign_nodes_to_groups(self, graph, comfy_groups, stats):
+        group_assignments = {}
+        groups_signature = tuple(group_bounding_box(group) if isinstance(group, dict) else None
+                                 for group in comfy_groups)
+        if groups_signature != self._groups_signature or self._spatial_index is None:
+            self._spatial_index = GroupSpatialIndex(comfy_groups)
+            self._groups_signature = groups_signature
+            self._group_cache = {}
+            stats["group_index_rebuilt"] = True
+        spatial_index = self._spatial_index
+        group_cache = {}
+        if spatial_index.group_boxes:
+            for position, row in enumerate(graph.box_rows):
+                node_box = graph.node_box(position)
+                group_index = group_cache.get(node_box)
+                if group_index is None:
+                    group_index = self._group_cache.get(node_box)
+                if group_index is None:
+                    group_index = spatial_index.assigned_group(node_box)
+                    stats["group_memberships_computed"] += 1
+                group_cache[node_box] = group_index
+                if group_index != -1:
+                    group_assignments.setdefault(group_index, []).append(graph.node_ids[row])
+        self._group_cache = group_cache
+        return group_assignments
+
+    # Applies JSON Patch operations to the last workflow version and converts the result.
+    def apply_patch(self, operations):
+        if self.workflow is None:
+            raise ValueError("Session has no workflow to patch")
+        return self.convert(apply_json_patch(self.workflow, operations))
@@ -1,20 +1,19 @@
 # mermaid_styles.py
 
-import re
+import hashlib
+import json
+import threading
+import types
 
-try:
-    import webcolors
-
-    WEBCOLORS_AVAILABLE = True
-except ImportError:
-    WEBCOLORS_AVAILABLE = False
+from css_colors import CSS3_NAMED_COLORS
 
 # --- Constants ---
 CONTRAST_THRESHOLD = 4.5
 DEFAULT_DARK_THEME_TEXT_COLOR_RGB = (255, 255, 255)  # White
 
-# --- Style Definitions Cache ---
-style_cache = {}
+DEFAULT_STYLE_MEMO_SIZE = 4096
+DEFAULT_COLLAPSE_NODE_THRESHOLD = 500  # Collapse_ComfyUI_Groups "auto": collapse above this many nodes
+COLOR_CACHE_SIZE = 4096  # Per cache of parsed colors, contrast decisions and adjusted styles
 
 # --- Mermaid Shape Syntax Mapping ---
 MERMAID_SHAPE_SYNTAX = {
@@ -35,20 +34,32 @@ def get_mermaid_shape_syntax(shape_name):
     return MERMAID_SHAPE_SYNTAX.get(shape_name.strip().lower(), DEFAULT_SHAPE_SYNTAX)
 
 
-def parse_color(color_string):
-    if not color_string or not isinstance(color_string, str): return None
+# --- Colors ---
+# Every distinct color string is parsed once, and every distinct fill and style string gets its
+# contrast decision once; repeats are dictionary lookups. The caches are cleared when full.
+_MISSING = object()
+_HEX_DIGITS = frozenset('0123456789abcdef')
+_parsed_colors = {}
+_dark_text_fills = {}  # fill value -> True if the fill needs dark text
+_adjusted_styles = {}
+
+
+def _cache_put(cache, key, value):
+    if len(cache) >= COLOR_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+    return value
+
+
+def _parse_color_uncached(color_string):
     color_string = color_string.strip().lower()
     if color_string.startswith('#'):
-        try:
-            return webcolors.hex_to_rgb(color_string)
-        except (ValueError, AttributeError):  # AttributeError for webcolors not found
-            if len(color_string) == 4:  # Try to expand 3-char hex
-                try:
-                    norm_hex = '#' + color_string[1] * 2 + color_string[2] * 2 + color_string[3] * 2
-                    return webcolors.hex_to_rgb(norm_hex)
-                except (ValueError, AttributeError):
-                    return None
+        hex_digits = color_string[1:]
+        if len(hex_digits) == 3:
+            hex_digits = hex_digits[0] * 2 + hex_digits[1] * 2 + hex_digits[2] * 2
+        if len(hex_digits) != 6 or not _HEX_DIGITS.issuperset(hex_digits):
             return None
+        return int(hex_digits[0:2], 16), int(hex_digits[2:4], 16), int(hex_digits[4:6], 16)
     if color_string.startswith('rgb(') and color_string.endswith(')'):
         try:
             parts = color_string[4:-1].split(',')
@@ -58,23 +69,16 @@ def parse_color(color_string):
             return None
         except (ValueError, IndexError):
             return None
-    if WEBCOLORS_AVAILABLE:
-        try:
-            if "grey" in color_string: color_string = color_string.replace("grey", "gray")  # common alternative
-            return webcolors.name_to_rgb(color_string)
-        except ValueError:
-            return None
-    else:  # Basic fallback if webcolors is not available
-        basic_colors = {
-            "white": (255, 255, 255), "black": (0, 0, 0), "red": (255, 0, 0),
-            "green": (0, 128, 0), "blue": (0, 0, 255), "yellow": (255, 255, 0),
-            "cyan": (0, 255, 255), "magenta": (255, 0, 255),
-            "lightgrey": (211, 211, 211), "lightgray": (211, 211, 211),
-            "grey": (128, 128, 128), "gray": (128, 128, 128),
-            "darkgrey": (169, 169, 169), "darkgray": (169, 169, 169)
-        }
-        return basic_colors.get(color_string, None)
-    return None
+    return CSS3_NAMED_COLORS.get(color_string.replace("grey", "gray"))  # "grey" is a common alternative
+
+
+# Returns the (r, g, b) of a #rgb / #rrggbb, rgb(r, g, b) or CSS3 named color, or None.
+def parse_color(color_string):
+    if not color_string or not isinstance(color_string, str): return None
+    rgb = _parsed_colors.get(color_string, _MISSING)
+    if rgb is _MISSING:
+        rgb = _cache_put(_parsed_colors, color_string, _parse_color_uncached(color_string))
+    return rgb
 
 
 def _calculate_relative_luminance(rgb):
@@ -100,30 +104,44 @@ def calculate_contrast_ratio(rgb1, rgb2):
         return 1.0
 
 
-def adjust_text_color_for_background(style_string):
-    if not style_string or not isinstance(style_string, str): return style_string
-    normalized_style = ','.join(part.strip() for part in style_string.split(',') if part.strip())
-    if re.search(r'(?:^|,)\s*color\s*:', normalized_style, re.IGNORECASE): return normalized_style
+# True if the default (white) text would be unreadable on this fill color.
+def _fill_needs_dark_text(fill_color_value):
+    needs_dark_text = _dark_text_fills.get(fill_color_value)
+    if needs_dark_text is None:
+        bg_rgb = parse_color(fill_color_value)
+        needs_dark_text = bg_rgb is not None and \
+            calculate_contrast_ratio(bg_rgb, DEFAULT_DARK_THEME_TEXT_COLOR_RGB) < CONTRAST_THRESHOLD
+        _cache_put(_dark_text_fills, fill_color_value, needs_dark_text)
+    return needs_dark_text
+
+
+def _adjust_text_color_uncached(style_string):
+    props = [part.strip() for part in style_string.split(',')]
+    props = [prop for prop in props if prop]
+    normalized_style = ','.join(props)
     fill_color_value = None
-    for prop in (p.strip() for p in normalized_style.split(',') if p.strip()):
-        if prop.lower().startswith('fill:'):
-            try:
-                fill_color_value = prop.split(':', 1)[1].strip(); break
-            except IndexError:
-                continue
-    if not fill_color_value: return normalized_style
-    bg_rgb = parse_color(fill_color_value)
-    if bg_rgb is None: return normalized_style
-    contrast = calculate_contrast_ratio(bg_rgb, DEFAULT_DARK_THEME_TEXT_COLOR_RGB)
-    if contrast < CONTRAST_THRESHOLD:
+    for prop in props:
+        name, has_colon, value = prop.partition(':')
+        if has_colon and name.rstrip().lower() == 'color':
+            return normalized_style  # Text color set explicitly
+        if fill_color_value is None and prop[:5].lower() == 'fill:':
+            fill_color_value = value.strip()
+    if fill_color_value and _fill_needs_dark_text(fill_color_value):
         return normalized_style + ",color:#000"  # Add black text for light backgrounds
     return normalized_style
 
 
+# Normalizes a style string and adds black text (color:#000) if its fill is too light for white text.
+def adjust_text_color_for_background(style_string):
+    if not style_string or not isinstance(style_string, str): return style_string
+    adjusted_style = _adjusted_styles.get(style_string)
+    if adjusted_style is None:
+        adjusted_style = _cache_put(_adjusted_styles, style_string, _adjust_text_color_uncached(style_string))
+    return adjusted_style
+
+
 def _resolve_style_alias(style_key_or_value, style_definitions):
     if not style_key_or_value: return ""  # Handle empty or None input gracefully
-    cache_key = (style_key_or_value,)  # Make it a tuple for dict key
-    if cache_key in style_cache: return style_cache[cache_key]
 
     resolved_style = style_key_or_value
     # Heuristic: if it doesn't contain typical CSS characters, it might be a key
@@ -139,11 +157,107 @@ def _resolve_style_alias(style_key_or_value, style_definitions):
         # Consolidate multiple commas and remove leading/trailing ones
         resolved_style = ','.join(part.strip() for part in resolved_style.split(',') if part.strip())
 
-    style_cache[cache_key] = resolved_style
     return resolved_style
 
 
-def get_node_style_and_shape(node_id_num, node_type, config, node_id_to_group_names, style_definitions):
+# --- Style Definitions Cache ---
+class StyleCache:
+    """
+    Thread-safe cache of resolved style aliases and their contrast-adjusted forms,
+    bound to one Style_Definitions dict. It is owned by a CompiledConfig, so every
+    conversion sharing that config version reuses it, and no conversion can clear
+    or poison the cache of another. Reads are lock-free; writes take a lock.
+    """
+
+    def __init__(self, style_definitions):
+        self.style_definitions = style_definitions if isinstance(style_definitions, dict) else {}
+        self._resolved = {}
+        self._adjusted = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, style_key_or_value):
+        if not style_key_or_value: return ""
+        resolved_style = self._resolved.get(style_key_or_value, _MISSING)
+        if resolved_style is _MISSING:
+            resolved_style = _resolve_style_alias(style_key_or_value, self.style_definitions)
+            with self._lock:
+                resolved_style = self._resolved.setdefault(style_key_or_value, resolved_style)
+        return resolved_style
+
+    # Resolves the alias and adds a readable text color for the fill (see adjust_text_color_for_background).
+    def adjusted(self, style_key_or_value):
+        resolved_style = self.resolve(style_key_or_value)
+        if not isinstance(resolved_style, str):
+            return adjust_text_color_for_background(resolved_style)
+        adjusted_style = self._adjusted.get(resolved_style)
+        if adjusted_style is None:
+            adjusted_style = adjust_text_color_for_background(resolved_style)
+            with self._lock:
+                adjusted_style = self._adjusted.setdefault(resolved_style, adjusted_style)
+        return adjusted_style
+
+    def __len__(self):
+        return len(self._resolved)
+
+
+class StyleMemo:
+    """
+    Bounded, thread-safe memo of resolved node and link styles. Keys combine a
+    config version with a resolution signature, so entries from different configs
+    never mix and old versions are evicted (oldest first) once max_entries is reached.
+    Lookups without a config version (plain config dicts) bypass the memo.
+    """
+
+    def __init__(self, max_entries=DEFAULT_STYLE_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind, config_version, *signature):
+        if config_version is None:  # Unknown config: its entries could be served for another one
+            return None
+        key = (kind, config_version) + tuple(tuple(part) if isinstance(part, list) else part for part in signature)
+        try:
+            hash(key)
+        except TypeError:  # Unhashable signature (odd config values): resolve without memo
+            return None
+        return key
+
+    # Lookups take no lock: they run once per node and link. The counts are only reported, so an
+    # increment lost to a concurrent conversion does not matter.
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "max_entries": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self.hits = 0
+            self.misses = 0
+
+
+style_memo = StyleMemo()
+
+
+# Runs the node styling priority cascade. Returns the unresolved (style_key_or_value, shape).
+def _node_style_key_and_shape(node_type, node_groups, config):
     # Defaults
     default_shape_val = config.get('Default_Node_Shape', 'rectangle').strip().lower()
     default_style_key_val = config.get('Default_Node_Style', '')
@@ -175,15 +289,13 @@ def get_node_style_and_shape(node_id_num, node_type, config, node_id_to_group_na
     # Only apply if corresponding component (style or shape) was not found in Priority 1
     if not (style_found and shape_found):
         node_group_styles_config = config.get('Node_Group_Styles', [])
-        # Ensure node_id_to_group_names provides a list, even if empty
-        node_groups_for_current_node = node_id_to_group_names.get(node_id_num, [])
 
-        if isinstance(node_group_styles_config, list) and node_groups_for_current_node:
+        if isinstance(node_group_styles_config, list) and node_groups:
             for group_style_entry in node_group_styles_config:
                 if not isinstance(group_style_entry, dict): continue
                 group_name_in_config = group_style_entry.get('group_name')
 
-                if group_name_in_config in node_groups_for_current_node:
+                if group_name_in_config in node_groups:
                     if not style_found and 'style' in group_style_entry:
                         final_style_key_or_value = group_style_entry['style']
                         style_found = True
@@ -196,167 +308,380 @@ def get_node_style_and_shape(node_id_num, node_type, config, node_id_to_group_na
 
                         # Priority 3: Defaults are already set as initial values for final_shape and final_style_key_or_value
 
+    return final_style_key_or_value, final_shape
+
+
+# node_groups, if given, are the node's config groups; node_id_to_group_names is then not consulted.
+def get_node_style_and_shape(node_id_num, node_type, config, node_id_to_group_names, style_definitions,
+                             memo=None, config_version=None, node_groups=None):
+    if node_groups is None:
+        node_groups = node_id_to_group_names.get(node_id_num, [])
+    if isinstance(config, CompiledConfig):
+        return config.node_style_and_shape(node_type, node_groups)
+
+    # Nodes of the same type and groups resolve identically: serve repeats from the memo
+    memo_key = None
+    if memo is not None:
+        memo_key = memo.make_key('node', config_version, node_type, node_groups)
+        cached = memo.get(memo_key) if memo_key is not None else None
+        if cached is not None:
+            return {"style": cached[0], "shape": cached[1]}
+
+    final_style_key_or_value, final_shape = _node_style_key_and_shape(node_type, node_groups, config)
     resolved_style = _resolve_style_alias(final_style_key_or_value, style_definitions)
     adjusted_style = adjust_text_color_for_background(resolved_style)
 
+    if memo_key is not None:
+        memo.put(memo_key, (adjusted_style, final_shape))
     return {"style": adjusted_style, "shape": final_shape}
 
 
-def _apply_style_component(current_value, new_value_from_rule, is_set_flag):
+def _indexed_rules(index, key):
+    try:
+        return index.get(key, ())
+    except TypeError:  # Unhashable values can never match an indexed rule
+        return ()
+
+
+def _add_to_index(index, key, rule):
+    try:
+        rules = index.setdefault(key, [])
+    except TypeError:
+        return
+    if not rules or rules[-1] is not rule:
+        rules.append(rule)
+
+
+class LinkStyleRules:
     """
-    Helper to update a style component (connector, style, add_label) if it's
-    defined in the rule and not already set by a higher priority rule.
-    Returns the (potentially updated) value and the updated is_set_flag.
+    Link styling rules of one config, compiled into dict indexes so that a link
+    only visits the rules that can match it. Each level keeps the priority order
+    of get_link_style; within a level, matching rules are applied in config order.
     """
-    if new_value_from_rule is not None and not is_set_flag:
-        return new_value_from_rule, True
-    return current_value, is_set_flag
 
+    def __init__(self, config):
+        self.default_connector = config.get('Default_Connector', '-->').strip()
+        self.default_add_label = config.get('Add_Link_Labels', True)
+
+        # Each compiled rule is (order, connector, style, add_link_label)
+        self.point_to_point = {}  # (start_node_type, end_node_type) -> [rule]
+        self.single_to_group = {}  # single_node -> [(group_name, rule)]
+        self.from_node_by_type = {}  # single_node -> [rule]
+        self.from_node_by_group = {}  # group_name -> [rule]
+        self.to_node_by_type = {}
+        self.to_node_by_group = {}
+        self.group_to_group = {}  # (start group, end group) -> [rule], both directions
+        self.data_type = {}  # data_type -> [rule]
 
-def get_link_style(link_index, start_node_id_num, end_node_id_num,
-                   start_node_type, end_node_type,
-                   config, node_id_to_group_names, style_definitions,
-                   link_data_type=None):
-    # Default values from config
-    final_connector = config.get('Default_Connector', '-->').strip()
-    final_add_label = config.get('Add_Link_Labels', True)
-    final_style_key_or_value = ""  # Default link style (resolved from empty string)
-
-    # Flags to track if a component has been set
-    connector_set = False
-    style_set = False
-    add_label_set = False
-
-    # Helper to process a rule dictionary and update components
-    def process_rule(rule_config_dict):
-        nonlocal final_connector, connector_set
-        nonlocal final_style_key_or_value, style_set
-        nonlocal final_add_label, add_label_set
-
-        # Check and apply 'connector'
-        final_connector, connector_set = _apply_style_component(
-            final_connector, rule_config_dict.get('connector'), connector_set
-        )
-        # Check and apply 'style'
-        final_style_key_or_value, style_set = _apply_style_component(
-            final_style_key_or_value, rule_config_dict.get('style'), style_set
-        )
-        # Check and apply 'add_link_label'
-        final_add_label, add_label_set = _apply_style_component(
-            final_add_label, rule_config_dict.get('add_link_label'), add_label_set
-        )
-        # Return True if all components are now set, allowing early exit from loops
-        return connector_set and style_set and add_label_set
-
-    # --- Start of Priority Checks ---
-    all_components_set = lambda: connector_set and style_set and add_label_set
-
-    # Priority 1: Individual Link_Styles (start_node_type to end_node_type)
-    if not all_components_set() and start_node_type and end_node_type:
         link_styles_config = config.get('Link_Styles', [])
         if isinstance(link_styles_config, list):
-            for entry in link_styles_config:
-                if isinstance(entry, dict) and \
-                        entry.get('start_node_type') == start_node_type and \
-                        entry.get('end_node_type') == end_node_type:
-                    if process_rule(entry): break
-
-                    # Prepare group info for subsequent checks
-    start_node_groups = node_id_to_group_names.get(start_node_id_num, [])
-    end_node_groups = node_id_to_group_names.get(end_node_id_num, [])
-    link_group_styles_config = config.get('Link_Group_Styles', [])
-
-    # Priority 2: single_to_group (bidirectional)
-    if not all_components_set() and isinstance(link_group_styles_config, list):
-        for entry in link_group_styles_config:
-            if not isinstance(entry, dict) or entry.get('type') != 'single_to_group':
-                continue
-
-            single_node_cfg = entry.get('single_node')
-            group_name_cfg = entry.get('group_name')
-
-            # Check standard direction: single_node (start) -> group_name (end)
-            if start_node_type == single_node_cfg and group_name_cfg in end_node_groups:
-                if process_rule(entry): break
-            # Check reverse direction: group_name (start) -> single_node (end)
-            elif end_node_type == single_node_cfg and group_name_cfg in start_node_groups:
-                if process_rule(entry): break
-
-            if all_components_set(): break
-
-    # Priority 3a: from_node (single_node or group_name as start)
-    if not all_components_set() and isinstance(link_group_styles_config, list):
-        for entry in link_group_styles_config:
-            if not isinstance(entry, dict) or entry.get('type') != 'from_node':
-                continue
-
-            match = False
-            if start_node_type and entry.get('single_node') == start_node_type:
-                match = True
-            # Check if the rule's group_name is one of the start_node's groups
-            elif entry.get('group_name') and entry.get('group_name') in start_node_groups:
-                match = True
-
-            if match:
-                if process_rule(entry): break
-            if all_components_set(): break
-
-    # Priority 3b: to_node (single_node or group_name as end)
-    if not all_components_set() and isinstance(link_group_styles_config, list):
-        for entry in link_group_styles_config:
-            if not isinstance(entry, dict) or entry.get('type') != 'to_node':
-                continue
-
-            match = False
-            if end_node_type and entry.get('single_node') == end_node_type:
-                match = True
-            # Check if the rule's group_name is one of the end_node's groups
-            elif entry.get('group_name') and entry.get('group_name') in end_node_groups:
-                match = True
-
-            if match:
-                if process_rule(entry): break
-            if all_components_set(): break
-
-    # Priority 4: group_to_group (bidirectional)
-    if not all_components_set() and isinstance(link_group_styles_config, list):
-        for entry in link_group_styles_config:
-            if not isinstance(entry, dict) or entry.get('type') != 'group_to_group':
-                continue
-
-            g1_cfg = entry.get('group_name_1')
-            g2_cfg = entry.get('group_name_2')
-
-            if not (g1_cfg and g2_cfg): continue  # Both group names must be defined in rule
-
-            # Check standard direction: g1_cfg (start) -> g2_cfg (end)
-            if g1_cfg in start_node_groups and g2_cfg in end_node_groups:
-                if process_rule(entry): break
-            # Check reverse direction: g2_cfg (start) -> g1_cfg (end)
-            elif g2_cfg in start_node_groups and g1_cfg in end_node_groups:  # Note: g1_cfg and g2_cfg are from the rule
-                if process_rule(entry): break
-
-            if all_components_set(): break
-
-    # Priority 5: Data_Type_Link_Styles
-    if not all_components_set() and link_data_type is not None:
+            for order, entry in enumerate(link_styles_config):
+                if isinstance(entry, dict):
+                    _add_to_index(self.point_to_point,
+                                  (entry.get('start_node_type'), entry.get('end_node_type')),
+                                  self._compile_rule(order, entry))
+
+        link_group_styles_config = config.get('Link_Group_Styles', [])
+        if isinstance(link_group_styles_config, list):
+            for order, entry in enumerate(link_group_styles_config):
+                if not isinstance(entry, dict): continue
+                rule_type = entry.get('type')
+                rule = self._compile_rule(order, entry)
+                if rule_type == 'single_to_group':
+                    _add_to_index(self.single_to_group, entry.get('single_node'), (entry.get('group_name'), rule))
+                elif rule_type in ('from_node', 'to_node'):
+                    by_type, by_group = (self.from_node_by_type, self.from_node_by_group) if rule_type == 'from_node' \
+                        else (self.to_node_by_type, self.to_node_by_group)
+                    single_node_cfg = entry.get('single_node')
+                    group_name_cfg = entry.get('group_name')
+                    if single_node_cfg:
+                        _add_to_index(by_type, single_node_cfg, rule)
+                    if group_name_cfg:
+                        _add_to_index(by_group, group_name_cfg, rule)
+                elif rule_type == 'group_to_group':
+                    g1_cfg = entry.get('group_name_1')
+                    g2_cfg = entry.get('group_name_2')
+                    if not (g1_cfg and g2_cfg): continue  # Both group names must be defined in rule
+                    _add_to_index(self.group_to_group, (g1_cfg, g2_cfg), rule)
+                    _add_to_index(self.group_to_group, (g2_cfg, g1_cfg), rule)
+
         data_type_link_styles_config = config.get('Data_Type_Link_Styles', [])
         if isinstance(data_type_link_styles_config, list):
-            for entry in data_type_link_styles_config:
+            for order, entry in enumerate(data_type_link_styles_config):
                 if not isinstance(entry, dict): continue
-
                 config_dt = entry.get('data_type')
-                # Ensure link_data_type is compared as string if config_dt is string
-                if isinstance(config_dt, str) and config_dt == str(link_data_type):
-                    if process_rule(entry): break
-                    # No early exit here as it's the last rule-based source before defaults are finalized
+                if isinstance(config_dt, str):
+                    _add_to_index(self.data_type, config_dt, self._compile_rule(order, entry))
+
+    @staticmethod
+    def _compile_rule(order, entry):
+        return order, entry.get('connector'), entry.get('style'), entry.get('add_link_label')
+
+    @staticmethod
+    def _ordered(rules):
+        # Rules gathered from several index buckets: restore config order, drop duplicates
+        if len(rules) > 1:
+            rules_by_order = {rule[0]: rule for rule in rules}
+            rules = [rules_by_order[order] for order in sorted(rules_by_order)]
+        return rules
+
+    def _matching_rule_levels(self, start_node_type, end_node_type, start_node_groups, end_node_groups,
+                              link_data_type):
+        # Priority 1: Individual Link_Styles (start_node_type to end_node_type)
+        if start_node_type and end_node_type:
+            yield _indexed_rules(self.point_to_point, (start_node_type, end_node_type))
+
+        # Priority 2: single_to_group (bidirectional)
+        matches = [rule for group_name, rule in _indexed_rules(self.single_to_group, start_node_type)
+                   if group_name in end_node_groups]
+        matches += [rule for group_name, rule in _indexed_rules(self.single_to_group, end_node_type)
+                    if group_name in start_node_groups]
+        yield self._ordered(matches)
+
+        # Priority 3a: from_node (single_node or group_name as start)
+        matches = list(_indexed_rules(self.from_node_by_type, start_node_type)) if start_node_type else []
+        for group_name in start_node_groups:
+            matches += _indexed_rules(self.from_node_by_group, group_name)
+        yield self._ordered(matches)
+
+        # Priority 3b: to_node (single_node or group_name as end)
+        matches = list(_indexed_rules(self.to_node_by_type, end_node_type)) if end_node_type else []
+        for group_name in end_node_groups:
+            matches += _indexed_rules(self.to_node_by_group, group_name)
+        yield self._ordered(matches)
+
+        # Priority 4: group_to_group (bidirectional)
+        matches = []
+        for start_group in start_node_groups:
+            for end_group in end_node_groups:
+                matches += _indexed_rules(self.group_to_group, (start_group, end_group))
+        yield self._ordered(matches)
+
+        # Priority 5: Data_Type_Link_Styles
+        if link_data_type is not None:
+            yield _indexed_rules(self.data_type, str(link_data_type))
+
+    def resolve(self, start_node_type, end_node_type, start_node_groups, end_node_groups, link_data_type=None):
+        """
+        Returns (connector, style_key_or_value, add_label) for a link. A component
+        comes from the highest priority matching rule that defines it, else the defaults.
+        """
+        connector = style = add_label = None
+        levels = self._matching_rule_levels(start_node_type, end_node_type,
+                                            start_node_groups, end_node_groups, link_data_type)
+        for rules in levels:
+            for _order, rule_connector, rule_style, rule_add_label in rules:
+                if connector is None: connector = rule_connector
+                if style is None: style = rule_style
+                if add_label is None: add_label = rule_add_label
+            if connector is not None and style is not None and add_label is not None:
+                break
+        return (self.default_connector if connector is None else connector,
+                "" if style is None else style,
+                self.default_add_label if add_label is None else add_label)
+
+
+# start_node_groups/end_node_groups, if given, take the place of node_id_to_group_names lookups.
+def get_link_style(link_index, start_node_id_num, end_node_id_num,
+                   start_node_type, end_node_type,
+                   config, node_id_to_group_names, style_definitions,
+                   link_data_type=None, link_rules=None, memo=None, config_version=None,
+                   start_node_groups=None, end_node_groups=None):
+    if start_node_groups is None:
+        start_node_groups = node_id_to_group_names.get(start_node_id_num, [])
+    if end_node_groups is None:
+        end_node_groups = node_id_to_group_names.get(end_node_id_num, [])
+    compiled_config = config if isinstance(config, CompiledConfig) else None
+    if compiled_config is not None:
+        link_rules = compiled_config.link_rules
+        if config_version is None: config_version = compiled_config.version
+
+    # Links with the same endpoint types, groups and data type resolve identically
+    memo_key = None
+    if memo is not None:
+        memo_key = memo.make_key('link', config_version, start_node_type, end_node_type,
+                                 start_node_groups, end_node_groups, link_data_type)
+        cached = memo.get(memo_key) if memo_key is not None else None
+        if cached is not None:
+            return {'connector': cached[0], 'style': cached[1], 'add_label': cached[2]}
+
+    # Compiled rules should be built once per config by the caller; compile here as a fallback
+    if link_rules is None:
+        link_rules = LinkStyleRules(config)
+
+    final_connector, final_style_key_or_value, final_add_label = link_rules.resolve(
+        start_node_type, end_node_type, start_node_groups, end_node_groups, link_data_type
+    )
 
     # Resolve the final style alias for the link style string
-    resolved_style = _resolve_style_alias(final_style_key_or_value, style_definitions)
+    if compiled_config is not None:
+        resolved_style = compiled_config.resolve_style(final_style_key_or_value)
+    else:
+        resolved_style = _resolve_style_alias(final_style_key_or_value, style_definitions)
 
+    if memo_key is not None:
+        memo.put(memo_key, (final_connector, resolved_style, final_add_label))
     return {'connector': final_connector, 'style': resolved_style, 'add_label': final_add_label}
 
 
-def clear_style_cache():
-    global style_cache
-    style_cache = {}
+# Stable hash of a config's content, used as its version for cached style resolution and conversions.
+def config_fingerprint(config):
+    try:
+        canonical = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    except (TypeError, ValueError):  # Non-string keys cannot be sorted
+        canonical = repr(config)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _build_node_type_to_group_names(node_group_config):
+    node_type_to_group_names = {}
+    if not isinstance(node_group_config, list):
+        return node_type_to_group_names
+    for group_def in node_group_config:
+        if isinstance(group_def, dict):
+            group_name = group_def.get('group_name')
+            nodes_in_group = group_def.get('nodes', [])
+            if group_name and isinstance(nodes_in_group, list):
+                for node_type in nodes_in_group:
+                    if isinstance(node_type, str):
+                        if node_type not in node_type_to_group_names:
+                            node_type_to_group_names[node_type] = []
+                        if group_name not in node_type_to_group_names[node_type]:
+                            node_type_to_group_names[node_type].append(group_name)
+    return {node_type: tuple(group_names) for node_type, group_names in node_type_to_group_names.items()}
+
+
+NODE_STYLE_MODES = ('style', 'class', 'shorthand')  # Node_Style_Mode values, see iter_style_lines
+LINK_STYLE_MODES = ('per_link', 'grouped')  # Link_Style_Mode values
+_COLLAPSE_MODES = {'auto': 'auto', 'true': True, '1': True, 'yes': True, 'always': True,
+                   'false': False, '0': False, 'no': False, 'never': False}
+
+
+# Normalizes a Collapse_ComfyUI_Groups value to True, False or 'auto'; returns None if it is not recognized.
+def parse_collapse_mode(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return _COLLAPSE_MODES.get(value.strip().lower())
+    return None
+
+
+class CompiledConfig:
+    """
+    Immutable, precompiled form of a merged config dict. Built once per config
+    version and shared by the converter and the server: it holds the node type to
+    group map, the resolved and contrast-adjusted style of every configured node
+    type, pre-resolved style aliases and the compiled link rules.
+    """
+
+    __slots__ = ('source', 'version', 'graph_direction', 'default_connector', 'add_link_labels',
+                 'generate_comfyui_subgraphs', 'collapse_comfyui_groups', 'collapse_node_threshold',
+                 'node_style_mode', 'link_style_mode', 'compact_node_ids', 'default_node_shape', 'default_node_style',
+                 'style_definitions', 'node_type_to_group_names', 'node_styles_by_type',
+                 'fallback_node_style', 'link_rules', 'style_cache')
+
+    def __init__(self, config):
+        set_field = lambda name, value: object.__setattr__(self, name, value)
+        source = types.MappingProxyType(dict(config))
+        style_definitions = source.get('Style_Definitions', {})
+        set_field('source', source)
+        set_field('version', config_fingerprint(dict(config)))
+        set_field('graph_direction', source.get('Default_Graph_Direction', 'TD').strip())
+        set_field('default_connector', source.get('Default_Connector', '-->').strip())
+        set_field('add_link_labels', source.get('Add_Link_Labels', True))
+        set_field('generate_comfyui_subgraphs', source.get('Generate_ComfyUI_Subgraphs', True))
+        collapse_mode = parse_collapse_mode(source.get('Collapse_ComfyUI_Groups', False))
+        set_field('collapse_comfyui_groups', False if collapse_mode is None else collapse_mode)
+        try:
+            collapse_node_threshold = int(source.get('Collapse_Node_Threshold', DEFAULT_COLLAPSE_NODE_THRESHOLD))
+        except (TypeError, ValueError):
+            collapse_node_threshold = DEFAULT_COLLAPSE_NODE_THRESHOLD
+        set_field('collapse_node_threshold', collapse_node_threshold)
+        node_style_mode = str(source.get('Node_Style_Mode', 'style')).strip().lower()
+        set_field('node_style_mode', node_style_mode if node_style_mode in NODE_STYLE_MODES else 'style')
+        link_style_mode = str(source.get('Link_Style_Mode', 'per_link')).strip().lower()
+        set_field('link_style_mode', link_style_mode if link_style_mode in LINK_STYLE_MODES else 'per_link')
+        set_field('compact_node_ids', str(source.get('Compact_Node_Ids', False)).lower() == 'true')
+        set_field('default_node_shape', source.get('Default_Node_Shape', 'rectangle'))
+        set_field('style_definitions', style_definitions)
+        set_field('style_cache', StyleCache(style_definitions))
+        set_field('node_type_to_group_names', _build_node_type_to_group_names(source.get('Node_Group', [])))
+        set_field('link_rules', LinkStyleRules(source))
+
+        # Pre-resolve every alias and every style value referenced by the config.
+        # Unhashable values are left to fail only if a conversion actually uses them.
+        if isinstance(style_definitions, dict):
+            for alias in style_definitions:
+                self.adjusted_style(alias)
+        for style_value in self._referenced_style_values(source):
+            try:
+                self.resolve_style(style_value)
+            except TypeError:
+                pass
+
+        default_node_style_key = source.get('Default_Node_Style', '').strip()
+        set_field('default_node_style', self.adjusted_style(default_node_style_key))
+
+        # Every configured node type resolves to one (style, shape): precompute them all
+        node_styles_config = source.get('Node_Styles', {})
+        configured_types = set(self.node_type_to_group_names)
+        if isinstance(node_styles_config, dict):
+            configured_types.update(node_styles_config)
+        node_styles_by_type = {}
+        for node_type in configured_types:
+            try:
+                node_styles_by_type[node_type] = self._compute_node_style(
+                    node_type, self.node_type_to_group_names.get(node_type, ()))
+            except TypeError:
+                node_styles_by_type[node_type] = None  # Resolved (and fails) on use
+        set_field('node_styles_by_type', node_styles_by_type)
+        set_field('fallback_node_style', self._compute_node_style(_UNCONFIGURED_NODE_TYPE, ()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledConfig is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledConfig is immutable")
+
+    @staticmethod
+    def _referenced_style_values(source):
+        node_styles_config = source.get('Node_Styles', {})
+        if isinstance(node_styles_config, dict):
+            for entry in node_styles_config.values():
+                if isinstance(entry, str): yield entry
+                elif isinstance(entry, dict): yield entry.get('style')
+        for rules_key in ('Node_Group_Styles', 'Link_Styles', 'Link_Group_Styles', 'Data_Type_Link_Styles'):
+            rules = source.get(rules_key, [])
+            if isinstance(rules, list):
+                for entry in rules:
+                    if isinstance(entry, dict): yield entry.get('style')
+
+    def resolve_style(self, style_key_or_value):
+        return self.style_cache.resolve(style_key_or_value)
+
+    def adjusted_style(self, style_key_or_value):
+        return self.style_cache.adjusted(style_key_or_value)
+
+    def _compute_node_style(self, node_type, node_groups):
+        style_key_or_value, shape = _node_style_key_and_shape(node_type, node_groups, self.source)
+        return self.adjusted_style(style_key_or_value), shape
+
+    # Returns {"style", "shape"} for a node; precomputed unless the caller supplies non-standard groups.
+    def node_style_and_shape(self, node_type, node_groups=None):
+        expected_groups = self.node_type_to_group_names.get(node_type, ())
+        style_and_shape = None
+        if node_groups is None or tuple(node_groups) == expected_groups:
+            style_and_shape = self.node_styles_by_type.get(node_type, self.fallback_node_style)
+        if style_and_shape is None:
+            style_and_shape = self._compute_node_style(node_type, expected_groups if node_groups is None else node_groups)
+        style, shape = style_and_shape
+        return {"style": style, "shape": shape}
+
+
+_UNCONFIGURED_NODE_TYPE = object()  # Matches no Node_Styles key or group
+
+
+def compile_config(config):
+    if isinstance(config, CompiledConfig):
+        return config
+    return CompiledConfig(config)
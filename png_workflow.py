@@ -0,0 +1,131 @@
+# png_workflow.py
+# Reads the ComfyUI workflow JSON embedded in a PNG's text chunks (server-side counterpart
+# of extractWorkflowFromPng in static/script.js).
+#
+# Only chunk headers and the 'workflow' text chunk are read; image data (IDAT) is skipped,
+# via an mmap for local files or seek()/discarding reads for streams.
+
+import mmap
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+WORKFLOW_KEYWORD = b'workflow'
+TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')
+MAX_WORKFLOW_BYTES = 64 * 1024 * 1024  # Upper bound for decompressed zTXt/iTXt payloads
+
+_KEYWORD_PREFIX = WORKFLOW_KEYWORD + b'\x00'  # Keywords are null-terminated
+
+
+# ComfyUI writes UTF-8 even in tEXt chunks (as the browser extractor assumes); the PNG spec says Latin-1.
+def _decode_text(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def _decompress(data):
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, MAX_WORKFLOW_BYTES)
+    except zlib.error:
+        raise ValueError("Found 'workflow' chunk, but its compressed content is corrupt.")
+    if decompressor.unconsumed_tail:
+        raise ValueError("Found 'workflow' chunk, but its content is too large.")
+    return result
+
+
+# Returns the workflow JSON string from a 'workflow' chunk's data (keyword included).
+def _decode_workflow_chunk(chunk_type, chunk_data):
+    text = chunk_data[len(_KEYWORD_PREFIX):]
+    if chunk_type == b'zTXt':
+        # Compression method byte (0 = zlib), then the compressed text
+        json_data = _decode_text(_decompress(text[1:]))
+    elif chunk_type == b'iTXt':
+        # Compression flag, compression method, language tag\0, translated keyword\0, UTF-8 text
+        compressed = text[:1] == b'\x01'
+        _language_tag, _, rest = text[2:].partition(b'\x00')
+        _translated_keyword, _, text = rest.partition(b'\x00')
+        json_data = _decode_text(_decompress(text) if compressed else text)
+    else:
+        json_data = _decode_text(text)
+    if not (json_data.strip().startswith('{') and json_data.strip().endswith('}')):
+        raise ValueError("Found 'workflow' chunk, but content is not valid JSON.")
+    return json_data
+
+
+# Skips `count` bytes forward; non-seekable streams (e.g. uploads, zip members) are read and discarded.
+def _skip(f, count):
+    if f.seekable():
+        f.seek(count, 1)
+        return
+    while count > 0:
+        skipped = len(f.read(min(count, 65536)))
+        if not skipped:
+            break
+        count -= skipped
+
+
+# Walks the chunks of an in-memory or memory-mapped PNG, copying nothing but the workflow chunk.
+# Returns (chunk_type, chunk_data) of the 'workflow' text chunk, or (None, None).
+def _find_workflow_chunk_in_buffer(buffer):
+    if buffer[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+        raise ValueError("Invalid PNG file format.")
+    offset = len(PNG_SIGNATURE)
+    buffer_length = len(buffer)
+    while offset + 8 <= buffer_length:
+        length, chunk_type = struct.unpack_from('>I4s', buffer, offset)
+        data_start = offset + 8
+        if chunk_type == b'IEND':
+            break
+        if chunk_type in TEXT_CHUNK_TYPES and buffer[data_start:data_start + len(_KEYWORD_PREFIX)] == _KEYWORD_PREFIX:
+            return chunk_type, bytes(buffer[data_start:data_start + length])
+        offset = data_start + length + 4  # Chunk data + CRC
+    return None, None
+
+
+# Same walk over a binary stream, reading only chunk headers and text chunk keywords.
+def _find_workflow_chunk_in_stream(f):
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("Invalid PNG file format.")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IEND':
+            break
+        if chunk_type in TEXT_CHUNK_TYPES and length >= len(_KEYWORD_PREFIX):
+            keyword_prefix = f.read(len(_KEYWORD_PREFIX))
+            if keyword_prefix == _KEYWORD_PREFIX:
+                return chunk_type, keyword_prefix + f.read(length - len(_KEYWORD_PREFIX))
+            _skip(f, length - len(keyword_prefix) + 4)
+        else:
+            _skip(f, length + 4)  # Chunk data + CRC
+    return None, None
+
+
+def _find_workflow_chunk_in_file(file_path):
+    with open(file_path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # Empty and non-regular files cannot be mapped
+            return _find_workflow_chunk_in_stream(f)
+        with mapped:
+            return _find_workflow_chunk_in_buffer(mapped)
+
+
+# Returns the workflow JSON string stored under the 'workflow' keyword of a tEXt, zTXt or iTXt chunk.
+# `source` is a file path, a bytes-like object or a binary file object.
+# Raises ValueError if the data is not a PNG or carries no workflow.
+def extract_workflow_from_png(source):
+    if hasattr(source, 'read'):
+        chunk_type, chunk_data = _find_workflow_chunk_in_stream(source)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        chunk_type, chunk_data = _find_workflow_chunk_in_buffer(source)
+    else:
+        chunk_type, chunk_data = _find_workflow_chunk_in_file(source)
+    if chunk_type is None:
+        raise ValueError("Workflow data not found in PNG file.")
+    return _decode_workflow_chunk(chunk_type, chunk_data)
@@ -0,0 +1,182 @@
+# service_metrics.py
+# Counters and histograms for the Flask app, exposed at /metrics in the Prometheus text format.
+#
+# Every thread updates its own shard of the values without taking a lock; a scrape sums the shards.
+# Shards of finished threads (Werkzeug serves each request on a new thread) are folded into one
+# retired shard when the next thread registers or at the next scrape, so they don't pile up.
+
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=''):
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}    # (metric name, label values) -> value
+        self.histograms = {}  # (metric name, label values) -> [bucket counts..., sum]
+
+    def merge(self, other):
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in list(other.histograms.items()):
+            values = values[:]
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = values
+            else:
+                for i, value in enumerate(values):
+                    mine[i] += value
+
+
+class Counter:
+    def __init__(self, registry, name, help_text, label_names=()):
+        self._registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+
+    def inc(self, *label_values, amount=1):
+        counters = self._registry._shard().counters
+        key = (self.name, label_values)
+        counters[key] = counters.get(key, 0) + amount
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, buckets, label_names=()):
+        self._registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(label_names)
+
+    def observe(self, value, *label_values):
+        histograms = self._registry._shard().histograms
+        key = (self.name, label_values)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 2)  # Buckets, +Inf, sum
+        # Linear scan: the bucket lists are short and most observations land in the first few
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[i] += 1
+                break
+        else:
+            values[-2] += 1
+        values[-1] += value
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms plus callback metrics evaluated at scrape time
+    (for values another component already keeps, such as the conversion cache statistics).
+    """
+
+    def __init__(self, namespace=''):
+        self.namespace = namespace
+        self._metrics = []
+        self._callbacks = []  # (name, type, help, function returning [(label dict, value)])
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) of every thread that recorded something
+        self._retired = _Shard()
+        self._lock = threading.Lock()  # Taken once per thread on first use and on scrapes
+
+    def _full_name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire_finished_threads()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_finished_threads(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def counter(self, name, help_text, label_names=()):
+        metric = Counter(self, self._full_name(name), help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, label_names=()):
+        metric = Histogram(self, self._full_name(name), help_text, buckets, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    # `function` returns a number or a list of (label dict, number) pairs; metric_type is 'counter' or 'gauge'.
+    def callback(self, name, help_text, function, metric_type='gauge'):
+        self._callbacks.append((self._full_name(name), metric_type, help_text, function))
+
+    # Sum of all shards (live threads read without locking; a concurrent update may be missed until the next scrape).
+    def _snapshot(self):
+        with self._lock:
+            self._retire_finished_threads()
+            total = _Shard()
+            total.merge(self._retired)
+            for _thread, shard in self._shards:
+                total.merge(shard)
+        return total
+
+    # Returns all metrics in the Prometheus text exposition format (version 0.0.4).
+    def exposition(self):
+        snapshot = self._snapshot()
+        lines = []
+        for metric in self._metrics:
+            if isinstance(metric, Counter):
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} counter")
+                for (name, label_values), value in sorted(snapshot.counters.items()):
+                    if name == metric.name:
+                        lines.append(f"{name}{_format_labels(metric.label_names, label_values)} {_format_value(value)}")
+            else:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} histogram")
+                for (name, label_values), values in sorted(snapshot.histograms.items()):
+                    if name != metric.name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float('inf'),), values[:-1]):
+                        cumulative += bucket_count
+                        labels = _format_labels(metric.label_names, label_values, f'le="{_format_value(float(bound))}"')
+                        lines.append(f"{name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(metric.label_names, label_values)
+                    lines.append(f"{name}_sum{labels} {_format_value(values[-1])}")
+                    lines.append(f"{name}_count{labels} {cumulative}")
+        for name, metric_type, help_text, function in self._callbacks:
+            result = function()
+            samples = result if isinstance(result, list) else [({}, result)]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
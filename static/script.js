@@ -16,7 +16,7 @@ let graphContainer, mermaidDiagramDiv, instructionsDiv, fileInput, loadButton,
     // Settings Modal Elements
     settingsButton, settingsModal, closeSettingsButton,
     settingGraphDirectionSelect, settingGroupNodesSelect, settingDefaultConnectorSelect,
-    settingDefaultShapeSelect, settingAddLinkLabelsSelect,
+    settingDefaultShapeSelect, settingAddLinkLabelsSelect, settingCollapseGroupsSelect,
     saveSettingsButton, settingsFeedbackSpan;
 
 // --- State Variables ---
@@ -160,10 +160,11 @@ async function sendToServer(jsonString) {
     }
     showStatus('Converting workflow...', 'processing');
     try {
+        // The workflow JSON is sent as the raw body; the server parses it once.
         const response = await fetch('/api/convert', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ workflow_json: jsonString }),
+            body: jsonString,
         });
         const data = await response.json();
         if (!response.ok) {
@@ -426,7 +427,7 @@ function handleReloadDiagram() {
             const response = await fetch('/api/convert', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ workflow_json: currentWorkflowJSON }),
+                body: currentWorkflowJSON,
             });
             const data = await response.json();
 
@@ -832,6 +833,10 @@ async function loadCurrentSettings() {
             settingAddLinkLabelsSelect.value = (settings.Add_Link_Labels === true || String(settings.Add_Link_Labels).toLowerCase() === "true") ? "true" : "false";
             settingDefaultConnectorSelect.value = settings.Default_Connector || "-->";
             settingDefaultShapeSelect.value = settings.Default_Node_Shape || "rectangle";
+            if (settingCollapseGroupsSelect) {
+                const collapseMode = String(settings.Collapse_ComfyUI_Groups ?? "false").toLowerCase();
+                settingCollapseGroupsSelect.value = ["true", "auto"].includes(collapseMode) ? collapseMode : "false";
+            }
             hideStatus();
             if (settingsFeedbackSpan) settingsFeedbackSpan.textContent = "";
         } else {
@@ -874,6 +879,9 @@ async function saveAndApplySettings() {
         Default_Connector: settingDefaultConnectorSelect.value,
         Default_Node_Shape: settingDefaultShapeSelect.value
     };
+    if (settingCollapseGroupsSelect) {
+        newSettings.Collapse_ComfyUI_Groups = settingCollapseGroupsSelect.value;
+    }
     showStatus("Saving settings...", "processing");
     settingsFeedbackSpan.textContent = "Saving...";
     saveSettingsButton.disabled = true;
@@ -939,6 +947,7 @@ document.addEventListener('DOMContentLoaded', () => {
     settingGraphDirectionSelect = document.getElementById('setting-graph-direction');
     settingGroupNodesSelect = document.getElementById('setting-group-nodes');
     settingAddLinkLabelsSelect = document.getElementById('setting-add-link-labels');
+    settingCollapseGroupsSelect = document.getElementById('setting-collapse-groups');
     settingDefaultConnectorSelect = document.getElementById('setting-default-connector');
     settingDefaultShapeSelect = document.getElementById('setting-default-shape');
     saveSettingsButton = document.getElementById('save-settings-button');
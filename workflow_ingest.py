@@ -0,0 +1,238 @@
+# workflow_ingest.py
+# Selective loading of workflow JSON for conversion: only the fields the converter reads
+# (nodes[].id/type/title/pos/size, links and groups) become Python objects. Everything else
+# (widgets_values, properties, inputs/outputs, extra, embedded previews and prompt text) is
+# stepped over with regular expressions, without building strings, lists or dicts for it.
+#
+# Skipped values are only checked for closed strings and balanced brackets. Whenever the scan
+# fails, the document is parsed in full instead, so invalid JSON raises the same errors as
+# parse_workflow_json; invalid scalars inside skipped values (e.g. a bare word in widgets_values)
+# are not noticed, though. Workflow files are memory-mapped rather than read into memory.
+#
+# The scan saves memory, not time: it is pure Python and about three times slower than
+# json.loads (more against orjson), so it is opt-in, for places where memory is the constraint: the offload workers (OFFLOAD_SELECTIVE_PARSE in app.py)
+# and batch_convert.py --selective-parse.
+
+import mmap
+import re
+
+from workflow_to_mermaid import parse_workflow_json
+
+NODE_FIELDS = ('id', 'type', 'title', 'pos', 'size')  # What the converter reads from a node
+WORKFLOW_FIELDS = ('nodes', 'links', 'groups', 'workflow_json')  # workflow_json: legacy wrapper (see app.py)
+
+# A full parse (orjson when installed) is always faster; below this size its memory does not matter either
+SELECTIVE_PARSE_MIN_BYTES = 4 * 1024 * 1024
+
+_STRING_PATTERN = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_NESTING_IN_ONE_MATCH = 4  # Brackets nested this deep are stepped over by one regex match
+
+
+# Pattern for a run of text and bracketed groups up to `depth` levels deep, stopping at any other
+# bracket. Text runs are matched atomically (lookahead plus backreference) and the alternatives start
+# with different characters, so a group that does not close backtracks over its items only once.
+def _run_pattern(depth):
+    pattern = b''
+    for level in range(depth + 1):
+        text = rb'(?=(?P<text%d>[^"\[\]{}]+))(?P=text%d)' % (level, level)
+        group = rb'|[\[{]' + pattern + rb'[\]}]' if level else b''
+        pattern = rb'(?:' + text + rb'|' + _STRING_PATTERN + group + rb')*'
+    return pattern
+
+
+# Pattern for one JSON value whose brackets nest at most `depth` levels deep. Scalars are not
+# validated here; values that are kept are decoded (and so validated) on their own.
+def _value_pattern(depth):
+    return (rb'(?:' + _STRING_PATTERN + rb'|[^ \t\n\r,\]}\[{"]+|[\[{]' + _run_pattern(depth - 1) + rb'[\]}])')
+
+
+# Patterns (skip, keep) for the members of an object: `skip` steps over a run of members whose name
+# is none of `kept_names`, `keep` matches one member named one of `decoded_names` and captures its
+# name and value. Both match a member only when it is followed by '}' or by ',' and another member.
+# Members with escaped names or deeper values match neither and are scanned one token at a time.
+def _member_patterns(kept_names, decoded_names):
+    value = _value_pattern(_NESTING_IN_ONE_MATCH)
+    ending = rb'[ \t\n\r]*(?:,[ \t\n\r]*(?=")|(?=\}))'
+    kept = b'|'.join(re.escape(name.encode('utf-8')) for name in kept_names)
+    skip = rb'(?:"(?!(?:' + kept + rb')")[^"\\]*"[ \t\n\r]*:[ \t\n\r]*' + value + ending + rb')*'
+    decoded = b'|'.join(re.escape(name.encode('utf-8')) for name in decoded_names)
+    keep = rb'"(' + decoded + rb')"[ \t\n\r]*:[ \t\n\r]*(' + value + rb')' + ending
+    return re.compile(skip, re.S), re.compile(keep, re.S)
+
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(_STRING_PATTERN, re.S)
+_RUN = re.compile(_run_pattern(_NESTING_IN_ONE_MATCH), re.S)
+_SCALAR = re.compile(rb'[^ \t\n\r,\]}]+')
+_MEMBER_NAME = re.compile(rb'(' + _STRING_PATTERN + rb')[ \t\n\r]*:[ \t\n\r]*', re.S)
+_SEPARATOR = re.compile(rb'[ \t\n\r]*([,\]}])[ \t\n\r]*')
+_UTF8_BOM = b'\xef\xbb\xbf'
+
+_QUOTE = ord('"')
+_OBJECT_START, _OBJECT_END, _ARRAY_START, _ARRAY_END = ord('{'), ord('}'), ord('['), ord(']')
+_OPENERS = frozenset(b'[{')
+_CLOSERS = frozenset(b']}')
+
+
+class _ScanError(ValueError):
+    pass
+
+
+# Returns the end offset of the JSON value starting at pos.
+def _skip_value(buf, pos):
+    first = buf[pos]
+    if first == _QUOTE:
+        string_match = _STRING.match(buf, pos)
+        if string_match is None:
+            raise _ScanError("Unterminated string")
+        return string_match.end()
+    if first in _OPENERS:
+        depth = 0
+        while True:
+            bracket = buf[pos]
+            if bracket in _OPENERS:
+                depth += 1
+            elif bracket in _CLOSERS:
+                depth -= 1
+                if depth == 0:
+                    return pos + 1
+            else:
+                raise _ScanError("Unterminated string")
+            pos = _RUN.match(buf, pos + 1).end()
+    scalar_match = _SCALAR.match(buf, pos)
+    if scalar_match is None:
+        raise _ScanError("Expected a value")
+    return scalar_match.end()
+
+
+# Returns (value, end offset) of the JSON value starting at pos.
+def _decode_value(buf, pos):
+    end = _skip_value(buf, pos)
+    return parse_workflow_json(buf[pos:end]), end
+
+
+class _ObjectScanner:
+    """What to keep from an object: handlers maps member names to functions (buf, pos) -> (value, end offset)."""
+
+    __slots__ = ("handlers", "skip_members", "keep_member", "kept_names")
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        decoded_names = [name for name, handler in handlers.items() if handler is _decode_value]
+        self.skip_members, self.keep_member = _member_patterns(handlers, decoded_names)
+        self.kept_names = {name.encode('utf-8'): name for name in decoded_names}
+
+    # Returns (dict of the members that have a handler, end offset) of the object starting at pos.
+    # A repeated member replaces the earlier one, as in json.
+    def scan(self, buf, pos):
+        members = {}
+        pos = _WHITESPACE.match(buf, pos + 1).end()
+        if buf[pos] == _OBJECT_END:
+            return members, pos + 1
+        while True:
+            pos = self.skip_members.match(buf, pos).end()
+            if buf[pos] == _OBJECT_END:  # Only after a member: the patterns never stop after a comma
+                return members, pos + 1
+            member_match = self.keep_member.match(buf, pos)
+            if member_match is not None:
+                members[self.kept_names[member_match.group(1)]] = parse_workflow_json(member_match.group(2))
+                pos = member_match.end()
+                continue
+            name_match = _MEMBER_NAME.match(buf, pos)
+            if name_match is None:
+                raise _ScanError("Expected a member name")
+            raw_name = name_match.group(1)
+            name = parse_workflow_json(raw_name) if b'\\' in raw_name else raw_name[1:-1].decode('utf-8')
+            handler = self.handlers.get(name)
+            if handler is None:
+                pos = _skip_value(buf, name_match.end())
+            else:
+                members[name], pos = handler(buf, name_match.end())
+            separator_match = _SEPARATOR.match(buf, pos)
+            if separator_match is None:
+                raise _ScanError("Expected ',' or '}'")
+            separator = separator_match.group(1)
+            if separator == b'}':
+                return members, separator_match.end()
+            pos = separator_match.end()
+            if separator != b',' or buf[pos] != _QUOTE:
+                raise _ScanError("Expected a member after ','")
+
+
+# Returns (node list, end offset) of the 'nodes' array starting at pos, keeping NODE_FIELDS of each node.
+def _scan_nodes(buf, pos):
+    if buf[pos] != _ARRAY_START:
+        return _decode_value(buf, pos)
+    nodes = []
+    pos = _WHITESPACE.match(buf, pos + 1).end()
+    if buf[pos] == _ARRAY_END:
+        return nodes, pos + 1
+    while True:
+        if buf[pos] == _OBJECT_START:
+            node, pos = _NODE_SCANNER.scan(buf, pos)
+        else:
+            node, pos = _decode_value(buf, pos)
+        nodes.append(node)
+        separator_match = _SEPARATOR.match(buf, pos)
+        if separator_match is None:
+            raise _ScanError("Expected ',' or ']'")
+        separator = separator_match.group(1)
+        if separator == b']':
+            return nodes, separator_match.end()
+        if separator != b',':
+            raise _ScanError("Expected ',' or ']'")
+        pos = separator_match.end()
+
+
+_NODE_SCANNER = _ObjectScanner({name: _decode_value for name in NODE_FIELDS})
+_WORKFLOW_SCANNER = _ObjectScanner({**{name: _decode_value for name in WORKFLOW_FIELDS}, 'nodes': _scan_nodes})
+
+
+# allow_bom: the text came as bytes, where json accepts a leading UTF-8 byte order mark.
+def _scan_workflow(buf, allow_bom=True):
+    start = len(_UTF8_BOM) if allow_bom and buf[:len(_UTF8_BOM)] == _UTF8_BOM else 0
+    pos = _WHITESPACE.match(buf, start).end()
+    if buf[pos] != _OBJECT_START:
+        raise _ScanError("Not an object")  # Parsed in full, which reports it like any other workflow
+    workflow, pos = _WORKFLOW_SCANNER.scan(buf, pos)
+    if _WHITESPACE.match(buf, pos).end() != len(buf):
+        raise _ScanError("Extra data")
+    return workflow
+
+
+# Parses workflow JSON text (str or bytes) into a dict holding only WORKFLOW_FIELDS, each node only
+# NODE_FIELDS. Anything that is not a JSON object is returned as parse_workflow_json returns it.
+# Raises ValueError (json.JSONDecodeError) for invalid JSON.
+def parse_workflow_fields(workflow_json):
+    buf = workflow_json
+    if isinstance(buf, str):
+        buf = buf.encode('utf-8', 'surrogatepass')
+    elif isinstance(buf, memoryview):
+        buf = buf.tobytes()
+    try:
+        return _scan_workflow(buf, allow_bom=not isinstance(workflow_json, str))
+    except (ValueError, IndexError):  # ValueError includes _ScanError and UnicodeDecodeError
+        return parse_workflow_json(workflow_json)
+
+
+# Reads a workflow JSON file like parse_workflow_fields. The file is memory-mapped, so skipped
+# parts are never copied into the process (and only paged in while they are scanned).
+def read_workflow_file_fields(path):
+    with open(path, 'rb') as workflow_file:
+        try:
+            mapped = mmap.mmap(workflow_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # Empty files and files that cannot be mapped
+            return parse_workflow_fields(workflow_file.read())
+        with mapped:
+            try:
+                return _scan_workflow(mapped)
+            except (ValueError, IndexError):
+                return parse_workflow_json(mapped[:])
+
+
+# What the converters parse workflow text with: with selective=True, parse_workflow_fields for text
+# of at least SELECTIVE_PARSE_MIN_BYTES; parse_workflow_json otherwise.
+def parse_workflow_for_conversion(workflow_json, selective=False):
+    if selective and len(workflow_json) >= SELECTIVE_PARSE_MIN_BYTES:
+        return parse_workflow_fields(workflow_json)
+    return parse_workflow_json(workflow_json)
@@ -1,14 +1,23 @@
+import array
+import io
 import json
+import math
 import os
 import numbers
-import traceback  # Keep for error handling
+import threading
+import types
 
 try:
 
     from mermaid_styles import (
         get_node_style_and_shape,
         get_link_style,
-        clear_style_cache,
+        CompiledConfig,
+        compile_config,
+        config_fingerprint,
+        parse_collapse_mode,
+        DEFAULT_COLLAPSE_NODE_THRESHOLD,
+        style_memo,
         get_mermaid_shape_syntax,
         _resolve_style_alias,  # Keep for default node style resolution
         adjust_text_color_for_background  # Keep for default node style resolution
@@ -30,10 +39,37 @@ except ImportError:
         return {'connector': '-->', 'style': '', 'add_label': True}
 
 
-    def clear_style_cache():
+    class CompiledConfig:
         pass
 
 
+    def config_fingerprint(config):
+        return repr(config)
+
+
+    DEFAULT_COLLAPSE_NODE_THRESHOLD = 500
+
+
+    def parse_collapse_mode(value):
+        return value if isinstance(value, bool) else None
+
+
+    def compile_config(config):  # Minimal stand-in exposing the fields the converter reads
+        return types.SimpleNamespace(
+            source=config, version=config_fingerprint(config),
+            graph_direction=config.get('Default_Graph_Direction', 'TD').strip(),
+            default_connector=config.get('Default_Connector', '-->').strip(),
+            generate_comfyui_subgraphs=config.get('Generate_ComfyUI_Subgraphs', True),
+            collapse_comfyui_groups=parse_collapse_mode(config.get('Collapse_ComfyUI_Groups')) or False,
+            collapse_node_threshold=DEFAULT_COLLAPSE_NODE_THRESHOLD,
+            node_style_mode='style', link_style_mode='per_link', compact_node_ids=False,
+            default_node_shape=config.get('Default_Node_Shape', 'rectangle'),
+            default_node_style="", style_definitions={}, node_type_to_group_names={})
+
+
+    style_memo = None
+
+
     def get_mermaid_shape_syntax(shape_name):
         return ('[', ']')
 
@@ -45,6 +81,31 @@ except ImportError:
     def adjust_text_color_for_background(s):
         return s  # Dummy for standalone
 
+_orjson = None  # Optional, much faster parsing of large workflows: the module, or False if not installed
+
+
+def _get_orjson():
+    global _orjson
+    if _orjson is None:  # Imported on the first parse rather than at import time
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+
+# Parses workflow JSON text (str or bytes) with orjson when installed, else the json module.
+# Raises ValueError (json.JSONDecodeError) for invalid JSON.
+def parse_workflow_json(workflow_json):
+    orjson = _get_orjson()
+    if orjson:
+        try:
+            return orjson.loads(workflow_json)
+        except orjson.JSONDecodeError:
+            pass  # orjson rejects NaN/Infinity, big ints and non-UTF-8 bytes that json accepts
+    return json.loads(workflow_json)
+
 # --- Internal Default Configuration ---
 default_config = {
     "Default_Graph_Direction": "TD",
@@ -54,6 +115,11 @@ default_config = {
     "Default_Node_Style": "",
     "Add_Link_Labels": True,
     "Generate_ComfyUI_Subgraphs": True,
+    "Collapse_ComfyUI_Groups": False,  # true, false, or "auto": above Collapse_Node_Threshold nodes
+    "Collapse_Node_Threshold": DEFAULT_COLLAPSE_NODE_THRESHOLD,
+    "Node_Style_Mode": "style",  # "style", "class" or "shorthand": see iter_style_lines
+    "Link_Style_Mode": "per_link",  # "per_link" or "grouped": see iter_style_lines
+    "Compact_Node_Ids": False,
     "Style_Definitions": {},
     "Node_Group_Styles": [],
     "Link_Group_Styles": [],
@@ -64,29 +130,52 @@ default_config = {
 
 # --- Configuration File Loading ---
 config_path = "Mermaid_config.json"  # Relative path
-config = None  # Will hold the final configuration
 
 # Determine the directory of the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Construct the absolute path to the config file
 absolute_config_path = os.path.join(script_dir, config_path)
 
-if os.path.exists(absolute_config_path):
-    try:
-        with open(absolute_config_path, 'r', encoding='utf-8') as f:
-            user_config = json.load(f)
-        print(f"Successfully loaded configuration from '{absolute_config_path}'.")
-        config = default_config.copy()
-        config.update(user_config)
-    except json.JSONDecodeError:
-        print(f"Error: Could not parse config file '{absolute_config_path}'. Using internal default configuration.")
-        config = default_config.copy()
-    except Exception as e:
-        print(f"Unknown error loading config file '{absolute_config_path}': {e}. Using internal default configuration.")
-        config = default_config.copy()
-else:
-    print(f"Warning: Config file '{absolute_config_path}' not found. Using internal default configuration.")
-    config = default_config.copy()
+
+# Loads a config file and merges it over default_config; falls back to the defaults if it is missing or invalid.
+def load_config_file(config_file_path):
+    if os.path.exists(config_file_path):
+        try:
+            with open(config_file_path, 'r', encoding='utf-8') as f:
+                user_config = json.load(f)
+            print(f"Successfully loaded configuration from '{config_file_path}'.")
+            loaded_config = default_config.copy()
+            loaded_config.update(user_config)
+            return loaded_config
+        except json.JSONDecodeError:
+            print(f"Error: Could not parse config file '{config_file_path}'. Using internal default configuration.")
+        except Exception as e:
+            print(f"Unknown error loading config file '{config_file_path}': {e}. Using internal default configuration.")
+    else:
+        print(f"Warning: Config file '{config_file_path}' not found. Using internal default configuration.")
+    return default_config.copy()
+
+
+_default_config = None
+_default_config_lock = threading.Lock()
+
+
+# Returns Mermaid_config.json (next to this script) merged over default_config. Importing the module
+# does no I/O: the file is read on first use.
+def get_default_config():
+    global _default_config
+    if _default_config is None:
+        with _default_config_lock:
+            if _default_config is None:
+                _default_config = load_config_file(absolute_config_path)
+    return _default_config
+
+
+# The loaded config stays available as the module attribute `config`
+def __getattr__(name):
+    if name == 'config':
+        return get_default_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Mermaid Link Style Templates (Unchanged) ---
 LINK_LABEL_FORMATS = {
@@ -97,96 +186,331 @@ LINK_LABEL_FORMATS = {
 }
 
 
-# --- Helper Function (calculate_overlap_area remains unchanged) ---
-# Calculates the overlapping area between a node and a group.
-def calculate_overlap_area(node, group) -> float:
-    node_pos = node.get('pos')
-    node_size = node.get('size')
-    nx, ny, nw, nh = None, None, None, None
-    if isinstance(node_pos, list) and len(node_pos) >= 2:
-        nx, ny = node_pos[0], node_pos[1]
-    elif isinstance(node_pos, dict):
-        px_key = "0" if "0" in node_pos else (0 if 0 in node_pos else None)
-        py_key = "1" if "1" in node_pos else (1 if 1 in node_pos else None)
-        if px_key is not None and py_key is not None:
-            nx = node_pos.get(px_key)
-            ny = node_pos.get(py_key)
-    if isinstance(node_size, list) and len(node_size) >= 2:
-        nw, nh = node_size[0], node_size[1]
-    elif isinstance(node_size, dict):
-        sx_key = "0" if "0" in node_size else (0 if 0 in node_size else None)
-        sy_key = "1" if "1" in node_size else (1 if 1 in node_size else None)
-        if sx_key is not None and sy_key is not None:
-            nw = node_size.get(sx_key)
-            nh = node_size.get(sy_key)
+# --- Helper Functions: Node/Group Geometry ---
+GROUP_OVERLAP_THRESHOLD = 0.4  # Share of a node's area that must lie inside a ComfyUI group
+
+
+# Reads an (x, y) or (width, height) pair stored either as a list or as a {"0": .., "1": ..} dict.
+def _read_pair(value):
+    if isinstance(value, list) and len(value) >= 2:
+        return value[0], value[1]
+    if isinstance(value, dict):
+        first_key = "0" if "0" in value else (0 if 0 in value else None)
+        second_key = "1" if "1" in value else (1 if 1 in value else None)
+        if first_key is not None and second_key is not None:
+            return value.get(first_key), value.get(second_key)
+    return None, None
+
+
+# Parses a node's pos/size once into (left, top, right, bottom, area), or None if it has no usable box.
+def node_bounding_box(node):
+    nx, ny = _read_pair(node.get('pos'))
+    nw, nh = _read_pair(node.get('size'))
     if not all(isinstance(v, numbers.Number) for v in [nx, ny, nw, nh]):
-        return 0.0
+        return None
     if nw <= 0 or nh <= 0:
-        return 0.0
+        return None
+    return nx, ny, nx + nw, ny + nh, float(nw * nh)
+
+
+# Parses a group's 'bounding' [x, y, w, h] into (left, top, right, bottom), or None if unusable.
+def group_bounding_box(group):
     bounding = group.get('bounding')
-    gx, gy, gw, gh = None, None, None, None
-    if isinstance(bounding, list) and len(bounding) >= 4:
-        if all(isinstance(v, numbers.Number) for v in bounding[:4]):
-            gx, gy, gw, gh = bounding[0], bounding[1], bounding[2], bounding[3]
-        else:
-            return 0.0
-    else:
-        return 0.0
+    if not (isinstance(bounding, list) and len(bounding) >= 4):
+        return None
+    if not all(isinstance(v, numbers.Number) for v in bounding[:4]):
+        return None
+    gx, gy, gw, gh = bounding[0], bounding[1], bounding[2], bounding[3]
     if gw <= 0 or gh <= 0:
-        return 0.0
-    node_left = nx
-    node_top = ny
-    node_right = nx + nw
-    node_bottom = ny + nh
-    group_left = gx
-    group_top = gy
-    group_right = gx + gw
-    group_bottom = gy + gh
-    intersection_left = max(node_left, group_left)
-    intersection_top = max(node_top, group_top)
-    intersection_right = min(node_right, group_right)
-    intersection_bottom = min(node_bottom, group_bottom)
+        return None
+    return gx, gy, gx + gw, gy + gh
+
+
+def _box_overlap_area(node_box, group_box) -> float:
+    intersection_left = max(node_box[0], group_box[0])
+    intersection_top = max(node_box[1], group_box[1])
+    intersection_right = min(node_box[2], group_box[2])
+    intersection_bottom = min(node_box[3], group_box[3])
     if intersection_left < intersection_right and intersection_top < intersection_bottom:
         overlap_width = intersection_right - intersection_left
         overlap_height = intersection_bottom - intersection_top
-        overlap_area = overlap_width * overlap_height
-        return float(overlap_area)
-    else:
-        return 0.0
+        return float(overlap_width * overlap_height)
+    return 0.0
 
 
-# --- Main Conversion Function ---
-# Converts a ComfyUI workflow JSON into a Mermaid graph definition string.
-def workflow_to_mermaid(workflow, config_param) -> str:
-    clear_style_cache()
-
-    # --- Configuration Values ---
-    Graph_Direction = config_param.get('Default_Graph_Direction', 'TD').strip()
-    default_connector = config_param.get('Default_Connector', '-->').strip()
-    generate_comfyui_subgraphs = config_param.get('Generate_ComfyUI_Subgraphs', True)
-    style_definitions = config_param.get('Style_Definitions', {})
-    node_group_config = config_param.get('Node_Group', [])
-    default_node_shape = config_param.get('Default_Node_Shape', 'rectangle')
-
-    # --- Pre-process Group Information (Based on Node Type) ---
-    node_type_to_group_names = {}
-    for group_def in node_group_config:
-        if isinstance(group_def, dict):
-            group_name = group_def.get('group_name')
-            nodes_in_group = group_def.get('nodes', [])
-            if group_name and isinstance(nodes_in_group, list):
-                for node_type in nodes_in_group:
-                    if isinstance(node_type, str):
-                        if node_type not in node_type_to_group_names:
-                            node_type_to_group_names[node_type] = []
-                        if group_name not in node_type_to_group_names[node_type]:
-                            node_type_to_group_names[node_type].append(group_name)
-
-    # Map node IDs to their type, title, display label, and config groups
+# Calculates the overlapping area between a node and a group.
+def calculate_overlap_area(node, group) -> float:
+    node_box = node_bounding_box(node)
+    group_box = group_bounding_box(group)
+    if node_box is None or group_box is None:
+        return 0.0
+    return _box_overlap_area(node_box, group_box)
+
+
+class GroupSpatialIndex:
+    """
+    Uniform grid over the bounding boxes of a workflow's ComfyUI groups. A node is
+    only tested against the groups sharing a grid cell with it; groups that are
+    huge or have non-finite bounds are kept aside and tested against every node.
+    """
+
+    MAX_CELLS_PER_BOX = 1024
+
+    def __init__(self, comfy_groups):
+        self.group_boxes = {}
+        for group_index, group in enumerate(comfy_groups):
+            if not isinstance(group, dict): continue
+            group_box = group_bounding_box(group)
+            if group_box is not None:
+                self.group_boxes[group_index] = group_box
+
+        finite_extents = [max(box[2] - box[0], box[3] - box[1]) for box in self.group_boxes.values()
+                          if all(math.isfinite(v) for v in box)]
+        extent = sum(finite_extents) / len(finite_extents) if finite_extents else 0.0
+        self.cell_size = extent if math.isfinite(extent) and extent > 0 else 1.0
+
+        self.cells = {}
+        self.unbucketed = []
+        for group_index, group_box in self.group_boxes.items():
+            cell_range = self._cell_range(group_box)
+            if cell_range is None:
+                self.unbucketed.append(group_index)
+                continue
+            (first_col, last_col), (first_row, last_row) = cell_range
+            for col in range(first_col, last_col + 1):
+                for row in range(first_row, last_row + 1):
+                    self.cells.setdefault((col, row), []).append(group_index)
+        self.all_group_indices = sorted(self.group_boxes)
+
+    def _cell_range(self, box):
+        if not all(math.isfinite(v) for v in box[:4]):
+            return None
+        first_col, last_col = math.floor(box[0] / self.cell_size), math.floor(box[2] / self.cell_size)
+        first_row, last_row = math.floor(box[1] / self.cell_size), math.floor(box[3] / self.cell_size)
+        if (last_col - first_col + 1) * (last_row - first_row + 1) > self.MAX_CELLS_PER_BOX:
+            return None
+        return (first_col, last_col), (first_row, last_row)
+
+    def candidate_groups(self, node_box):
+        cell_range = self._cell_range(node_box)
+        if cell_range is None:
+            return self.all_group_indices
+        (first_col, last_col), (first_row, last_row) = cell_range
+        candidates = set(self.unbucketed)
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                candidates.update(self.cells.get((col, row), ()))
+        return sorted(candidates)
+
+    # Returns (group_index, overlap_area) of the group covering most of the node; earliest group wins ties.
+    def best_group(self, node_box):
+        best_group_index = -1
+        max_overlap = 0.0
+        for group_index in self.candidate_groups(node_box):
+            overlap = _box_overlap_area(node_box, self.group_boxes[group_index])
+            if overlap > max_overlap:
+                max_overlap = overlap
+                best_group_index = group_index
+        return best_group_index, max_overlap
+
+    # Returns the index of the group covering at least GROUP_OVERLAP_THRESHOLD of the node, or -1.
+    def assigned_group(self, node_box):
+        best_group_index, max_overlap = self.best_group(node_box)
+        if best_group_index != -1 and node_box[4] > 0 and max_overlap / node_box[4] >= GROUP_OVERLAP_THRESHOLD:
+            return best_group_index
+        return -1
+
+
+# --- Compact Workflow Graph ---
+UNKNOWN_NODE = -1  # Link endpoint column value: no node has this ID
+MALFORMED_LINK = -2  # Link endpoint column value: the link is not a list of at least 6 items
+
+
+class WorkflowGraph:
+    """
+    Compact form of a workflow's nodes and links, built in one pass and read by every conversion
+    phase instead of the node dicts. Node types and config group sets are interned to small ints;
+    per-node and per-link fields are array columns:
+
+      rows:    every node with an ID, in workflow order (a duplicate ID gives another row);
+      entries: distinct node IDs, compared like dict keys (1, 1.0 and True are one entry), with the
+               label, type and config groups that build_node_maps would map the ID to;
+      boxes:   the rows with a usable pos/size, as left/top/right/bottom/area columns (only kept
+               with with_boxes, i.e. when the workflow has ComfyUI groups to place nodes in);
+      links:   the start and end entry of each link (or UNKNOWN_NODE / MALFORMED_LINK).
+
+    IDs are looked up with entry_of(): in an array indexed by ID when they are small non-negative
+    ints (as ComfyUI assigns them), else in a dict.
+    """
+
+    __slots__ = ("node_count", "node_ids", "node_entries", "entry_index", "entry_by_id", "entry_labels",
+                 "entry_type_codes", "entry_group_codes", "type_names", "group_name_sets", "box_rows", "box_columns",
+                 "exact_boxes", "links", "link_starts", "link_ends")
+
+    def __init__(self, nodes, links, node_type_to_group_names, with_boxes=True):
+        self.node_count = 0  # All nodes, including those without an ID
+        self.node_ids = []
+        self.node_entries = array.array('i')
+        self.entry_index = {}
+        self.entry_by_id = None
+        self.entry_labels = []
+        self.entry_type_codes = array.array('i')
+        self.entry_group_codes = array.array('i')
+        self.type_names = []
+        self.group_name_sets = []
+        self.box_rows = array.array('i')
+        self.box_columns = tuple(array.array('d') for _ in range(5))  # left, top, right, bottom, area
+        self.exact_boxes = {}  # Box position -> box whose values do not fit a double exactly
+        self.links = links
+        self.link_starts = array.array('i')
+        self.link_ends = array.array('i')
+
+        entry_index = self.entry_index
+        type_codes = {}
+        type_group_codes = []  # Type code -> group set code; a node's config groups follow from its type
+        group_codes = {}
+        for node in nodes:
+            self.node_count += 1
+            node_id_num = node.get('id')
+            node_type = node.get('type')
+            node_title = node.get('title')
+            if node_id_num is None:
+                print(f"Warning: Node without ID found, skipped. Node data: {node}")
+                continue
+            display_label = node_title if node_title else (node_type if node_type else 'Unknown')
+            entry = entry_index.get(node_id_num)
+            if entry is None:
+                entry = entry_index[node_id_num] = len(self.entry_labels)
+                self.entry_labels.append(display_label)
+                self.entry_type_codes.append(-1)
+                self.entry_group_codes.append(-1)
+            else:
+                self.entry_labels[entry] = display_label
+            if node_type:
+                type_code = type_codes.get(node_type)
+                if type_code is None:
+                    type_code = type_codes[node_type] = len(self.type_names)
+                    self.type_names.append(node_type)
+                    group_names = node_type_to_group_names.get(node_type, [])
+                    group_code = -1
+                    if group_names:
+                        group_code = group_codes.get(tuple(group_names))
+                        if group_code is None:
+                            group_code = group_codes[tuple(group_names)] = len(self.group_name_sets)
+                            self.group_name_sets.append(group_names)
+                    type_group_codes.append(group_code)
+                self.entry_type_codes[entry] = type_code
+                if type_group_codes[type_code] != -1:  # A type without groups keeps those of an earlier duplicate
+                    self.entry_group_codes[entry] = type_group_codes[type_code]
+            self.node_entries.append(entry)
+            self.node_ids.append(node_id_num)
+            if with_boxes:
+                node_box = node_bounding_box(node)
+                if node_box is not None:
+                    self._add_box(len(self.node_ids) - 1, node_box)
+        self._index_ids_densely()
+
+        entry_of = self.entry_of
+        for link in links:
+            if isinstance(link, list) and len(link) >= 6:
+                self.link_starts.append(entry_of(link[1]))
+                self.link_ends.append(entry_of(link[3]))
+            else:
+                self.link_starts.append(MALFORMED_LINK)
+                self.link_ends.append(MALFORMED_LINK)
+
+    # Replaces the ID dict by an array indexed by ID if the IDs are non-negative ints without large gaps.
+    def _index_ids_densely(self):
+        entry_index = self.entry_index
+        if not entry_index or not all(type(node_id_num) is int and node_id_num >= 0 for node_id_num in entry_index):
+            return
+        size = max(entry_index) + 1
+        if size > 2 * len(entry_index) + 1024:
+            return
+        entry_by_id = array.array('i', [UNKNOWN_NODE]) * size
+        for node_id_num, entry in entry_index.items():
+            entry_by_id[node_id_num] = entry
+        self.entry_by_id = entry_by_id
+        self.entry_index = None
+
+    # Entry of a node ID (as a link endpoint or group member names it), or UNKNOWN_NODE.
+    def entry_of(self, node_id_num):
+        entry_by_id = self.entry_by_id
+        if entry_by_id is None:
+            return self.entry_index.get(node_id_num, UNKNOWN_NODE)
+        if type(node_id_num) is not int:  # Numbers equal to an int ID name its node, as dict keys do
+            if isinstance(node_id_num, bool) or (isinstance(node_id_num, float) and node_id_num.is_integer()):
+                node_id_num = int(node_id_num)
+            else:
+                hash(node_id_num)  # Unhashable IDs fail as they would as dict keys
+                return UNKNOWN_NODE
+        return entry_by_id[node_id_num] if 0 <= node_id_num < len(entry_by_id) else UNKNOWN_NODE
+
+    def _add_box(self, row, node_box):
+        left, top, right, bottom, area = node_box
+        try:
+            float_box = (float(left), float(top), float(right), float(bottom), area)  # area is a float already
+        except OverflowError:
+            float_box = None
+        if float_box != node_box:  # Integers beyond double precision: keep the box as parsed
+            self.exact_boxes[len(self.box_rows)] = node_box
+            float_box = (0.0,) * 5
+        self.box_rows.append(row)
+        for column, value in zip(self.box_columns, float_box):
+            column.append(value)
+
+    # (left, top, right, bottom, area) of the box at `position` in box_rows, as node_bounding_box returns it.
+    def node_box(self, position):
+        if self.exact_boxes and position in self.exact_boxes:
+            return self.exact_boxes[position]
+        left, top, right, bottom, area = self.box_columns
+        return left[position], top[position], right[position], bottom[position], area[position]
+
+    # Type of an entry; None for untyped nodes and for UNKNOWN_NODE.
+    def entry_type(self, entry):
+        type_code = self.entry_type_codes[entry] if entry >= 0 else -1
+        return self.type_names[type_code] if type_code != -1 else None
+
+    # Config group names of an entry; () if it has none and for UNKNOWN_NODE.
+    def entry_groups(self, entry):
+        group_code = self.entry_group_codes[entry] if entry >= 0 else -1
+        return self.group_name_sets[group_code] if group_code != -1 else ()
+
+
+# Builds the WorkflowGraph of a workflow dict.
+def build_workflow_graph(workflow, node_type_to_group_names):
+    return WorkflowGraph(workflow.get('nodes', []), workflow.get('links', []), node_type_to_group_names,
+                         with_boxes=bool(workflow.get('groups', [])))
+
+
+# Assigns each node to the ComfyUI group covering at least GROUP_OVERLAP_THRESHOLD of its area.
+# Returns {group_index: [node ids]}.
+def assign_nodes_to_comfy_groups(graph, comfy_groups):
+    group_assignments = {}
+    spatial_index = GroupSpatialIndex(comfy_groups)
+    if not spatial_index.group_boxes:
+        return group_assignments
+    node_ids = graph.node_ids
+    for position, row in enumerate(graph.box_rows):
+        group_index = spatial_index.assigned_group(graph.node_box(position))
+        if group_index != -1:
+            group_assignments.setdefault(group_index, []).append(node_ids[row])
+    return group_assignments
+
+
+# --- Conversion Steps ---
+# Shared by iter_mermaid_lines and the incremental ConversionSession (conversion_session.py),
+# which must produce identical output.
+EMPTY_TEXT = "    "
+
+
+# Maps node IDs to their type, display label (title or type) and config groups.
+# Returns (node_id_to_type, node_id_to_display_label, node_id_to_group_names).
+# The converter itself reads the same mapping from a WorkflowGraph; the dicts feed the style benchmarks.
+def build_node_maps(nodes, node_type_to_group_names):
     node_id_to_group_names = {}
     node_id_to_type = {}
     node_id_to_display_label = {}
-    nodes = workflow.get('nodes', [])
     for node in nodes:
         node_id_num = node.get('id')
         node_type = node.get('type')
@@ -199,210 +523,458 @@ def workflow_to_mermaid(workflow, config_param) -> str:
                 groups_for_node = node_type_to_group_names.get(node_type, [])
                 if groups_for_node:
                     node_id_to_group_names[node_id_num] = groups_for_node
+    return node_id_to_type, node_id_to_display_label, node_id_to_group_names
 
-    # --- Mermaid Output Initialization ---
-    graph_text = "graph " + Graph_Direction
-    start_text = graph_text + '\n'
-    start_text += "    %% Node Definitions (Label: Title or Type)"
-    empty_text = "    "
-    mermaid_list = []
 
-    # Add default node style definition
-    default_Node_Style_Key = config_param.get('Default_Node_Style', '').strip()
-    default_Node_Style_Value = _resolve_style_alias(default_Node_Style_Key, style_definitions)
-    adjusted_default_style = adjust_text_color_for_background(default_Node_Style_Value)
+_BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
 
-    if adjusted_default_style:
-        node_default_text = empty_text + "classDef default " + adjusted_default_style + ";"
-        mermaid_list.append(node_default_text)
 
-    link_style_list = []
-    node_style_list = []
+# Mermaid ID of a node: "N<id>", or with compact IDs "n<id in base 36>" for IDs written as plain
+# non-negative integers (so "N12345" becomes "n9ix"). Both forms map distinct IDs to distinct names.
+def mermaid_node_id(node_id_num, compact_ids=False):
+    id_text = str(node_id_num).strip()
+    if compact_ids and id_text.isascii() and id_text.isdigit() and (id_text == '0' or id_text[0] != '0'):
+        number = int(id_text)
+        digits = []
+        while True:
+            number, digit = divmod(number, 36)
+            digits.append(_BASE36_DIGITS[digit])
+            if not number:
+                break
+        return "n" + "".join(reversed(digits))
+    return "N" + id_text
 
-    # --- Process Nodes ---
-    for node in nodes:
-        node_id_num = node.get('id')
-        if node_id_num is None:
-            print(f"Warning: Node without ID found, skipped. Node data: {node}")
-            continue
 
-        node_id = "N" + str(node_id_num).strip()
-        display_label = node_id_to_display_label.get(node_id_num, 'Unknown')
-        escaped_label = display_label.replace('"', '#quot;')
-        node_type = node_id_to_type.get(node_id_num)
+def header_lines(compiled_config):
+    lines = ["graph " + compiled_config.graph_direction, "    %% Node Definitions (Label: Title or Type)"]
+    if compiled_config.default_node_style:
+        lines.append(EMPTY_TEXT + "classDef default " + compiled_config.default_node_style + ";")
+    return lines
 
-        style_and_shape_info = {"style": "", "shape": default_node_shape}
-        if node_type:
-            style_and_shape_info = get_node_style_and_shape(
-                node_id_num, node_type, config_param, node_id_to_group_names, style_definitions
-            )
-        else:
-            style_and_shape_info["style"] = adjusted_default_style  # Use default if no type
 
-        node_shape_name = style_and_shape_info['shape']
-        current_node_style = style_and_shape_info['style']
-        shape_syntax = get_mermaid_shape_syntax(node_shape_name)
+# Returns (node line, style); style is "" when the node needs no style statement.
+# node_groups are the node's config groups (WorkflowGraph.entry_groups).
+def render_node(node_id_num, display_label, node_type, compiled_config, node_groups):
+    node_id = mermaid_node_id(node_id_num, compiled_config.compact_node_ids)
+    escaped_label = display_label.replace('"', '#quot;')
 
-        nodetext = f'{empty_text}{node_id}{shape_syntax[0]}"{escaped_label}"{shape_syntax[1]}'
-        mermaid_list.append(nodetext)
+    style_and_shape_info = {"style": "", "shape": compiled_config.default_node_shape}
+    if node_type:
+        style_and_shape_info = get_node_style_and_shape(
+            node_id_num, node_type, compiled_config, None, compiled_config.style_definitions, node_groups=node_groups
+        )
+    else:
+        style_and_shape_info["style"] = compiled_config.default_node_style  # Use default if no type
+
+    shape_syntax = get_mermaid_shape_syntax(style_and_shape_info['shape'])
+    nodetext = f'{EMPTY_TEXT}{node_id}{shape_syntax[0]}"{escaped_label}"{shape_syntax[1]}'
+    return nodetext, style_and_shape_info['style'] or ""
+
+
+# Returns (link line, style) for a link, or None if the link is skipped (a warning is printed).
+# start_entry/end_entry are the link's endpoint columns in the WorkflowGraph `graph`.
+def render_link(link, start_entry, end_entry, graph, compiled_config, link_index=None):
+    if start_entry == MALFORMED_LINK:
+        print(f"Warning: Malformed link found, skipped. Link data: {link}")
+        return None
+
+    link_id = link[0]
+    start_node_id_num = link[1]
+    # slot_origin = link[2] # Unused
+    end_node_id_num = link[3]
+    # slot_dest = link[4] # Unused
+    link_data_type_raw = link[5]
+
+    # Prepare link_data_type: uppercase string, or empty string if None/not string.
+    if isinstance(link_data_type_raw, str):
+        link_data_type = link_data_type_raw.upper()
+    elif link_data_type_raw is not None:
+        link_data_type = str(link_data_type_raw).upper()  # Convert to string and uppercase
+    else:
+        link_data_type = ""  # Default to empty string for None or other non-string types
+
+    link_text_label = str(link_data_type_raw) if link_data_type_raw is not None else ""
+
+    if start_entry == UNKNOWN_NODE or end_entry == UNKNOWN_NODE:
+        print(
+            f"Warning: Link {link_id} connects to unknown or skipped node ({start_node_id_num} -> {end_node_id_num}), skipping this link.")
+        return None
+    start_node_type = graph.entry_type(start_entry)
+    end_node_type = graph.entry_type(end_entry)
+
+    start_node_id = mermaid_node_id(start_node_id_num, compiled_config.compact_node_ids)
+    end_node_id = mermaid_node_id(end_node_id_num, compiled_config.compact_node_ids)
+
+    # Get link style, connector, and label visibility from mermaid_styles
+    link_style_info = get_link_style(
+        link_index, start_node_id_num, end_node_id_num,
+        start_node_type, end_node_type,  # Can be None
+        compiled_config, None, compiled_config.style_definitions,
+        link_data_type=link_data_type,  # Pass the processed data type
+        memo=style_memo,
+        start_node_groups=graph.entry_groups(start_entry), end_node_groups=graph.entry_groups(end_entry)
+    )
 
-        if current_node_style:
-            node_style_list.append({'nodeid': node_id, "style": current_node_style})
+    current_connector = link_style_info['connector']
+    add_label = link_style_info['add_label']
+    current_link_style_value = link_style_info['style']
 
-    # --- Process Links ---
-    mermaid_list.append("    %% Connections")
-    links = workflow.get('links', [])
+    # Optional: Info if styling might be partial due to unknown node types
+    # if start_node_type is None or end_node_type is None:
+    #     print(f"Info: Link {link_id} (Data Type: {link_data_type}) involves unknown node types. Connector: {current_connector}, Style: '{current_link_style_value}', AddLabel: {add_label}")
 
-    for i, link in enumerate(links):
-        if not isinstance(link, list) or len(link) < 6:
-            print(f"Warning: Malformed link found, skipped. Link data: {link}")
-            continue
+    if current_connector not in LINK_LABEL_FORMATS:
+        print(
+            f"Warning: Connector '{current_connector}' for link {link_id} is invalid, using default '{compiled_config.default_connector}'.")
+        current_connector = compiled_config.default_connector
 
-        link_id = link[0]
-        start_node_id_num = link[1]
-        # slot_origin = link[2] # Unused
-        end_node_id_num = link[3]
-        # slot_dest = link[4] # Unused
-        link_data_type_raw = link[5]
-
-        # Prepare link_data_type: uppercase string, or empty string if None/not string.
-        if isinstance(link_data_type_raw, str):
-            link_data_type = link_data_type_raw.upper()
-        elif link_data_type_raw is not None:
-            link_data_type = str(link_data_type_raw).upper()  # Convert to string and uppercase
+    escaped_label = link_text_label.replace('"', '#quot;')
+    if add_label and escaped_label:
+        connector_format = LINK_LABEL_FORMATS.get(current_connector, "-- {} -->")  # Default format
+        connector_text = connector_format.format(escaped_label)
+    else:
+        connector_text = current_connector
+
+    linktext = f"{EMPTY_TEXT}{start_node_id} {connector_text} {end_node_id}"
+    return linktext, current_link_style_value or ""
+
+
+# Yields the subgraph blocks for {group_index: [node ids]}.
+def iter_subgraph_lines(group_assignments, comfy_groups, compact_ids=False):
+    if not group_assignments:
+        return
+    yield "    %% ComfyUI Groups (Subgraphs)"
+    sorted_group_indices = sorted(group_assignments.keys())
+    for group_index in sorted_group_indices:
+        assigned_node_ids = group_assignments[group_index]
+        if 0 <= group_index < len(comfy_groups):
+            group = comfy_groups[group_index]
+            if not isinstance(group, dict): continue
+            title = group.get('title', f'Group_{group_index + 1}')
+            subgraph_title = title.strip()
+            if not subgraph_title: subgraph_title = f'Group_{group_index + 1}'
+            escaped_group_title = subgraph_title.replace('"', '#quot;')
+            subtext = f'{EMPTY_TEXT}subgraph "{escaped_group_title}"'
+            yield subtext
+            for node_id_num in assigned_node_ids:
+                idtext = f"{EMPTY_TEXT}{EMPTY_TEXT}{mermaid_node_id(node_id_num, compact_ids)}"
+                yield idtext
+            yield EMPTY_TEXT + "end"
         else:
-            link_data_type = ""  # Default to empty string for None or other non-string types
-
-        link_text_label = str(link_data_type_raw) if link_data_type_raw is not None else ""
-
-        start_node_type = node_id_to_type.get(start_node_id_num)
-        end_node_type = node_id_to_type.get(end_node_id_num)
+            print(f"Warning: Invalid group_index found while generating ComfyUI groups: {group_index}")
+
+
+# Returns the generated class name ("s0", "s1", ...) of a node style, interning it in style_classes.
+def intern_style_class(style_classes, style):
+    class_name = style_classes.get(style)
+    if class_name is None:
+        class_name = style_classes[style] = f"s{len(style_classes)}"
+    return class_name
+
+
+# Yields the style statements; node_style_list holds (node_id, style), link_style_list (link index, style).
+# node_style_mode (Node_Style_Mode) selects how node styles are written:
+#   "style":     one "style <node> <css>" line per styled node;
+#   "class":     one "classDef" per distinct style, then one "class <node>,<node> <name>" line per style;
+#   "shorthand": only the classDefs, the node lines already end in ":::<name>".
+# style_classes holds the class names already handed out (shorthand mode) and is added to.
+# link_style_mode (Link_Style_Mode) is "per_link" for one "linkStyle <index> <css>" line per styled link,
+# or "grouped" for one "linkStyle <index>,<index> <css>" line per distinct style.
+def iter_style_lines(node_style_list, link_style_list, node_style_mode='style', style_classes=None,
+                     link_style_mode='per_link'):
+    if not (node_style_list or link_style_list):
+        return
+    yield "    %% Styling (Based on Node Type/Group/Data Type)"  # Updated comment
+    if node_style_mode == 'style':
+        for node_id, style in node_style_list:
+            if node_id and style:
+                yield f"{EMPTY_TEXT}style {node_id} {style}"
+    else:
+        style_classes = {} if style_classes is None else style_classes
+        class_members = {}
+        for node_id, style in node_style_list:
+            if node_id and style:
+                class_members.setdefault(intern_style_class(style_classes, style), []).append(node_id)
+        for style, class_name in style_classes.items():
+            yield f"{EMPTY_TEXT}classDef {class_name} {style};"
+        if node_style_mode == 'class':
+            for class_name, node_ids in class_members.items():
+                yield f"{EMPTY_TEXT}class {','.join(node_ids)} {class_name}"
+    if link_style_mode == 'grouped':
+        indices_by_style = {}
+        for index, style in link_style_list:
+            if index is not None and style:
+                indices_by_style.setdefault(style, []).append(str(index).strip())
+        for style, indices in indices_by_style.items():
+            yield f"{EMPTY_TEXT}linkStyle {','.join(indices)} {style}"
+        return
+    for index, style in link_style_list:
+        if index is not None and style:  # Allow empty string style to be applied if explicitly set
+            yield f"{EMPTY_TEXT}linkStyle {str(index).strip()} {style}"
+
+
+# --- Collapsed ComfyUI Groups ---
+# Large diagrams are slow to lay out in the browser. In collapse mode each ComfyUI group is drawn
+# as one summary node, links inside a group are dropped and the links between a pair of groups
+# (or a group and an ungrouped node) are merged into one edge labeled with their data types.
+COLLAPSED_GROUP_SHAPE = "subroutine"
+COLLAPSED_EDGE_MAX_TYPES = 3  # Data types named on an aggregated edge; the rest are summed up as "+N more"
+
+
+# Tells whether a workflow with node_count nodes is drawn with collapsed groups. Collapsing draws
+# ComfyUI groups, so it is off whenever Generate_ComfyUI_Subgraphs is.
+def should_collapse_groups(compiled_config, node_count):
+    if not compiled_config.generate_comfyui_subgraphs:
+        return False
+    collapse_mode = getattr(compiled_config, 'collapse_comfyui_groups', False)
+    if collapse_mode == 'auto':
+        threshold = compiled_config.collapse_node_threshold
+        return 0 < threshold < node_count
+    return collapse_mode is True
+
+
+def _collapsed_group_title(comfy_groups, group_index):
+    group = comfy_groups[group_index]
+    title = str(group.get('title', '')).strip()
+    return title if title else f'Group_{group_index + 1}'
+
+
+# Label of an aggregated edge: data types by descending count, e.g. "IMAGE x3, LATENT".
+def _aggregated_edge_label(type_counts):
+    ordered = sorted(type_counts.items(), key=lambda item: -item[1])  # Stable: ties keep first-seen order
+    parts = [f"{data_type} x{count}" if count > 1 else data_type
+             for data_type, count in ordered[:COLLAPSED_EDGE_MAX_TYPES]]
+    hidden = sum(count for _, count in ordered[COLLAPSED_EDGE_MAX_TYPES:])
+    if hidden:
+        parts.append(f"+{hidden} more")
+    return ", ".join(parts)
+
+
+# Yields the lines following the header for a workflow (WorkflowGraph) whose groups are collapsed.
+# group_assignments is {group_index: [node ids]} as returned by assign_nodes_to_comfy_groups.
+def iter_collapsed_lines(graph, comfy_groups, group_assignments, compiled_config, profile=None):
+    if profile is not None: profile.enter('nodes')
+    entry_collapsed_group = array.array('i', [-1]) * len(graph.entry_labels)  # Entry -> collapsed group index
+    grouped_entries = 0
+    group_shape_syntax = get_mermaid_shape_syntax(COLLAPSED_GROUP_SHAPE)
+    yield "    %% Collapsed ComfyUI Groups (Label: Group Title and Node Count)"
+    for group_index in sorted(group_assignments):
+        assigned_node_ids = group_assignments[group_index]
+        for node_id_num in assigned_node_ids:
+            entry = graph.entry_of(node_id_num)
+            grouped_entries += entry_collapsed_group[entry] == -1
+            entry_collapsed_group[entry] = group_index
+        escaped_title = _collapsed_group_title(comfy_groups, group_index).replace('"', '#quot;')
+        node_count_text = "1 node" if len(assigned_node_ids) == 1 else f"{len(assigned_node_ids)} nodes"
+        yield f'{EMPTY_TEXT}G{group_index}{group_shape_syntax[0]}"{escaped_title} ({node_count_text})"{group_shape_syntax[1]}'
 
-        if start_node_id_num not in node_id_to_display_label or end_node_id_num not in node_id_to_display_label:
-            print(
-                f"Warning: Link {link_id} connects to unknown or skipped node ({start_node_id_num} -> {end_node_id_num}), skipping this link.")
+    node_style_list = []
+    style_classes = {} if compiled_config.node_style_mode == 'shorthand' else None
+    for node_id_num, entry in zip(graph.node_ids, graph.node_entries):
+        if entry_collapsed_group[entry] != -1:
+            continue
+        nodetext, current_node_style = render_node(
+            node_id_num, graph.entry_labels[entry], graph.entry_type(entry), compiled_config, graph.entry_groups(entry))
+        if current_node_style:
+            node_style_list.append((mermaid_node_id(node_id_num, compiled_config.compact_node_ids), current_node_style))
+            if style_classes is not None:
+                nodetext += ":::" + intern_style_class(style_classes, current_node_style)
+        yield nodetext
+
+    # Links between ungrouped nodes are drawn as usual; linkStyle indexes count the edges actually drawn
+    if profile is not None: profile.enter('links')
+    yield "    %% Connections"
+    link_style_list = []
+    edges_emitted = 0
+    links_inside_groups = 0
+    aggregated_edges = {}  # (start id, end id) -> {data type: link count}, in first-seen order
+    for link, start_entry, end_entry in zip(graph.links, graph.link_starts, graph.link_ends):
+        start_group = entry_collapsed_group[start_entry] if start_entry >= 0 else -1
+        end_group = entry_collapsed_group[end_entry] if end_entry >= 0 else -1
+        if start_group == -1 and end_group == -1:
+            rendered_link = render_link(link, start_entry, end_entry, graph, compiled_config, link_index=edges_emitted)
+            if rendered_link is None:
+                continue
+            linktext, current_link_style_value = rendered_link
+            if current_link_style_value:
+                link_style_list.append((edges_emitted, current_link_style_value))
+            edges_emitted += 1
+            yield linktext
             continue
+        if start_entry == UNKNOWN_NODE or end_entry == UNKNOWN_NODE:
+            print(f"Warning: Link {link[0]} connects to unknown or skipped node ({link[1]} -> {link[3]}), skipping this link.")
+            continue
+        if start_group == end_group:
+            links_inside_groups += 1
+            continue
+        start_id = f"G{start_group}" if start_group != -1 else mermaid_node_id(link[1], compiled_config.compact_node_ids)
+        end_id = f"G{end_group}" if end_group != -1 else mermaid_node_id(link[3], compiled_config.compact_node_ids)
+        type_counts = aggregated_edges.setdefault((start_id, end_id), {})
+        data_type = (str(link[5]).upper() if link[5] is not None else "") or "?"
+        type_counts[data_type] = type_counts.get(data_type, 0) + 1
+
+    connector = compiled_config.default_connector
+    if connector not in LINK_LABEL_FORMATS:
+        connector = "-->"
+    for (start_id, end_id), type_counts in aggregated_edges.items():
+        escaped_label = _aggregated_edge_label(type_counts).replace('"', '#quot;')
+        yield f"{EMPTY_TEXT}{start_id} {LINK_LABEL_FORMATS[connector].format(escaped_label)} {end_id}"
+
+    if profile is not None: profile.enter('styles')
+    yield from iter_style_lines(node_style_list, link_style_list, compiled_config.node_style_mode, style_classes,
+                                compiled_config.link_style_mode)
+
+    if profile is not None:
+        profile.enter('join')
+        profile.count('nodes', graph.node_count)
+        profile.count('links', len(graph.link_starts))
+        profile.count('node_styles', len(node_style_list))
+        profile.count('link_styles', len(link_style_list))
+        profile.count('comfy_groups', len(comfy_groups))
+        profile.count('grouped_nodes', grouped_entries)
+        profile.count('collapsed_groups', len(group_assignments))
+        profile.count('links_inside_groups', links_inside_groups)
+        profile.count('aggregated_edges', len(aggregated_edges))
 
-        start_node_id = "N" + str(start_node_id_num).strip()
-        end_node_id = "N" + str(end_node_id_num).strip()
 
-        # Get link style, connector, and label visibility from mermaid_styles
-        link_style_info = get_link_style(
-            i, start_node_id_num, end_node_id_num,
-            start_node_type, end_node_type,  # Can be None
-            config_param, node_id_to_group_names, style_definitions,
-            link_data_type=link_data_type  # Pass the processed data type
-        )
+# --- Main Conversion Function ---
+# Converts a ComfyUI workflow JSON into Mermaid graph definition lines, yielded in output order.
+# config_param is a merged config dict or a CompiledConfig (compiled once and reused across calls).
+# profile is an optional ConversionProfile receiving per-phase times and counters.
+def iter_mermaid_lines(workflow, config_param, profile=None):
+    if profile is not None: profile.enter('preprocess')
+    # --- Configuration Values (precompiled once per config; dicts are compiled here) ---
+    compiled_config = compile_config(config_param)
+    memo_stats_before = style_memo.stats() if style_memo is not None and profile is not None else None
+
+    # One pass over the nodes and links: IDs, labels, interned types and groups, boxes, link endpoints
+    graph = build_workflow_graph(workflow, compiled_config.node_type_to_group_names)
 
-        current_connector = link_style_info['connector']
-        add_label = link_style_info['add_label']
-        current_link_style_value = link_style_info['style']
+    # --- Mermaid Output Initialization ---
+    yield from header_lines(compiled_config)
 
-        # Optional: Info if styling might be partial due to unknown node types
-        # if start_node_type is None or end_node_type is None:
-        #     print(f"Info: Link {link_id} (Data Type: {link_data_type}) involves unknown node types. Connector: {current_connector}, Style: '{current_link_style_value}', AddLabel: {add_label}")
+    # --- Collapsed Groups (large workflows, or when requested) ---
+    comfy_groups = workflow.get('groups', [])
+    group_assignments = None
+    if comfy_groups and graph.node_count and should_collapse_groups(compiled_config, graph.node_count):
+        if profile is not None: profile.enter('subgraphs')
+        group_assignments = assign_nodes_to_comfy_groups(graph, comfy_groups)
+        if group_assignments:
+            yield from iter_collapsed_lines(graph, comfy_groups, group_assignments, compiled_config, profile)
+            _report_style_memo(memo_stats_before, profile)
+            return
 
-        if current_connector not in LINK_LABEL_FORMATS:
-            print(
-                f"Warning: Connector '{current_connector}' for link {link_id} is invalid, using default '{default_connector}'.")
-            current_connector = default_connector
+    link_style_list = []
+    node_style_list = []
+    style_classes = {} if compiled_config.node_style_mode == 'shorthand' else None
 
-        if current_link_style_value:
-            link_style_list.append({"index": i, 'style': current_link_style_value})
+    # --- Process Nodes ---
+    if profile is not None: profile.enter('nodes')
+    for node_id_num, entry in zip(graph.node_ids, graph.node_entries):
+        nodetext, current_node_style = render_node(
+            node_id_num, graph.entry_labels[entry], graph.entry_type(entry), compiled_config, graph.entry_groups(entry))
+        if current_node_style:
+            node_style_list.append((mermaid_node_id(node_id_num, compiled_config.compact_node_ids), current_node_style))
+            if style_classes is not None:
+                nodetext += ":::" + intern_style_class(style_classes, current_node_style)
+        yield nodetext
 
-        escaped_label = link_text_label.replace('"', '#quot;')
-        if add_label and escaped_label:
-            connector_format = LINK_LABEL_FORMATS.get(current_connector, "-- {} -->")  # Default format
-            connector_text = connector_format.format(escaped_label)
-        else:
-            connector_text = current_connector
+    # --- Process Links ---
+    if profile is not None: profile.enter('links')
+    yield "    %% Connections"
+    links_emitted = 0
 
-        linktext = f"{empty_text}{start_node_id} {connector_text} {end_node_id}"
-        mermaid_list.append(linktext)
+    for i, (link, start_entry, end_entry) in enumerate(zip(graph.links, graph.link_starts, graph.link_ends)):
+        rendered_link = render_link(link, start_entry, end_entry, graph, compiled_config, link_index=i)
+        if rendered_link is None:
+            continue
+        linktext, current_link_style_value = rendered_link
+        if current_link_style_value:
+            link_style_list.append((i, current_link_style_value))
+        links_emitted += 1
+        yield linktext
 
     # --- Process ComfyUI Groups (Subgraphs) ---
-    group_assignments = {}
-    comfy_groups = workflow.get('groups', [])
-    if generate_comfyui_subgraphs and comfy_groups and nodes:
-        for node in nodes:
-            node_id_num = node.get('id')
-            if node_id_num is None: continue
-            node_size = node.get('size')
-            nw, nh = None, None
-            if isinstance(node_size, list) and len(node_size) >= 2:
-                if all(isinstance(v, numbers.Number) for v in node_size[:2]):
-                    nw, nh = node_size[0], node_size[1]
-            elif isinstance(node_size, dict):
-                sx_key = "0" if "0" in node_size else (0 if 0 in node_size else None)
-                sy_key = "1" if "1" in node_size else (1 if 1 in node_size else None)
-                if sx_key is not None and sy_key is not None:
-                    _nw = node_size.get(sx_key)
-                    _nh = node_size.get(sy_key)
-                    if isinstance(_nw, numbers.Number) and isinstance(_nh, numbers.Number):
-                        nw, nh = _nw, _nh
-            if nw is None or nh is None or nw <= 0 or nh <= 0:
-                node_area = 0.0
-            else:
-                node_area = float(nw * nh)
-
-            best_group_index = -1
-            max_overlap = -1.0
-            for group_index, group in enumerate(comfy_groups):
-                if not isinstance(group, dict): continue
-                overlap = calculate_overlap_area(node, group)
-                if overlap > max_overlap:
-                    max_overlap = overlap
-                    best_group_index = group_index
-
-            if best_group_index != -1 and node_area > 0:
-                overlap_ratio = max_overlap / node_area
-                if overlap_ratio >= 0.4:  # Threshold
-                    if best_group_index not in group_assignments:
-                        group_assignments[best_group_index] = []
-                    group_assignments[best_group_index].append(node_id_num)
+    if profile is not None: profile.enter('subgraphs')
+    if group_assignments is None:  # Already empty if collapsing found no grouped nodes
+        group_assignments = {}
+        if compiled_config.generate_comfyui_subgraphs and comfy_groups and graph.node_count:
+            group_assignments = assign_nodes_to_comfy_groups(graph, comfy_groups)
 
     # --- Generate Mermaid Subgraph Code from ComfyUI group assignments ---
-    if group_assignments:
-        mermaid_list.append("    %% ComfyUI Groups (Subgraphs)")
-        sorted_group_indices = sorted(group_assignments.keys())
-        for group_index in sorted_group_indices:
-            assigned_node_ids = group_assignments[group_index]
-            if 0 <= group_index < len(comfy_groups):
-                group = comfy_groups[group_index]
-                if not isinstance(group, dict): continue
-                title = group.get('title', f'Group_{group_index + 1}')
-                subgraph_title = title.strip()
-                if not subgraph_title: subgraph_title = f'Group_{group_index + 1}'
-                escaped_group_title = subgraph_title.replace('"', '#quot;')
-                subtext = f'{empty_text}subgraph "{escaped_group_title}"'
-                mermaid_list.append(subtext)
-                for node_id_num in assigned_node_ids:
-                    idtext = f"{empty_text}{empty_text}N{str(node_id_num).strip()}"
-                    mermaid_list.append(idtext)
-                mermaid_list.append(empty_text + "end")
-            else:
-                print(f"Warning: Invalid group_index found while generating ComfyUI groups: {group_index}")
+    yield from iter_subgraph_lines(group_assignments, comfy_groups, compiled_config.compact_node_ids)
 
     # --- Add Style Definitions ---
-    if node_style_list or link_style_list:
-        mermaid_list.append("    %% Styling (Based on Node Type/Group/Data Type)")  # Updated comment
-        for nodestyle in node_style_list:
-            node_id = nodestyle.get('nodeid')
-            style = nodestyle.get('style')
-            if node_id and style:
-                styletext = f"{empty_text}style {node_id} {style}"
-                mermaid_list.append(styletext)
-        for linkstyle in link_style_list:
-            index = linkstyle.get('index')
-            style = linkstyle.get('style')
-            if index is not None and style:  # Allow empty string style to be applied if explicitly set
-                styletext = f"{empty_text}linkStyle {str(index).strip()} {style}"
-                mermaid_list.append(styletext)
-
-    # --- Combine Final Mermaid Code ---
-    mermaid_code = start_text
-    for mermaid_line in mermaid_list:
-        mermaid_code += "\n" + mermaid_line
+    if profile is not None: profile.enter('styles')
+    yield from iter_style_lines(node_style_list, link_style_list, compiled_config.node_style_mode, style_classes,
+                                compiled_config.link_style_mode)
+
+    if profile is not None:
+        profile.enter('join')
+        profile.count('nodes', graph.node_count)
+        profile.count('links', len(graph.link_starts))
+        profile.count('links_skipped', len(graph.link_starts) - links_emitted)
+        profile.count('node_styles', len(node_style_list))
+        profile.count('link_styles', len(link_style_list))
+        profile.count('comfy_groups', len(comfy_groups))
+        profile.count('grouped_nodes', sum(len(node_ids) for node_ids in group_assignments.values()))
+
+    _report_style_memo(memo_stats_before, profile)
+
+
+# Adds the style memo hits and misses since memo_stats_before was taken to the profile.
+def _report_style_memo(memo_stats_before, profile):
+    if memo_stats_before is not None:
+        # The memo is process-wide: concurrent conversions share these deltas
+        memo_stats = style_memo.stats()
+        profile.count('style_resolutions', memo_stats['misses'] - memo_stats_before['misses'])
+        profile.count('style_memo_hits', memo_stats['hits'] - memo_stats_before['hits'])
+
+
+# Yields the Mermaid code in newline-joined chunks of roughly chunk_size characters.
+# Concatenating the chunks gives exactly the output of workflow_to_mermaid.
+def iter_mermaid_chunks(workflow, config_param, chunk_size=65536, profile=None):
+    pending = []
+    pending_size = 0
+    separator = ""
+    for mermaid_line in iter_mermaid_lines(workflow, config_param, profile):
+        pending.append(mermaid_line)
+        pending_size += len(mermaid_line) + 1
+        if pending_size >= chunk_size:
+            yield separator + "\n".join(pending)
+            separator = "\n"
+            pending = []
+            pending_size = 0
+    if pending:
+        yield separator + "\n".join(pending)
+
+
+# Streams the Mermaid code to a text file, a binary file or a socket without building it in memory.
+# Returns the number of characters written.
+def write_mermaid(workflow, config_param, out, chunk_size=65536, encoding='utf-8', profile=None) -> int:
+    if hasattr(out, 'sendall'):
+        send = lambda chunk: out.sendall(chunk.encode(encoding))
+    elif isinstance(out, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(out, 'mode', ''):
+        send = lambda chunk: out.write(chunk.encode(encoding))
+    else:
+        send = out.write
+    written = 0
+    for chunk in iter_mermaid_chunks(workflow, config_param, chunk_size, profile):
+        send(chunk)
+        written += len(chunk)
+    if profile is not None:
+        profile.finish()
+        profile.count('output_chars', written)
+    return written
+
+
+# Converts a ComfyUI workflow JSON into a Mermaid graph definition string.
+def workflow_to_mermaid(workflow, config_param, profile=None) -> str:
+    if profile is None:
+        return "\n".join(iter_mermaid_lines(workflow, config_param))
+    mermaid_code = "\n".join(iter_mermaid_lines(workflow, config_param, profile))
+    profile.finish()
+    profile.count('output_chars', len(mermaid_code))
     return mermaid_code
 
 
@@ -442,15 +1014,10 @@ if __name__ == '__main__':
 
         if workflow_dict and isinstance(workflow_dict, dict):
             print("JSON workflow file loaded successfully for testing.")
-            # Use the global 'config' loaded earlier
-            mermaid_code_output = workflow_to_mermaid(workflow_dict, config)
-            # print("\n--- Generated Mermaid Code (for testing) ---")
-            # print(mermaid_code_output)
-            # print("--------------------------------------------\n")
-            # Save to a file for easy viewing
+            # Stream the generated code straight to a file for easy viewing
             output_mermaid_file = os.path.join(script_dir_main, "test_output.mmd")
             with open(output_mermaid_file, 'w', encoding='utf-8') as f_out:
-                f_out.write(mermaid_code_output)
+                write_mermaid(workflow_dict, get_default_config(), f_out)
             print(f"Standalone test finished. Mermaid code generated and saved to '{output_mermaid_file}'.")
 
         else:
@@ -461,6 +1028,7 @@ if __name__ == '__main__':
     except json.JSONDecodeError:
         print(f"Error: Could not parse file '{test_workflow_file_path}'. Please check if it is valid JSON format.")
     except Exception as e:
+        import traceback
         print(f"An unknown error occurred while processing the workflow file: {e}")
         traceback.print_exc()
 
@@ -0,0 +1,123 @@
+# wsgi_server.py
+# Production serving for app.py (python app.py --production): no debugger, reloader or browser.
+#
+#   - Threaded (default): one process serving requests on a fixed pool of threads, using
+#     Werkzeug's WSGI server. Works everywhere, including the packaged wf2mermaid.exe.
+#   - Pre-fork (workers > 1): gunicorn with `workers` processes of `threads` threads each.
+#     The app and its compiled config are loaded once in the master and shared by fork.
+#     Needs gunicorn (POSIX only); falls back to the threaded server when it is missing.
+#
+# Both stop accepting connections on SIGINT/SIGTERM and let in-flight requests finish
+# (up to SHUTDOWN_GRACE_SECONDS) before exiting.
+
+import concurrent.futures
+import signal
+import threading
+
+DEFAULT_THREADS = 8
+DEFAULT_WORKERS = 1
+SHUTDOWN_GRACE_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 120  # Pre-fork only: a worker stuck this long is restarted
+
+
+# --- Threaded Server ---
+def _make_pooled_server(host, port, wsgi_app, threads):
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Werkzeug's WSGI server handing each connection to a fixed pool of threads."""
+
+        multithread = True  # Sets wsgi.multithread, as ThreadedWSGIServer does
+
+        def __init__(self):
+            super().__init__(host, port, wsgi_app)
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+            self.in_flight = set()
+            self.in_flight_lock = threading.Lock()
+
+        def process_request(self, request, client_address):
+            future = self.pool.submit(self._process_request_in_pool, request, client_address)
+            with self.in_flight_lock:
+                self.in_flight.add(future)
+            future.add_done_callback(self._request_done)
+
+        def _request_done(self, future):
+            with self.in_flight_lock:
+                self.in_flight.discard(future)
+
+        def _process_request_in_pool(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        # Waits up to grace_seconds for accepted requests, then releases the pool.
+        def drain(self, grace_seconds):
+            with self.in_flight_lock:
+                pending = list(self.in_flight)
+            if pending:
+                print(f"Waiting for {len(pending)} in-flight request(s) to finish...")
+                concurrent.futures.wait(pending, timeout=grace_seconds)
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    return PooledWSGIServer()
+
+
+def _install_shutdown_handlers(stop):
+    def handle_signal(signum, frame):  # pylint: disable=unused-argument
+        print(f"Received signal {signum}, shutting down gracefully...")
+        # server.shutdown() blocks until serve_forever() returns, so it cannot run in the serving thread
+        threading.Thread(target=stop, daemon=True).start()
+
+    for signal_name in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), handle_signal)
+
+
+def serve_threaded(wsgi_app, host, port, threads=DEFAULT_THREADS, on_shutdown=None):
+    server = _make_pooled_server(host, port, wsgi_app, threads)
+    _install_shutdown_handlers(server.shutdown)
+    print(f"Serving on http://{host}:{port} with {threads} thread(s) (production mode).")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()  # Stop accepting new connections
+        server.drain(SHUTDOWN_GRACE_SECONDS)
+        if on_shutdown is not None:
+            on_shutdown()
+        print("Server stopped.")
+
+
+# --- Pre-fork Server ---
+def serve_prefork(wsgi_app, host, port, workers, threads=DEFAULT_THREADS, on_shutdown=None):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("Warning: gunicorn is not installed (pip install gunicorn; not available on Windows). "
+              f"Serving with one process and {threads} thread(s) instead of {workers} workers.")
+        return serve_threaded(wsgi_app, host, port, threads, on_shutdown)
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        "preload_app": True,  # Workers are forked from a master that already loaded the app
+        "graceful_timeout": SHUTDOWN_GRACE_SECONDS,  # SIGTERM: finish in-flight requests first
+        "timeout": REQUEST_TIMEOUT_SECONDS,
+    }
+    if on_shutdown is not None:
+        options["worker_exit"] = lambda arbiter, worker: on_shutdown()
+
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return wsgi_app
+
+    print(f"Serving on http://{host}:{port} with {workers} worker process(es) x {threads} thread(s) (production mode).")
+    PreforkApplication().run()  # Exits the process when the master stops